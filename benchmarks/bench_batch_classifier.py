@@ -0,0 +1,180 @@
+"""
+Calls, tokens and wall time of per-message vs. batched sensitivity classification.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_batch_classifier                  # simulated API
+    python -m benchmarks.bench_batch_classifier --live -n 40     # real API (needs OPENAI_API_KEY)
+
+The simulated API charges a fixed round trip plus a per-token generation
+time and counts tokens as ~4 characters each, which is enough to compare
+request overhead; use --live for real numbers.
+"""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import random
+import time
+import types
+
+from shared.batch_classifier import BatchClassifier, parse_detection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MESSAGES = [
+    "My name is Sarah, and I live in San Francisco. My birthday is May 3rd.",
+    "I've been feeling anxious lately and having trouble sleeping. What should I do?",
+    "What's a good recipe for banana bread?",
+    "I earn about $75,000 a year, and my credit score is around 680. Can I afford a new car?",
+    "Can you explain how photosynthesis works?",
+    "I have diabetes and take insulin regularly. Are there foods I should avoid?",
+    "Write a haiku about autumn leaves.",
+    "I often visit the Starbucks on Main Street after work around 6 PM.",
+]
+
+
+def load_constant(filename, name):
+    """Read a literal module-level constant from a chatbot script without importing it"""
+    with open(os.path.join(ROOT, filename), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], "id", None) == name:
+            return ast.literal_eval(node.value)
+    raise RuntimeError(f"{name} not found in {filename}")
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class SimulatedCompletions:
+    """Stands in for chat.completions: fixed latency plus per-token generation time"""
+
+    def __init__(self, round_trip, per_token, malformed, rng):
+        self.round_trip = round_trip
+        self.per_token = per_token
+        self.malformed = malformed
+        self.rng = rng
+
+    def _result(self):
+        return {
+            "sensitivity_level": self.rng.choice(["non-sensitive", "sensitive", "very-sensitive"]),
+            "flagged_items": [],
+            "reason": "simulated classification rationale"
+        }
+
+    async def create(self, model, messages, **kwargs):
+        prompt = "".join(m["content"] for m in messages)
+        user = messages[-1]["content"]
+        try:
+            items = json.loads(user)["items"]
+            results = []
+            for item in items:
+                # Occasionally drop or corrupt an item to exercise split-and-retry
+                roll = self.rng.random()
+                if roll < self.malformed / 2:
+                    continue
+                result = {"id": item["id"], **self._result()}
+                if roll < self.malformed:
+                    result["sensitivity_level"] = "unknown"
+                results.append(result)
+            content = json.dumps({"results": results})
+        except (ValueError, KeyError, TypeError):
+            content = json.dumps(self._result())
+
+        completion_tokens = count_tokens(content)
+        await asyncio.sleep(self.round_trip + completion_tokens * self.per_token)
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))],
+            usage=types.SimpleNamespace(prompt_tokens=count_tokens(prompt), completion_tokens=completion_tokens)
+        )
+
+
+class SimulatedClient:
+    def __init__(self, **kwargs):
+        self.chat = types.SimpleNamespace(completions=SimulatedCompletions(**kwargs))
+
+
+async def per_message(get_client, model, system_prompt, texts, concurrency):
+    """The existing path: one request per message"""
+    stats = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "failed_items": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def classify(text):
+        async with semaphore:
+            stats["requests"] += 1
+            response = await get_client().chat.completions.create(
+                model=model,
+                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": text}],
+                temperature=0.2,
+                response_format={"type": "json_object"}
+            )
+        stats["prompt_tokens"] += response.usage.prompt_tokens
+        stats["completion_tokens"] += response.usage.completion_tokens
+        if parse_detection(json.loads(response.choices[0].message.content)) is None:
+            stats["failed_items"] += 1
+
+    await asyncio.gather(*(classify(text) for text in texts))
+    return stats
+
+
+async def batched(classifier, texts, concurrency):
+    """The new path: BatchClassifier, one batch per request, same concurrency limit"""
+    await classifier.classify(texts, asyncio.Semaphore(concurrency))
+    return classifier.stats
+
+
+def report(label, stats, elapsed):
+    print(
+        f"{label:>14} {stats['requests']:>9} {stats['prompt_tokens']:>14} "
+        f"{stats['completion_tokens']:>17} {elapsed:>9.2f} {stats.get('failed_items', 0):>7}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--messages", type=int, default=200, help="Number of messages")
+    parser.add_argument("--batch-sizes", default="5,10,20", help="Comma-separated batch sizes")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--round-trip", type=float, default=0.4, help="Simulated seconds per request")
+    parser.add_argument("--per-token", type=float, default=0.01, help="Simulated seconds per output token")
+    parser.add_argument("--malformed", type=float, default=0.02, help="Simulated share of bad items")
+    parser.add_argument("--live", action="store_true", help="Call the real API")
+    args = parser.parse_args()
+
+    filename = "chatbot#3_private_history_highlighter_bini.py"
+    model = load_constant(filename, "DETECTION_MODEL")
+    system_prompt = load_constant(filename, "DETECTION_SYSTEM_PROMPT")
+    rng = random.Random(42)
+    # Distinct texts, so batching gains nothing from de-duplication
+    texts = [f"{rng.choice(MESSAGES)} (#{i})" for i in range(args.messages)]
+
+    if args.live:
+        from shared.openai_pool import get_async_client
+        get_client = get_async_client
+    else:
+        client = SimulatedClient(
+            round_trip=args.round_trip, per_token=args.per_token, malformed=args.malformed, rng=rng
+        )
+
+        def get_client():
+            return client
+
+    mode = "live" if args.live else "simulated"
+    print(f"{len(texts)} messages, concurrency {args.concurrency}, {mode} API ({model})")
+    print(f"{'path':>14} {'requests':>9} {'prompt tokens':>14} {'completion tokens':>17} {'wall s':>9} {'failed':>7}")
+
+    start = time.perf_counter()
+    stats = await per_message(get_client, model, system_prompt, texts, args.concurrency)
+    report("per-message", stats, time.perf_counter() - start)
+
+    for size in [int(s) for s in args.batch_sizes.split(",")]:
+        classifier = BatchClassifier(model, system_prompt, batch_size=size, get_client=get_client)
+        start = time.perf_counter()
+        stats = await batched(classifier, texts, args.concurrency)
+        report(f"batch of {size}", stats, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
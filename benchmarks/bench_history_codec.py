@@ -0,0 +1,182 @@
+"""
+Item size, DynamoDB capacity units and CPU time of the history codecs.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_history_codec
+    python -m benchmarks.bench_history_codec --sizes 100 1000 5000
+
+Transcripts mimic what the chatbots store: chatbot#4 user messages carry a
+PII audit (original text, removed items, the user's choice) and chatbot#7
+user messages a privacy_check payload with detection timings; replies are
+a few hundred words. Each session is packed with shared.history_codec the
+way the write-behind writer saves it.
+
+WCU are per save (1 KB units per item written, row plus chunks); RCU are
+per strongly consistent read of the row and its chunks (4 KB units). Item
+sizes follow DynamoDB's rules: attribute names plus UTF-8 strings, binary
+lengths and ~1 byte per two digits of a number. zstd is reported only when
+zstandard is installed. The json codec always writes the history inline,
+so its rows past 400 KB show what DynamoDB would reject.
+"""
+import argparse
+import math
+import random
+import time
+from decimal import Decimal
+
+from shared import history_codec
+from shared.history_codec import HistoryCodec
+from shared.message_model import Message, Role, encode_history
+
+WORDS = (
+    "the a to of and in is it you that for on with as this be are your can or if not at by an have from "
+    "will more about which when there their one all also time may use some other into only these need "
+    "privacy data information personal message account health income address email phone number bank "
+    "credit card insurance doctor symptoms medication family children school work job salary tax loan "
+    "travel flight hotel booking recipe cooking exercise sleep stress anxiety budget savings investment "
+    "recommend suggest consider important example step first second finally however because therefore"
+).split()
+PII = {
+    "name": ["Sarah Chen", "Michael Brown", "Priya Patel"],
+    "location": ["San Francisco", "1423 Oak Street", "Boston, MA"],
+    "contact": ["sarah.chen@example.com", "(415) 555-0134"],
+    "financial": ["$75,000", "credit score 680", "Chase checking"],
+    "health": ["type 2 diabetes", "insulin", "anxiety"]
+}
+CATEGORIES = ["financial", "identity", "history", "family", "location", "social", "preferences", "health", "other"]
+TIMESTAMP = "2025-04-14T12:00:00.000000+00:00"
+
+
+def sentence(rng, words):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def paragraph(rng, sentences):
+    return " ".join(sentence(rng, rng.randint(8, 20)) for _ in range(sentences))
+
+
+def pii_user_message(rng):
+    """chatbot#4: a rewritten message with its removed PII and the user's choice"""
+    removed = {kind: rng.sample(values, rng.randint(1, len(values))) for kind, values in rng.sample(sorted(PII.items()), 2)}
+    original = paragraph(rng, 2) + " " + " ".join(v for values in removed.values() for v in values)
+    return Message(Role.USER, paragraph(rng, 2), timestamp=TIMESTAMP, metadata={
+        "original": original,
+        "revised": paragraph(rng, 2),
+        "removed_pii": removed,
+        "user_choice": rng.choice(["accept", "reject"])
+    })
+
+
+def privacy_user_message(rng):
+    """chatbot#7: a message with the slider check result and its timings"""
+    detected = [
+        {"category": rng.choice(CATEGORIES), "text": rng.choice(PII[kind]), "level": rng.randint(1, 10),
+         "reason": sentence(rng, 10)}
+        for kind in rng.sample(sorted(PII), rng.randint(0, 3))
+    ]
+    return Message(Role.USER, paragraph(rng, 2), timestamp=TIMESTAMP, privacy_check={
+        "detected_items": detected,
+        "exceeded_items": detected[:1],
+        "exceeded": bool(detected),
+        "timing": {"pattern_ms": round(rng.uniform(0.2, 2), 2), "ai_ms": round(rng.uniform(300, 1500), 2),
+                   "total_ms": round(rng.uniform(300, 1600), 2), "early_exit": False}
+    })
+
+
+def make_history(n, rng):
+    history = []
+    while len(history) < n:
+        make_user = pii_user_message if rng.random() < 0.5 else privacy_user_message
+        history.append(make_user(rng))
+        history.append(Message(Role.ASSISTANT, paragraph(rng, rng.randint(6, 16)), timestamp=TIMESTAMP))
+    return history[:n]
+
+
+def value_size(value):
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        return math.ceil(len(str(value).lstrip("-").replace(".", "")) / 2) + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode("utf-8")) + value_size(v) + 1 for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(value_size(v) + 1 for v in value)
+    raise TypeError(type(value))
+
+
+def item_size(item):
+    """Approximate DynamoDB item size in bytes"""
+    return sum(len(name.encode("utf-8")) + value_size(value) for name, value in item.items())
+
+
+def row_for(session_id):
+    """A chat_history row's non-history attributes, as chatbot#4 writes them"""
+    return {
+        "user_id": "researcher-01",
+        "session_id": session_id,
+        "timestamp": TIMESTAMP,
+        "user_action": "none",
+        "metadata": {"sensitive_operations": 12, "last_modified": TIMESTAMP}
+    }
+
+
+class ChunkTable:
+    """In-memory stand-in for the chunk table: returns the chunks of the last pack()"""
+
+    def __init__(self):
+        self.items = []
+
+    def query(self, **kwargs):
+        return {"Items": self.items}
+
+
+def best_of(fn, repeats=5):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 200, 1_000, 3_000], help="Messages per session")
+    args = parser.parse_args()
+
+    codecs = ["json", "gzip"] + (["zstd"] if history_codec.zstandard is not None else [])
+    rng = random.Random(42)
+    print(f"codecs: {', '.join(codecs)} (inline up to {history_codec.MAX_INLINE_BYTES // 1024} KB, "
+          f"chunks of {history_codec.CHUNK_BYTES // 1024} KB)")
+    print(f"{'messages':>9} {'codec':>6} {'row KB':>8} {'chunks':>7} {'WCU':>6} {'RCU':>6} "
+          f"{'WCU saved':>10} {'pack ms':>8} {'read ms':>8}")
+    for n in args.sizes:
+        history = make_history(n, rng)
+        history_json = encode_history(history)
+        expected = [msg.to_dict() for msg in history]
+        baseline_wcu = None
+        for name in codecs:
+            chunk_table = ChunkTable()
+            codec = HistoryCodec(chunk_table=chunk_table, codec=name)
+            row, chunks = codec.pack(row_for("s"), history_json)
+            chunk_table.items = chunks
+            sizes = [item_size(row)] + [item_size(chunk) for chunk in chunks]
+            wcu = sum(math.ceil(size / 1024) for size in sizes)
+            # The row is a GetItem; chunks come back in one Query, rounded up once
+            rcu = math.ceil(sizes[0] / 4096) + (math.ceil(sum(sizes[1:]) / 4096) if chunks else 0)
+            baseline_wcu = baseline_wcu or wcu
+
+            assert codec.read(row) == expected
+            pack = best_of(lambda: codec.pack(row_for("s"), history_json))
+            read = best_of(lambda: codec.read(row))
+            print(f"{n:>9} {name:>6} {sizes[0] / 1024:>8.1f} {len(chunks):>7} {wcu:>6} {rcu:>6} "
+                  f"{baseline_wcu / wcu:>9.1f}x {pack * 1e3:>8.2f} {read * 1e3:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Encode/decode time of chat histories: stdlib json vs. shared.json_codec.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_json_codec
+
+Histories of 10 to 10,000 messages are encoded the way save_to_dynamodb
+used to (json.dumps(history, ensure_ascii=False)) and with the codec, then
+decoded both ways. Times are the best of several runs.
+"""
+import json
+import random
+import time
+
+from shared import json_codec
+from shared.message_model import decode_history, encode_history
+
+SIZES = [10, 100, 1_000, 10_000]
+
+TEXTS = [
+    "My name is Sarah, and I live in San Francisco. My birthday is May 3rd.",
+    "I've been feeling anxious lately and having trouble sleeping. What should I do?",
+    "What's a good recipe for banana bread?",
+    "我最近在找工作，月薪大概两万左右，住在上海浦东。",
+    "Sure! Here is a short overview of the main steps involved, one at a time.",
+]
+
+
+def make_history(n, rng):
+    history = []
+    for i in range(n):
+        msg = {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": rng.choice(TEXTS),
+            "timestamp": "2025-04-14T12:%02d:%02d.%06d+00:00" % (i // 60 % 60, i % 60, rng.randrange(10**6))
+        }
+        if i % 2 == 0:
+            msg["sensitivity"] = {"level": rng.choice(["non-sensitive", "sensitive"]), "items": [], "reason": ""}
+            msg["hash"] = "%064x" % rng.getrandbits(256)
+        history.append(msg)
+    return history
+
+
+def best_of(fn, total_work):
+    repeats = max(3, 200_000 // total_work)
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn()
+        best = min(best, (time.perf_counter() - start) / repeats)
+    return best
+
+
+def main():
+    rng = random.Random(42)
+    print(f"codec backend: {json_codec.BACKEND}")
+    print(f"{'messages':>9} {'KB':>8} {'dumps us':>10} {'codec us':>10} {'x':>6} "
+          f"{'loads us':>10} {'codec us':>10} {'x':>6} {'Message enc/dec us':>20}")
+    for n in SIZES:
+        history = make_history(n, rng)
+        text = json.dumps(history, ensure_ascii=False)
+        assert json_codec.loads(json_codec.dumps(history)) == history == json_codec.loads(text)
+        messages = decode_history(text)
+
+        dumps = best_of(lambda: json.dumps(history, ensure_ascii=False), n)
+        codec_dumps = best_of(lambda: json_codec.dumps(history), n)
+        loads = best_of(lambda: json.loads(text), n)
+        codec_loads = best_of(lambda: json_codec.loads(text), n)
+        encode = best_of(lambda: encode_history(messages), n)
+        decode = best_of(lambda: decode_history(text), n)
+        print(
+            f"{n:>9} {len(text.encode()) / 1024:>8.1f} "
+            f"{dumps * 1e6:>10.1f} {codec_dumps * 1e6:>10.1f} {dumps / codec_dumps:>5.1f}x "
+            f"{loads * 1e6:>10.1f} {codec_loads * 1e6:>10.1f} {loads / codec_loads:>5.1f}x "
+            f"{encode * 1e6:>9.1f} / {decode * 1e6:<9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Memory and speed of dict-per-message histories vs. slotted Message objects.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_message_model            # 10k-message session
+    python -m benchmarks.bench_message_model -n 50000
+
+Each history mixes the message shapes the chatbots store: user messages
+with a chatbot#2 sensitivity result and hash, assistant replies, and the
+occasional system warning. Memory is what tracemalloc sees still allocated
+after decoding the stored JSON into each form; times are the best of
+several runs. Both sides use shared.json_codec for the JSON itself.
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+from shared import json_codec
+from shared.message_model import Kind, Message, Role, decode_history, encode_history
+
+TEXTS = [
+    "My name is Sarah, and I live in San Francisco. My birthday is May 3rd.",
+    "What's a good recipe for banana bread?",
+    "I earn about $75,000 a year, and my credit score is around 680.",
+    "Can you explain how photosynthesis works?",
+    "Sure! Here is a short overview of the main steps involved.",
+]
+TIMESTAMP = "2025-04-14T12:00:00.000000+00:00"
+
+
+def make_dicts(n, rng):
+    """A history as the apps built it before: one dict per message"""
+    history = []
+    while len(history) < n:
+        level = rng.choice(["non-sensitive", "non-sensitive", "sensitive"])
+        history.append({
+            "role": "user",
+            "content": rng.choice(TEXTS),
+            "timestamp": TIMESTAMP,
+            "sensitivity": {"level": level, "items": [], "reason": ""},
+            "hash": "%064x" % rng.getrandbits(256)
+        })
+        if level != "non-sensitive":
+            history.append({
+                "role": "system",
+                "content": "⚠️ Detected sensitive level sensitive information: income",
+                "timestamp": TIMESTAMP
+            })
+        history.append({"role": "assistant", "content": rng.choice(TEXTS), "timestamp": TIMESTAMP})
+    return history[:n]
+
+
+def to_messages(dicts):
+    """The same history as Message objects, built through the constructor"""
+    messages = []
+    for d in dicts:
+        kind = Kind.SENSITIVITY_WARNING if d["role"] == "system" else Kind.CHAT
+        messages.append(Message(
+            d["role"], d["content"], kind=kind, timestamp=d["timestamp"],
+            sensitivity=d.get("sensitivity"), hash=d.get("hash")
+        ))
+    return messages
+
+
+def allocated(build):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return result, size
+
+
+def best_of(fn, repeats=5):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=10_000, help="Messages per session")
+    args = parser.parse_args()
+
+    dicts = make_dicts(args.n, random.Random(42))
+    messages = to_messages(dicts)
+    assert messages == decode_history(json.dumps(dicts, ensure_ascii=False))
+    assert json.loads(encode_history(messages)) == [m.to_dict() for m in messages]
+    encoded = json.dumps(dicts, ensure_ascii=False)
+
+    # Both decode the same JSON, so strings and nested dicts cost the same;
+    # the difference is the per-message container
+    _, dict_bytes = allocated(lambda: json_codec.loads(encoded))
+    _, message_bytes = allocated(lambda: decode_history(encoded))
+    nested = sum(1 for d in dicts if "sensitivity" in d)
+
+    timings = [
+        ("encode", lambda: json_codec.dumps(dicts), lambda: encode_history(messages)),
+        ("decode", lambda: json_codec.loads(encoded), lambda: decode_history(encoded)),
+        ("flagged warnings",
+         lambda: [d for d in dicts if d["role"] == "system" and "⚠️" in d["content"]],
+         lambda: [m for m in messages if m.kind is Kind.SENSITIVITY_WARNING]),
+        ("user contents",
+         lambda: [d["content"] for d in dicts if d["role"] == "user"],
+         lambda: [m.content for m in messages if m.role is Role.USER]),
+    ]
+
+    print(f"{args.n} messages ({nested} with a nested sensitivity dict), {len(encoded) / 1e6:.2f} MB of JSON")
+    print(f"{'memory':<18} {'dicts':>10} {'Message':>10}")
+    print(f"{'  total KB':<18} {dict_bytes / 1024:>10.0f} {message_bytes / 1024:>10.0f}")
+    print(f"{'  bytes/message':<18} {dict_bytes / args.n:>10.0f} {message_bytes / args.n:>10.0f}")
+    print(f"{'time (ms)':<18} {'dicts':>10} {'Message':>10} {'ratio':>8}")
+    for name, baseline, slotted in timings:
+        base, new = best_of(baseline), best_of(slotted)
+        print(f"{'  ' + name:<18} {base * 1e3:>10.2f} {new * 1e3:>10.2f} {new / base:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
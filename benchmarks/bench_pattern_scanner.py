@@ -0,0 +1,98 @@
+"""
+Throughput of the per-pattern regex loop vs. the merged SensitivePatternScanner.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_pattern_scanner
+"""
+import ast
+import os
+import random
+import re
+import time
+
+from shared.pattern_scanner import SensitivePatternScanner
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIZES = [100, 1_000, 10_000, 100_000]
+
+FILLER_WORDS = (
+    "the a quick brown fox jumps over lazy dog I am wondering what to cook for "
+    "dinner tonight and whether it will rain this weekend please help me plan"
+).split()
+
+SENSITIVE_SNIPPETS = [
+    "My name is Sarah, and I live in San Francisco. My birthday is May 3rd.",
+    "I've been feeling anxious lately and having trouble sleeping.",
+    "I earn about $75,000 a year, and my credit score is 680.",
+    "Call me at (206) 555-1234 or email sarah.k@example.com.",
+    "My SSN is 123-45-6789 and I live at 12 Main Street Seattle WA 98105.",
+]
+
+
+def load_patterns(filename):
+    """Read SENSITIVE_PATTERNS from a chatbot script without importing it"""
+    with open(os.path.join(ROOT, filename), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], "id", None) == "SENSITIVE_PATTERNS":
+            return ast.literal_eval(node.value)
+    raise RuntimeError(f"SENSITIVE_PATTERNS not found in {filename}")
+
+
+def legacy_detect(patterns, text):
+    """The original detect_sensitive_info_patterns loop"""
+    detected_items = []
+    for name, (pattern, category, score) in patterns.items():
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            detected_items.append({
+                "type": name,
+                "category": category,
+                "score": score,
+                "match": match.group()
+            })
+    return detected_items
+
+
+def make_message(size, rng):
+    """Build a message of `size` chars with a sensitive snippet roughly every 500 chars"""
+    parts = []
+    length = 0
+    while length < size:
+        if rng.random() < 0.02:
+            piece = rng.choice(SENSITIVE_SNIPPETS)
+        else:
+            piece = rng.choice(FILLER_WORDS)
+        parts.append(piece)
+        length += len(piece) + 1
+    return " ".join(parts)[:size]
+
+
+def time_per_call(fn, text):
+    repeats = max(3, 300_000 // len(text))
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(text)
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    patterns = load_patterns("chatbot#7_slider_hongfan.py")
+    scanner = SensitivePatternScanner(patterns)
+    rng = random.Random(42)
+
+    print(f"{len(patterns)} patterns")
+    print(f"{'size':>8} {'legacy us':>12} {'scanner us':>12} {'legacy MB/s':>12} {'scanner MB/s':>13} {'speedup':>8}")
+    for size in SIZES:
+        text = make_message(size, rng)
+        assert legacy_detect(patterns, text) == scanner.scan(text)
+        legacy = time_per_call(lambda t: legacy_detect(patterns, t), text)
+        merged = time_per_call(scanner.scan, text)
+        print(
+            f"{size:>8} {legacy * 1e6:>12.1f} {merged * 1e6:>12.1f} "
+            f"{size / legacy / 1e6:>12.2f} {size / merged / 1e6:>13.2f} {legacy / merged:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,23 @@
 import gradio as gr
 import uuid
 from datetime import datetime
-from openai import OpenAI
-import os
+from shared.openai_pool import close_clients_threadsafe, warm_up
+from shared.session_store import create_session_store
+from shared.streaming import stream_completion
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OpenAI calls share one pooled AsyncOpenAI client (see shared/openai_pool.py)
 
 # ========== Storage ==========
-archived_sessions = []
-active_sessions = {}
+# Set SESSION_STORE_URL to share these across workers (see shared/session_store.py).
+# Active sessions are transient and so bounded and expiring; archives are kept
+# because the user chose to keep them, so they are never evicted.
+archived_sessions = create_session_store("chatbot1_archived_sessions", maxsize=None, ttl=None)
+active_sessions = create_session_store("chatbot1_active_sessions")
 
 # ========== Utils ==========
 def convert_to_storage_format(gradio_history):
@@ -35,25 +39,22 @@ def convert_to_gradio_format(storage_history):
     return gradio_history
 
 # ========== Chat Logic ==========
-def process_message(msg, chat_history, session_id):
-    """Send message to LLM and store history."""
+async def process_message(msg, chat_history, session_id):
+    """Send message to LLM, stream the reply and store history."""
     history = convert_to_storage_format(chat_history)
     messages = [{"role": "system", "content": "You are a helpful assistant."}] + history
     messages.append({"role": "user", "content": msg})
 
+    chat_history.append((msg, ""))
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.7
-        )
-        bot_reply = response.choices[0].message.content
+        async for bot_reply in stream_completion(messages, model="gpt-3.5-turbo", label="chatbot#1 reply"):
+            chat_history[-1] = (msg, bot_reply)
+            yield chat_history, session_id
     except Exception as e:
-        bot_reply = f"Error: {e}"
+        chat_history[-1] = (msg, f"Error: {e}")
 
-    chat_history.append((msg, bot_reply))
     active_sessions[session_id] = convert_to_storage_format(chat_history)
-    return chat_history, session_id
+    yield chat_history, session_id
 
 # ========== Deletion Logic ==========
 def handle_decision(choice, session_id):
@@ -64,21 +65,22 @@ def handle_decision(choice, session_id):
         active_sessions.pop(session_id, None)
         return [], str(uuid.uuid4()), gr.update(visible=False)
     elif choice == "archive":
-        archived_sessions.append({
+        archived_sessions[session_id] = {
             "session_id": session_id,
             "timestamp": datetime.now().isoformat(),
             "history": history
-        })
+        }
         active_sessions.pop(session_id, None)
         return [], str(uuid.uuid4()), gr.update(visible=False)
     else:  # retain
         return chat_history, session_id, gr.update(visible=False)
 
 def show_archived():
-    if not archived_sessions:
+    archived = sorted(archived_sessions.values(), key=lambda item: item["timestamp"])
+    if not archived:
         return "No archived sessions found."
     output = ""
-    for item in archived_sessions:
+    for item in archived:
         output += f"\nSession ID: {item['session_id']} ({item['timestamp']})\n"
         for msg in convert_to_gradio_format(item['history']):
             output += f"User: {msg[0]}\nAssistant: {msg[1]}\n"
@@ -107,6 +109,9 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
 
     archive_text = gr.Textbox(label="Archived Chats", lines=15, visible=False)
 
+    # Open the OpenAI connection pool before the first message
+    demo.load(warm_up)
+
     # Event bindings
     submit.click(
         process_message,
@@ -128,4 +133,12 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         [archive_text]
     )
 
-demo.launch(server_name="0.0.0.0", server_port=7860, share=True)
\ No newline at end of file
+if __name__ == "__main__":
+    demo.launch(server_name="0.0.0.0", server_port=7860, share=True, prevent_thread_lock=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        # Close the pooled OpenAI connections while the server's event loop still runs
+        close_clients_threadsafe()
+        demo.close()
@@ -1,210 +1,250 @@
 import gradio as gr
-import boto3
 import uuid
 import json
-import openai
 from datetime import datetime, timezone
 import os
-import asyncio
+import time
 from dotenv import load_dotenv
 import hashlib
+from shared.batch_classifier import BATCH_INSTRUCTIONS, BatchClassifier, confine_to_text
+from shared.chat_log import ChatLog
+from shared.detection_cache import DetectionCache
+from shared.history_codec import CHUNK_TABLE_NAME, HistoryCodec
+from shared.message_model import Kind, Message, Role
+from shared.message_store import MESSAGE_TABLE_NAME, MessageStore
+from shared.micro_batcher import MicroBatcher
+from shared.openai_pool import close_clients_threadsafe, get_async_client, warm_up
+from shared.session_store import create_session_store
+from shared.storage_pool import get_storage_pool
+from shared.streaming import BufferedStream, stream_completion
+from shared.write_behind import WriteBehindWriter
 
 # Load environment variables
 load_dotenv()
 
-# Initialize AWS DynamoDB
-session = boto3.Session(region_name=os.getenv("AWS_REGION"))
-dynamodb_resource = session.resource("dynamodb")
-table = dynamodb_resource.Table("chat_history")
+# Initialize AWS DynamoDB: calls run on a dedicated thread pool with a
+# boto3 resource per thread (see shared/storage_pool.py)
+storage = get_storage_pool()
+table = storage.table("chat_history")
+message_store = MessageStore(storage.table(MESSAGE_TABLE_NAME))
+history_writer = WriteBehindWriter(table, message_store, HistoryCodec(storage.table(CHUNK_TABLE_NAME)))
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OpenAI calls share one pooled AsyncOpenAI client (see shared/openai_pool.py);
+# being async also lets a speculative reply really be cancelled
 
 # ================= Enhanced Data Structures =================
-def convert_to_gradio_format(history):
-    """Convert storage format to Gradio display format"""
-    gradio_history = []
-    for msg in history:
-        if msg["role"] == "user":
-            display_content = msg["content"]
-            if "sensitivity" in msg:
-                display_content += f"\n🔒Sensitivity Level: {msg['sensitivity']['level'].upper()}"
-            gradio_history.append((display_content, None))
-        elif msg["role"] == "assistant":
-            if gradio_history and gradio_history[-1][1] is None:
-                gradio_history[-1] = (gradio_history[-1][0], msg["content"])
-            else:
-                gradio_history.append((None, msg["content"]))
-        elif msg["role"] == "system":
-            gradio_history.append((None, msg["content"]))
-    return gradio_history
+def format_user_message(msg):
+    """Display text of a user message, with its sensitivity level"""
+    display_content = msg.content
+    if msg.sensitivity is not None:
+        display_content += f"\n🔒Sensitivity Level: {msg.sensitivity['level'].upper()}"
+    return display_content
 
-def convert_to_storage_format(gradio_history):
-    """Convert Gradio format to storage format"""
-    storage_history = []
-    for user_msg, bot_msg in gradio_history:
-        if user_msg:
-            sensitivity = {}
-            if "🔒Sensitivity Level:" in user_msg:
-                content, sensitivity_part = user_msg.split("\n🔒Sensitivity Level:")
-                sensitivity = {"level": sensitivity_part.strip().lower()}
-            else:
-                content = user_msg
-            
-            storage_history.append({
-                "role": "user",
-                "content": content,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                **({"sensitivity": sensitivity} if sensitivity else {})
-            })
-        
-        if bot_msg:
-            storage_history.append({
-                "role": "system" if "⚠️" in bot_msg else "assistant",
-                "content": bot_msg,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
-    return storage_history
+def new_chat_log():
+    return ChatLog(format_user=format_user_message)
 
 # ================= Privacy Handling Module =================
 class PrivacyManager:
     def __init__(self):
-        self.pending_actions = {}  # {session_id: {message: ..., detection: ...}}
+        # {session_id: {message: ..., detection: ...}}; bounded and expiring, see shared/session_store.py
+        self.pending_actions = create_session_store("chatbot2_pending_actions")
 
     def generate_message_hash(self, message):
         return hashlib.sha256(message.encode()).hexdigest()
 
 privacy_manager = PrivacyManager()
 
-async def detect_sensitive_info(text):
+DETECTION_MODEL = "gpt-4o-2024-08-06"
+DETECTION_SYSTEM_PROMPT = (
+    "Analyze text for sensitive information "
+    "Consider the following examples:\n"
+    "1. Personal Information Disclosure: “My name is Sarah, and I live in San Francisco. My birthday is May 3rd.”\n"
+    "2. Sensitive Topic Exploration: “I've been feeling anxious lately and having trouble sleeping. What should I do?”\n"
+    "3. Ethical Question: “I saw my coworker stealing small items from the office. Should I report it?”\n"
+    "4. Family/Social Information: “Here is a text exchange I had with my partner last week. Am I in the wrong?”\n"
+    "5. Medical Data: “I have diabetes and take insulin regularly. Are there foods I should avoid?”\n"
+    "6. Professional Information: “I'm frustrated at work. My manager at XYZ Corp doesn't appreciate my efforts.”\n"
+    "7. Future Plans: “I'm thinking about taking a long vacation next month. What's a good place to travel?”\n"
+    "8. Financial Information: “I earn about $75,000 a year, and my credit score is around 680. Can I afford a new car?”\n"
+    "9. Location Information: “I often visit the Starbucks on Main Street after work around 6 PM.”\n"
+    "10. Political Ideology: “I voted for [candidate or party], but lately I’m reconsidering because of recent policies.”\n\n"
+    "Return a JSON object with the following keys:\n"
+    '{"sensitivity_level": "non-sensitive/sensitive/very-sensitive", "flagged_items": ["detected sensitive content"], "reason": "classification rationale"}'
+)
+# Changes whenever the prompt text (or the batch instructions) is edited, so
+# stale cache entries are never served
+DETECTION_PROMPT_VERSION = hashlib.sha256((DETECTION_SYSTEM_PROMPT + BATCH_INSTRUCTIONS).encode()).hexdigest()[:12]
+
+# Repeated messages (and the canned example prompts) skip the GPT-4o call.
+# Set DETECTION_CACHE_DB to a file path to keep the cache across restarts.
+detection_cache = DetectionCache(
+    maxsize=int(os.getenv("DETECTION_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("DETECTION_CACHE_TTL", str(7 * 24 * 3600))),
+    sqlite_path=os.getenv("DETECTION_CACHE_DB")
+)
+
+# Detections from concurrent sessions that arrive within the window share one
+# batched request; DETECTION_BATCH_WINDOW_MS=0 sends every message on its own
+DETECTION_BATCH_WINDOW_MS = float(os.getenv("DETECTION_BATCH_WINDOW_MS", "20"))
+DETECTION_BATCH_SIZE = int(os.getenv("DETECTION_BATCH_SIZE", "16"))
+detection_batcher = MicroBatcher(
+    BatchClassifier(DETECTION_MODEL, DETECTION_SYSTEM_PROMPT, batch_size=DETECTION_BATCH_SIZE).classify,
+    max_batch=DETECTION_BATCH_SIZE,
+    window_ms=DETECTION_BATCH_WINDOW_MS,
+    name="detection batcher",
+    check_result=confine_to_text
+) if DETECTION_BATCH_WINDOW_MS > 0 else None
+
+# Shown when a detection has no reason of its own: detections batched with
+# other sessions' messages don't carry one, since it could quote them
+LEVEL_WARNINGS = {
+    "sensitive": "this message may contain personal information",
+    "very-sensitive": "this message appears to contain highly personal information"
+}
+
+async def request_detection(text, session_id=None):
+    """Classify one message (batched with other sessions if enabled); raises on failure"""
+    if detection_batcher is not None:
+        detection = await detection_batcher.submit(text, owner=session_id)
+        if detection is None:
+            raise ValueError("no valid result for this message in the batched response")
+        return detection
+
+    response = await get_async_client().chat.completions.create(
+        model=DETECTION_MODEL,
+        messages=[{
+            "role": "system",
+            "content": DETECTION_SYSTEM_PROMPT
+        }, {
+            "role": "user", 
+            "content": text
+        }],
+        temperature=0.2,
+        response_format={"type": "json_object"}
+    )
+    result = json.loads(response.choices[0].message.content)
+    return {
+        "level": result["sensitivity_level"],
+        "items": result.get("flagged_items", []),
+        "reason": result.get("reason", "")
+    }
+
+async def detect_sensitive_info(text, message_hash=None, session_id=None):
+    if message_hash:
+        cached = await detection_cache.get(message_hash, DETECTION_MODEL, DETECTION_PROMPT_VERSION)
+        if cached is not None:
+            print("Detection cache hit:", detection_cache.stats())
+            return cached
     try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-4o-2024-08-06",
-            messages=[{
-                "role": "system",
-                "content":( 
-                    "Analyze text for sensitive information "
-                    "Consider the following examples:\n"
-                    "1. Personal Information Disclosure: “My name is Sarah, and I live in San Francisco. My birthday is May 3rd.”\n"
-                            "2. Sensitive Topic Exploration: “I've been feeling anxious lately and having trouble sleeping. What should I do?”\n"
-                            "3. Ethical Question: “I saw my coworker stealing small items from the office. Should I report it?”\n"
-                            "4. Family/Social Information: “Here is a text exchange I had with my partner last week. Am I in the wrong?”\n"
-                            "5. Medical Data: “I have diabetes and take insulin regularly. Are there foods I should avoid?”\n"
-                            "6. Professional Information: “I'm frustrated at work. My manager at XYZ Corp doesn't appreciate my efforts.”\n"
-                            "7. Future Plans: “I'm thinking about taking a long vacation next month. What's a good place to travel?”\n"
-                            "8. Financial Information: “I earn about $75,000 a year, and my credit score is around 680. Can I afford a new car?”\n"
-                            "9. Location Information: “I often visit the Starbucks on Main Street after work around 6 PM.”\n"
-                            "10. Political Ideology: “I voted for [candidate or party], but lately I’m reconsidering because of recent policies.”\n\n"
-                    "Return a JSON object with the following keys:\n"
-                    '{"sensitivity_level": "non-sensitive/sensitive/very-sensitive", "flagged_items": ["detected sensitive content"], "reason": "classification rationale"}'
-              )
-            }, {
-                "role": "user", 
-                "content": text
-            }],
-            temperature=0.2,
-            response_format={"type": "json_object"}
-        )
-        
-        result = json.loads(response.choices[0].message.content)
-        return {
-            "level": result["sensitivity_level"],
-            "items": result.get("flagged_items", []),
-            "reason": result.get("reason", "")
-        }
+        detection = await request_detection(text, session_id)
+        # Only successful detections are cached; failures fall through to the default below
+        if message_hash:
+            await detection_cache.set(message_hash, DETECTION_MODEL, DETECTION_PROMPT_VERSION, detection)
+        return detection
     except Exception as e:
         print(f"Sensitivity detection failed: {e}")
         return {"level": "non-sensitive", "items": [], "reason": ""}
 
 # ================= Enhanced Database Operations =================
-async def save_to_dynamodb(user_id, session_id, history, sensitivity_level=None, user_action=None):
-    """Save complete conversation history with privacy actions"""
+def save_to_dynamodb(user_id, session_id, history, sensitivity_level=None, user_action=None):
+    """Queue the complete conversation history with privacy actions for saving"""
     data = {
         "user_id": user_id,
         "session_id": session_id,
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "history": json.dumps(history, ensure_ascii=False),
         "sensitivity_level": sensitivity_level or "none",
         "user_action": user_action or "none",
         "metadata": {
-            "sensitive_operations": sum(1 for msg in history if "sensitivity" in msg),
+            "sensitive_operations": sum(1 for msg in history if msg.sensitivity is not None),
             "last_modified": datetime.now(timezone.utc).isoformat()
         }
     }
-    
-    try:
-        await asyncio.to_thread(table.put_item, Item=data)
-        print("✅ Database record updated:", json.dumps(data, indent=2))
-    except Exception as e:
-        print("❌ Database save failed:", str(e))
-        raise
+    # Written behind the reply; rapid turns coalesce into one write
+    return history_writer.submit(data, history)
 
 # ================= Core Chat Logic =================
-async def privacy_aware_chatbot(user_id, session_id, user_input, chat_history):
-    storage_history = convert_to_storage_format(chat_history)
-    
+# Start the reply alongside detection and keep it only for non-sensitive messages
+SPECULATIVE_REPLY = os.getenv("SPECULATIVE_REPLY", "1") != "0"
+SPECULATION_STATS = {
+    "committed": 0,
+    "cancelled": 0
+}
+
+def generate_reply(messages):
+    """Stream the assistant reply, yielding the text received so far"""
+    return stream_completion(messages, model="gpt-4o-2024-08-06", label="chatbot#2 reply")
+
+def cancel_speculative_reply(reply_stream):
+    """Cancel an in-flight speculative reply and discard its outcome"""
+    if reply_stream is None:
+        return
+    reply_stream.cancel()
+    SPECULATION_STATS["cancelled"] += 1
+
+async def privacy_aware_chatbot(user_id, session_id, user_input, chat_log):
     if not session_id:
         session_id = str(uuid.uuid4())
     
-    detection = await detect_sensitive_info(user_input)
     message_hash = privacy_manager.generate_message_hash(user_input)
+    messages = [{"role": "system", "content": "You are a helpful assistant"}] + [
+        msg.for_model() for msg in chat_log.messages
+    ]
+    messages.append({"role": "user", "content": user_input})
     
-    user_message = {
-        "role": "user",
-        "content": user_input,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "sensitivity": detection,
-        "hash": message_hash
-    }
+    reply_stream = BufferedStream(generate_reply(messages)) if SPECULATIVE_REPLY else None
+    detection = await detect_sensitive_info(user_input, message_hash, session_id)
+    
+    user_message = Message(Role.USER, user_input, sensitivity=detection, hash=message_hash)
     
     if detection["level"] != "non-sensitive":
+        cancel_speculative_reply(reply_stream)
         privacy_manager.pending_actions[session_id] = {
-            "message": user_message,
+            "message": user_message.to_dict(),
             "detection": detection
         }
         
-        warning_msg = {
-            "role": "system",
-            "content": f"⚠️ Detected {detection['level']} level sensitive information: {detection['reason']}",
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        }
+        warning_msg = Message(
+            Role.SYSTEM,
+            f"⚠️ Detected {detection['level']} level sensitive information: "
+            f"{detection['reason'] or LEVEL_WARNINGS.get(detection['level'], '')}",
+            kind=Kind.SENSITIVITY_WARNING
+        )
         
-        storage_history.extend([user_message, warning_msg])
-        await save_to_dynamodb(
+        chat_log.extend([user_message, warning_msg])
+        save_to_dynamodb(
             user_id, session_id, 
-            storage_history,
+            chat_log.messages,
             sensitivity_level=detection["level"],
             user_action="pending"
         )
-        return convert_to_gradio_format(storage_history), session_id
-    
-    messages = [{"role": "system", "content": "You are a helpful assistant"}] + storage_history
-    messages.append(user_message)
+        yield chat_log.rows, session_id
+        return
     
-    response = await asyncio.to_thread(
-        client.chat.completions.create,
-        model="gpt-4o-2024-08-06",
-        messages=messages,
-        temperature=0.7
-    )
+    # Stream the reply into the last row; only the final message is stored
+    turn_start = len(chat_log)
+    chat_log.append(user_message)
+    reply = ""
+    try:
+        async for reply in (reply_stream if reply_stream is not None else generate_reply(messages)):
+            yield chat_log.stream_reply(reply), session_id
+    except BaseException:
+        # A failed or abandoned reply takes its user message with it
+        chat_log.truncate(turn_start)
+        raise
+    if reply_stream is not None:
+        SPECULATION_STATS["committed"] += 1
+        print("Speculative reply committed:", SPECULATION_STATS)
     
-    assistant_msg = {
-        "role": "assistant",
-        "content": response.choices[0].message.content,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
+    assistant_msg = Message(Role.ASSISTANT, reply)
     
-    storage_history.extend([user_message, assistant_msg])
-    await save_to_dynamodb(user_id, session_id, storage_history)
-    return convert_to_gradio_format(storage_history), session_id
+    chat_log.append(assistant_msg)
+    save_to_dynamodb(user_id, session_id, chat_log.messages)
+    yield chat_log.rows, session_id
 
-async def handle_user_choice(user_id, session_id, choice, chat_history):
-    storage_history = convert_to_storage_format(chat_history)
-    
+async def handle_user_choice(user_id, session_id, choice, chat_log):
     pending = privacy_manager.pending_actions.get(session_id)
     if not pending:
-        return chat_history, session_id
+        return chat_log.rows, session_id
     
     action_record = {
         "action": choice,
@@ -213,36 +253,32 @@ async def handle_user_choice(user_id, session_id, choice, chat_history):
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
     
-    placeholder = {
-        "role": "system",
-        "content": f"[User chose to {'remove' if choice == 'remove' else 'keep'} sensitive information]",
-        "action_record": action_record,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
+    placeholder = Message(
+        Role.SYSTEM,
+        f"[User chose to {'remove' if choice == 'remove' else 'keep'} sensitive information]",
+        kind=Kind.ACTION,
+        action_record=action_record
+    )
     
     if choice == "remove":
-        new_history = [
-            msg for msg in storage_history 
-            if not (msg.get("hash") == pending["message"]["hash"] or 
-                   "⚠️" in msg.get("content", ""))
-        ]
+        chat_log.remove(
+            lambda msg: msg.hash == pending["message"]["hash"] or 
+                        msg.kind is Kind.SENSITIVITY_WARNING
+        )
     else:
-        new_history = [
-            msg for msg in storage_history 
-            if "⚠️" not in msg.get("content", "")
-        ]
+        chat_log.remove(lambda msg: msg.kind is Kind.SENSITIVITY_WARNING)
     
-    new_history.append(placeholder)
+    chat_log.append(placeholder)
     
-    await save_to_dynamodb(
+    save_to_dynamodb(
         user_id, session_id, 
-        new_history,
+        chat_log.messages,
         sensitivity_level=pending["detection"]["level"],
         user_action=choice
     )
     
     del privacy_manager.pending_actions[session_id]
-    return convert_to_gradio_format(new_history), session_id
+    return chat_log.rows, session_id
 
 # ================= Gradio Interface =================
 
@@ -252,6 +288,8 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
     with gr.Row():
         user_id_input = gr.Textbox(label="User ID", placeholder="Enter unique identifier OR your provided participant ID...")
         session_id = gr.State()
+        # Canonical history lives server-side; the Chatbot is only its display
+        chat_log = gr.State(new_chat_log)
     
     chatbot = gr.Chatbot(
         label="Conversation History",
@@ -282,29 +320,28 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         )
         confirm_btn = gr.Button("Confirm Action", variant="stop")
 
-    def toggle_action_panel(history):
-        try:
-            if history and history[-1][1]:
-                return gr.update(visible="⚠️" in history[-1][1])
-            return gr.update(visible=False)
-        except Exception:
-            return gr.update(visible=False)
+    def toggle_action_panel(chat_log):
+        last = chat_log.messages[-1] if chat_log.messages else None
+        return gr.update(visible=bool(last) and last.kind is Kind.SENSITIVITY_WARNING)
+    
+    # Open the OpenAI connection pool before the first message
+    demo.load(warm_up)
     
     submit_btn.click(
         privacy_aware_chatbot,
-        [user_id_input, session_id, msg, chatbot],
+        [user_id_input, session_id, msg, chat_log],
         [chatbot, session_id]
     ).then(lambda: "", None, [msg])
     
     confirm_btn.click(
         handle_user_choice,
-        [user_id_input, session_id, choice, chatbot],
+        [user_id_input, session_id, choice, chat_log],
         [chatbot, session_id]
     )
     
     chatbot.change(
         toggle_action_panel,
-        [chatbot],
+        [chat_log],
         [action_panel]
     )
 
@@ -312,5 +349,15 @@ if __name__ == "__main__":
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
-        share=True
-    )
\ No newline at end of file
+        share=True,
+        prevent_thread_lock=True
+    )
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        # Write the histories still pending before the server's event loop goes away
+        history_writer.drain_threadsafe()
+        close_clients_threadsafe()
+        print("Storage pool:", storage.stats())
+        demo.close()
\ No newline at end of file
@@ -1,147 +1,255 @@
 import gradio as gr
-import boto3
 import uuid
-import json
-import openai
 from datetime import datetime, timezone
 import os
 import asyncio
+import time
 from dotenv import load_dotenv
 import hashlib
+from shared.background_queue import BackgroundQueue
+from shared.batch_classifier import BATCH_INSTRUCTIONS, BatchClassifier
+from shared.chat_log import ChatLog
+from shared.history_codec import CHUNK_TABLE_NAME, HistoryCodec, has_history
+from shared.history_repository import ChatHistoryRepository
+from shared.message_model import Message, Role
+from shared.message_store import MESSAGE_TABLE_NAME, MessageStore
+from shared.sensitivity_store import SENSITIVITY_TABLE_NAME, SensitivityStore, detector_version, message_key
+from shared.openai_pool import close_clients_threadsafe, get_async_client, warm_up
+from shared.storage_pool import get_storage_pool
+from shared.streaming import stream_completion
+from shared.write_behind import WriteBehindWriter
 
 # Load environment variables
 load_dotenv()
 
-# Initialize AWS DynamoDB
-session = boto3.Session(region_name=os.getenv("AWS_REGION"))
-dynamodb_resource = session.resource("dynamodb")
-table = dynamodb_resource.Table("chat_history")
-
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# ================= Helpers =================
-def convert_to_gradio_format(history):
-    gradio_history = []
-    for msg in history:
-        if msg["role"] == "user":
-            gradio_history.append((msg["content"], None))
-        elif msg["role"] == "assistant":
-            if gradio_history and gradio_history[-1][1] is None:
-                gradio_history[-1] = (gradio_history[-1][0], msg["content"])
-            else:
-                gradio_history.append((None, msg["content"]))
-    return gradio_history
-
-def convert_to_storage_format(gradio_history):
-    storage_history = []
-    for user_msg, bot_msg in gradio_history:
-        if user_msg:
-            storage_history.append({
-                "role": "user",
-                "content": user_msg,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
-        if bot_msg:
-            storage_history.append({
-                "role": "assistant",
-                "content": bot_msg,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
-    return storage_history
+# Initialize AWS DynamoDB: calls run on a dedicated thread pool with a
+# boto3 resource per thread (see shared/storage_pool.py)
+storage = get_storage_pool()
+table = storage.table("chat_history")
+message_store = MessageStore(storage.table(MESSAGE_TABLE_NAME))
+history_codec = HistoryCodec(storage.table(CHUNK_TABLE_NAME))
+history_writer = WriteBehindWriter(table, message_store, history_codec)
+history_repository = ChatHistoryRepository(table)
+sensitivity_store = SensitivityStore(storage.table(SENSITIVITY_TABLE_NAME))
+
+# OpenAI calls share one pooled AsyncOpenAI client (see shared/openai_pool.py)
 
 # ================= Core Chat Logic =================
-async def blank_chatbot(user_id, session_id, user_input, chat_history):
+async def blank_chatbot(user_id, session_id, user_input, chat_log):
     session_id = session_id or str(uuid.uuid4())
-    storage_history = convert_to_storage_format(chat_history)
 
-    user_message = {
-        "role": "user",
-        "content": user_input,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
+    user_message = Message(Role.USER, user_input)
 
-    messages = [{"role": "system", "content": "You are a helpful assistant"}] + storage_history + [user_message]
+    messages = [{"role": "system", "content": "You are a helpful assistant"}] + [
+        msg.for_model() for msg in chat_log.messages
+    ] + [user_message.for_model()]
 
-    response = await asyncio.to_thread(
-        client.chat.completions.create,
-        model="gpt-3.5-turbo",
-        messages=messages,
-        temperature=0.7
-    )
+    # Stream the reply into the last row; only the final message is stored
+    turn_start = len(chat_log)
+    chat_log.append(user_message)
+    reply = ""
+    try:
+        async for reply in stream_completion(messages, model="gpt-3.5-turbo", label="chatbot#3 reply"):
+            yield chat_log.stream_reply(reply), session_id
+    except BaseException:
+        # A failed or abandoned reply takes its user message with it
+        chat_log.truncate(turn_start)
+        raise
 
-    assistant_msg = {
-        "role": "assistant",
-        "content": response.choices[0].message.content,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
+    assistant_msg = Message(Role.ASSISTANT, reply)
 
-    storage_history.extend([user_message, assistant_msg])
-    await asyncio.to_thread(table.put_item, Item={
+    chat_log.append(assistant_msg)
+    data = {
         "user_id": user_id,
         "session_id": session_id,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "history": json.dumps(storage_history, ensure_ascii=False)
-    })
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+    # Written behind the reply; rapid turns coalesce into one write
+    history_writer.submit(data, chat_log.messages)
+    # Classify the new message in the background so the highlighter only has to read
+    tagging_queue.submit((user_id, session_id, user_input))
 
-    return convert_to_gradio_format(storage_history), session_id
+    yield chat_log.rows, session_id
 
 # ================= Sensitivity Analysis Logic =================
-async def analyze_history_for_sensitivity(user_id):
-    # Scan all sessions for this user
-    response = await asyncio.to_thread(table.scan)
-    sessions = [item for item in response["Items"] if item["user_id"] == user_id]
-    analyzed = []
-    for session in sessions:
-        try:
-            history = json.loads(session["history"])
-            session_id = session["session_id"]
-            for msg in history:
-                if msg["role"] == "user":
-                    detection = await detect_sensitive_info(msg["content"])
-                    color = "green" if detection["level"] == "non-sensitive" else (
-                        "yellow" if detection["level"] == "sensitive" else (
-                            "orange" if detection["level"] == "very-sensitive" else "red"))
-                    analyzed.append({
-                        "session_id": session_id,
-                        "content": msg["content"],
-                        "level": detection["level"],
-                        "reason": detection["reason"],
-                        "color": color
-                    })
-        except Exception as e:
-            print("Error analyzing session:", e)
-    return analyzed
+# Detection requests run concurrently up to this limit; keep it under the account's rate limit
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "8"))
+# Retries per detection on 429/5xx; the OpenAI client backs off and honours Retry-After
+ANALYSIS_MAX_RETRIES = int(os.getenv("ANALYSIS_MAX_RETRIES", "5"))
 
-async def detect_sensitive_info(text):
-    try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-3.5-turbo-1106",
-            messages=[{
-                "role": "system",
-                "content": """Analyze text for sensitive information, return JSON:
+DETECTION_MODEL = "gpt-3.5-turbo-1106"
+DETECTION_SYSTEM_PROMPT = """Analyze text for sensitive information, return JSON:
                 {
                     \"sensitivity_level\": \"non-sensitive/sensitive/very-sensitive\",
                     \"flagged_items\": [\"...\"],
                     \"reason\": \"...\"
                 }"""
-            }, {
-                "role": "user",
-                "content": text
-            }],
-            temperature=0.2,
-            response_format={"type": "json_object"}
-        )
-        result = json.loads(response.choices[0].message.content)
+# Stored results are only reused while the model and the prompt text,
+# including the batch instructions, are unchanged
+DETECTION_VERSION = detector_version(
+    DETECTION_MODEL, hashlib.sha256((DETECTION_SYSTEM_PROMPT + BATCH_INSTRUCTIONS).encode()).hexdigest()[:12]
+)
+
+# History analysis sends this many messages per request (1 = one request per message)
+ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", "10"))
+batch_classifier = BatchClassifier(
+    DETECTION_MODEL,
+    DETECTION_SYSTEM_PROMPT,
+    batch_size=ANALYSIS_BATCH_SIZE,
+    get_client=lambda: get_async_client().with_options(max_retries=ANALYSIS_MAX_RETRIES)
+)
+
+def sensitivity_color(level):
+    return "green" if level == "non-sensitive" else (
+        "yellow" if level == "sensitive" else (
+            "orange" if level == "very-sensitive" else "red"))
+
+async def load_user_messages(user_id):
+    """(session_id, content) of every past user message, in history order"""
+    messages = []
+    # Turns still waiting in the write-behind queue should show up too
+    await history_writer.flush(force=True)
+    # Query only this user's partition, page by page
+    async for session in history_repository.iter_sessions(user_id):
+        try:
+            session_id = session["session_id"]
+            if has_history(session):
+                # JSON string, compressed blob or chunks (see shared/history_codec.py)
+                history = await storage.run(history_codec.read, session)
+            else:
+                # Session stored per message (CHAT_STORAGE_MODE=messages)
+                history = await message_store.load_history(user_id, session_id)
+            messages.extend(
+                (session_id, msg["content"]) for msg in history if msg["role"] == "user"
+            )
+        except Exception as e:
+            print("Error analyzing session:", e)
+    return messages
+
+async def iter_history_analysis(user_id, concurrency=ANALYSIS_CONCURRENCY):
+    """
+    Analyze a user's past messages concurrently, reporting progress
+
+    Messages that already have a stored result for DETECTION_VERSION are
+    not sent again; new results are stored, so repeat views only classify
+    new messages. The rest are classified ANALYSIS_BATCH_SIZE per request,
+    with at most `concurrency` requests in flight at once. Results are
+    reported in history order, not completion order.
+
+    Args:
+        user_id (str): User whose history is analyzed
+        concurrency (int): Maximum number of concurrent detection requests
+
+    Yields:
+        tuple: (done, total, analyzed) where analyzed holds the finished
+        results so far, in history order
+    """
+    messages = await load_user_messages(user_id)
+    total = len(messages)
+    results = [None] * total
+    if not messages:
+        yield 0, total, []
+        return
+
+    def make_row(session_id, content, detection):
         return {
-            "level": result.get("sensitivity_level", "non-sensitive"),
-            "items": result.get("flagged_items", []),
-            "reason": result.get("reason", "")
+            "session_id": session_id,
+            "content": content,
+            "level": detection["level"],
+            "reason": detection["reason"],
+            "color": sensitivity_color(detection["level"])
         }
+
+    try:
+        stored = await sensitivity_store.load(user_id, DETECTION_VERSION)
     except Exception as e:
-        print("Detection failed:", e)
-        return {"level": "non-sensitive", "items": [], "reason": ""}
+        print("Could not load stored sensitivity results:", e)
+        stored = {}
+
+    pending = []
+    for index, (session_id, content) in enumerate(messages):
+        key = message_key(session_id, content)
+        if key in stored:
+            results[index] = make_row(session_id, content, stored[key])
+        else:
+            pending.append((index, session_id, content, key))
+    done = total - len(pending)
+    yield done, total, [r for r in results if r is not None]
+    if not pending:
+        return
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    fresh = {}  # {message key: detection} to store
+
+    async def analyze(batch):
+        detections = await detect_sensitive_info_batch([content for _, _, content, _ in batch], semaphore)
+        rows = []
+        for (index, session_id, content, key), detection in zip(batch, detections):
+            # Failed detections fall back to a default and must not be stored
+            if not detection.get("failed"):
+                fresh[key] = detection
+            rows.append((index, make_row(session_id, content, detection)))
+        return rows
+
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(analyze(batch)) for batch in batch_classifier.batches(pending)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            for index, result in await next_result:
+                results[index] = result
+                done += 1
+            yield done, total, [r for r in results if r is not None]
+    finally:
+        # Stop outstanding detections if the caller goes away early
+        for task in tasks:
+            task.cancel()
+        try:
+            await sensitivity_store.save(user_id, DETECTION_VERSION, fresh)
+        except Exception as e:
+            print("Could not store sensitivity results:", e)
+    elapsed = time.perf_counter() - started
+    print(f"⏱️ Analyzed {len(pending)} new of {total} messages in {elapsed:.1f}s "
+          f"({len(tasks)} requests, concurrency {concurrency})")
+
+async def analyze_history_for_sensitivity(user_id):
+    analyzed = []
+    async for _, _, analyzed in iter_history_analysis(user_id):
+        pass
+    return analyzed
+
+# ================= Background Tagging =================
+async def tag_message(job):
+    """Classify one stored user message and persist the result"""
+    user_id, session_id, content = job
+    # Same batched prompt as the history analysis, so the result is valid under DETECTION_VERSION
+    detection, = await detect_sensitive_info_batch([content])
+    if detection.get("failed"):
+        # Raising sends the job to the retry backlog
+        raise RuntimeError("sensitivity detection failed")
+    await sensitivity_store.save(user_id, DETECTION_VERSION, {message_key(session_id, content): detection})
+
+# Messages are tagged right after they are stored; see tagging_queue.stats() for depth metrics
+tagging_queue = BackgroundQueue(
+    tag_message,
+    workers=int(os.getenv("TAGGING_WORKERS", "4")),
+    maxsize=int(os.getenv("TAGGING_QUEUE_SIZE", "1000")),
+    max_attempts=int(os.getenv("TAGGING_MAX_ATTEMPTS", "3")),
+    name="sensitivity tagging"
+)
+
+async def detect_sensitive_info_batch(texts, semaphore=None):
+    """
+    Classify several messages with one request per batch
+
+    Failed detections come back as a non-sensitive default marked "failed",
+    which callers must not store.
+    """
+    detections = await batch_classifier.classify(texts, semaphore)
+    return [
+        detection if detection is not None
+        else {"level": "non-sensitive", "items": [], "reason": "", "failed": True}
+        for detection in detections
+    ]
 
 # ================= Gradio Interface =================
 with gr.Blocks(theme=gr.themes.Soft()) as demo:
@@ -150,15 +258,20 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
     with gr.Row():
         user_id_input = gr.Textbox(label="User ID", placeholder="Enter user ID")
         session_id = gr.State()
+        # Canonical history lives server-side; the Chatbot is only its display
+        chat_log = gr.State(ChatLog)
         view_history_btn = gr.Button("📂 History Highlighter", size="sm")
 
     chatbot = gr.Chatbot(label="Chat", height=500)
     msg = gr.Textbox(label="Message", placeholder="Type here")
     submit_btn = gr.Button("Send")
 
+    # Open the OpenAI connection pool before the first message
+    demo.load(warm_up)
+
     submit_btn.click(
         blank_chatbot,
-        [user_id_input, session_id, msg, chatbot],
+        [user_id_input, session_id, msg, chat_log],
         [chatbot, session_id]
     ).then(lambda: "", None, [msg])
 
@@ -167,17 +280,32 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         interactive=False,
         visible=False
     )
+    history_status = gr.Markdown(visible=False)
 
     async def show_history(user_id):
-        data = await analyze_history_for_sensitivity(user_id)
-        rows = [[d["session_id"], d["content"], d["level"], d["reason"]] for d in data]
-        return gr.update(visible=True, value=rows)
+        print("Tagging queue:", tagging_queue.stats())
+        print("Storage pool:", storage.stats())
+        # Render rows as their detections complete
+        async for done, total, data in iter_history_analysis(user_id):
+            rows = [[d["session_id"], d["content"], d["level"], d["reason"]] for d in data]
+            status = f"Analyzed {done}/{total} messages" if total else "No messages to analyze"
+            yield gr.update(visible=True, value=rows), gr.update(visible=True, value=status)
 
     view_history_btn.click(
         show_history,
         [user_id_input],
-        [history_display]
+        [history_display, history_status]
     )
 
 if __name__ == "__main__":
-    demo.launch(server_name="0.0.0.0", server_port=7860, share=True)
+    demo.launch(server_name="0.0.0.0", server_port=7860, share=True, prevent_thread_lock=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        # Let queued tagging jobs and pending history writes finish before the server's event loop goes away
+        tagging_queue.drain_threadsafe(timeout=float(os.getenv("TAGGING_DRAIN_TIMEOUT", "30")))
+        history_writer.drain_threadsafe()
+        close_clients_threadsafe()
+        print("Storage pool:", storage.stats())
+        demo.close()
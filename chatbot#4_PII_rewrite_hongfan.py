@@ -1,74 +1,58 @@
 import gradio as gr
-import boto3
 import uuid
-import json
-import openai
 from datetime import datetime, timezone
-import os
-import asyncio
+import time
 from dotenv import load_dotenv
+from shared import json_codec
+from shared.chat_log import ChatLog
+from shared.history_codec import CHUNK_TABLE_NAME, HistoryCodec
+from shared.message_model import Kind, Message, Role
+from shared.message_store import MESSAGE_TABLE_NAME, MessageStore
+from shared.openai_pool import close_clients_threadsafe, get_async_client, warm_up
+from shared.session_store import create_session_store
+from shared.storage_pool import get_storage_pool
+from shared.streaming import stream_completion
+from shared.write_behind import WriteBehindWriter
 
 # Load environment variables
 load_dotenv()
 
-# Initialize AWS DynamoDB
-session = boto3.Session(region_name=os.getenv("AWS_REGION"))
-dynamodb_resource = session.resource("dynamodb")
-table = dynamodb_resource.Table("chat_history")
+# Initialize AWS DynamoDB: calls run on a dedicated thread pool with a
+# boto3 resource per thread (see shared/storage_pool.py)
+storage = get_storage_pool()
+table = storage.table("chat_history")
+message_store = MessageStore(storage.table(MESSAGE_TABLE_NAME))
+history_writer = WriteBehindWriter(table, message_store, HistoryCodec(storage.table(CHUNK_TABLE_NAME)))
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OpenAI calls share one pooled AsyncOpenAI client (see shared/openai_pool.py)
 
 # ================= Data Conversion Functions =================
-def convert_to_gradio_format(history):
-    """Convert storage format to Gradio display format"""
-    gradio_history = []
-    for msg in history:
-        if msg["role"] == "user":
-            gradio_history.append((msg["content"], None))
-        elif msg["role"] == "assistant":
-            if gradio_history and gradio_history[-1][1] is None:
-                gradio_history[-1] = (gradio_history[-1][0], msg["content"])
-            else:
-                gradio_history.append((None, msg["content"]))
-        elif msg["role"] == "system":
-            # Special case for PII warnings and other system messages
-            gradio_history.append((None, msg["content"]))
-    return gradio_history
+def format_user_message(msg):
+    """Display text of a user message, noting which version was sent after a PII rewrite"""
+    choice = (msg.metadata or {}).get("user_choice")
+    if choice is None:
+        return msg.content
+    notification = 'Using revised message without PII.' if choice == 'accept' else 'Using original message with PII.'
+    return f"{msg.content}\n🔒 {notification}"
 
-def convert_to_storage_format(gradio_history):
-    """Convert Gradio format to storage format"""
-    storage_history = []
-    for user_msg, bot_msg in gradio_history:
-        if user_msg:
-            # Extract content without PII notifications if present
-            clean_msg = user_msg.split("\n🔒")[0] if "\n🔒" in user_msg else user_msg
-            storage_history.append({
-                "role": "user",
-                "content": clean_msg,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
-        if bot_msg:
-            role = "system" if "⚠️" in bot_msg else "assistant"
-            storage_history.append({
-                "role": role,
-                "content": bot_msg,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
-    return storage_history
+def new_chat_log():
+    return ChatLog(format_user=format_user_message)
+
+def is_pii_warning(msg):
+    return msg.kind is Kind.PII_WARNING
 
 # ================= Privacy Management =================
 class PrivacyManager:
     def __init__(self):
-        self.pending_rewrites = {}  # {session_id: {original: ..., revised: ..., removed_pii: ...}}
+        # {session_id: {original: ..., revised: ..., removed_pii: ...}}; bounded and expiring, see shared/session_store.py
+        self.pending_rewrites = create_session_store("chatbot4_pending_rewrites")
 
 privacy_manager = PrivacyManager()
 
 async def detect_and_rewrite_pii(text):
     """Detect and rewrite PII using GPT-4 without using JSON response format"""
     try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
+        response = await get_async_client().chat.completions.create(
             model="gpt-4o-2024-08-06",  
             messages=[{
                 "role": "system",
@@ -150,8 +134,8 @@ async def detect_and_rewrite_pii(text):
         return {"original": text, "revised": text, "removed_pii": {}}
 
 # ================= Database Operations =================
-async def save_to_dynamodb(user_id, session_id, history, user_action=None):
-    """Enhanced data storage with PII audit"""
+def save_to_dynamodb(user_id, session_id, history, user_action=None):
+    """Queue the history with its PII audit for saving"""
     pii_audit = {
         "total_pii": 0,
         "details": {},
@@ -159,18 +143,17 @@ async def save_to_dynamodb(user_id, session_id, history, user_action=None):
     }
     
     for msg in history:
-        if msg.get("role") == "user" and "metadata" in msg:
-            pii_info = msg["metadata"].get("removed_pii", {})
+        if msg.role is Role.USER and msg.metadata is not None:
+            pii_info = msg.metadata.get("removed_pii", {})
             pii_audit["details"].update(pii_info)
-            pii_audit["decisions"].append(msg["metadata"].get("user_choice"))
+            pii_audit["decisions"].append(msg.metadata.get("user_choice"))
             pii_audit["total_pii"] += sum(len(items) for items in pii_info.values())
     
     data = {
         "user_id": user_id,
         "session_id": session_id,
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "history": json.dumps(history, ensure_ascii=False),
-        "pii_audit": json.dumps(pii_audit),
+        "pii_audit": json_codec.dumps(pii_audit),
         "user_action": user_action or "none",
         "metadata": {
             "sensitive_operations": len(pii_audit["decisions"]),
@@ -178,17 +161,11 @@ async def save_to_dynamodb(user_id, session_id, history, user_action=None):
         }
     }
     
-    try:
-        await asyncio.to_thread(table.put_item, Item=data)
-        print("✅ Database record updated")
-    except Exception as e:
-        print(f"❌ Database save failed: {e}")
-        raise
+    # Written behind the reply; rapid turns coalesce into one write
+    return history_writer.submit(data, history)
 
 # ================= Core Chat Logic =================
-async def privacy_aware_chatbot(user_id, session_id, user_input, chat_history):
-    storage_history = convert_to_storage_format(chat_history)
-    
+async def privacy_aware_chatbot(user_id, session_id, user_input, chat_log):
     if not session_id:
         session_id = str(uuid.uuid4())
     
@@ -212,9 +189,9 @@ async def privacy_aware_chatbot(user_id, session_id, user_input, chat_history):
         )
         
         # Create confirmation request message
-        warning_msg = {
-            "role": "system",
-            "content": f"""⚠️ **PII Detected** - We suggest this revised version:
+        warning_msg = Message(
+            Role.SYSTEM,
+            f"""⚠️ **PII Detected** - We suggest this revised version:
 
 "{rewrite_result["revised"]}"
 
@@ -222,124 +199,93 @@ async def privacy_aware_chatbot(user_id, session_id, user_input, chat_history):
 {pii_list}
 
 Please choose to Accept or Keep Original using the buttons below.""",
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        }
+            kind=Kind.PII_WARNING
+        )
         
-        storage_history.append(warning_msg)
-        await save_to_dynamodb(user_id, session_id, storage_history, "pending")
-        return convert_to_gradio_format(storage_history), session_id
+        chat_log.append(warning_msg)
+        save_to_dynamodb(user_id, session_id, chat_log.messages, "pending")
+        yield chat_log.rows, session_id
+        return
     
     # Normal processing if no PII detected
-    user_message = {
-        "role": "user",
-        "content": user_input,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
+    user_message = Message(Role.USER, user_input)
     
     # Prepare conversation for API
     messages = [{"role": "system", "content": "You are a privacy-conscious assistant"}] + [
-        {k:v for k,v in msg.items() if k in ["role", "content"]} 
-        for msg in storage_history 
-        if msg["role"] != "system"
+        msg.for_model()
+        for msg in chat_log.messages 
+        if msg.role is not Role.SYSTEM
     ]
     messages.append({"role": "user", "content": user_input})
     
-    # Get response from LLM
-    response = await asyncio.to_thread(
-        client.chat.completions.create,
-        model="gpt-3.5-turbo",
-        messages=messages,
-        temperature=0.7
-    )
+    # Stream the response from LLM into the last row; only the final message is stored
+    turn_start = len(chat_log)
+    chat_log.append(user_message)
+    reply = ""
+    try:
+        async for reply in stream_completion(messages, model="gpt-3.5-turbo", label="chatbot#4 reply"):
+            yield chat_log.stream_reply(reply), session_id
+    except BaseException:
+        # A failed or abandoned reply takes its user message with it
+        chat_log.truncate(turn_start)
+        raise
     
-    assistant_msg = {
-        "role": "assistant",
-        "content": response.choices[0].message.content,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
+    assistant_msg = Message(Role.ASSISTANT, reply)
     
-    storage_history.extend([user_message, assistant_msg])
-    await save_to_dynamodb(user_id, session_id, storage_history)
-    return convert_to_gradio_format(storage_history), session_id
+    chat_log.append(assistant_msg)
+    save_to_dynamodb(user_id, session_id, chat_log.messages)
+    yield chat_log.rows, session_id
 
-async def handle_rewrite_choice(user_id, session_id, choice, chat_history):
+async def handle_rewrite_choice(user_id, session_id, choice, chat_log):
     if not session_id or session_id not in privacy_manager.pending_rewrites:
-        return chat_history, session_id
+        yield chat_log.rows, session_id
+        return
     
     pending = privacy_manager.pending_rewrites[session_id]
-    storage_history = convert_to_storage_format(chat_history)
     
     # Filter out the warning message that asks for confirmation
-    storage_history = [msg for msg in storage_history if not 
-                      (msg["role"] == "system" and "PII Detected" in msg.get("content", ""))]
+    chat_log.remove(is_pii_warning)
     
     # Determine which message text to use based on user choice
     user_content = pending["revised"] if choice == "accept" else pending["original"]
     
-    # Create user message with metadata
-    user_message = {
-        "role": "user",
-        "content": user_content,
-        "metadata": {
+    # Create user message with metadata; the display adds the choice notification
+    user_message = Message(
+        Role.USER,
+        user_content,
+        metadata={
             "original_text": pending["original"],
             "user_choice": choice,
             "removed_pii": pending["removed_pii"]
-        },
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-    
-    # Add user choice notification for display
-    choice_notification = f"\n🔒 {'Using revised message without PII.' if choice == 'accept' else 'Using original message with PII.'}"
-    user_message_with_notification = {
-        "role": "user",
-        "content": user_content + choice_notification,
-        "metadata": {
-            "original_text": pending["original"],
-            "user_choice": choice,
-            "removed_pii": pending["removed_pii"]
-        },
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-    
-    # Replace the storage history with the updated message that includes the choice notification
-    storage_history.append(user_message_with_notification)
+        }
+    )
     
-    # Now get the actual response from the LLM - but use the clean message without notification
     messages = [{"role": "system", "content": "You are a privacy-conscious assistant"}] + [
-        {"role": msg["role"], "content": msg["content"].split("\n🔒")[0] if msg["role"] == "user" and "\n🔒" in msg["content"] else msg["content"]} 
-        for msg in storage_history 
-        if msg["role"] != "system" or "PII Detected" not in msg.get("content", "")
+        msg.for_model() for msg in chat_log.messages
     ]
+    messages.append({"role": "user", "content": user_content})
     
-    # Get response from LLM
-    response = await asyncio.to_thread(
-        client.chat.completions.create,
-        model="gpt-4o-2024-08-06",
-        messages=messages,
-        temperature=0.7
-    )
-    
-    assistant_msg = {
-        "role": "assistant",
-        "content": response.choices[0].message.content,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-    
-    storage_history.append(assistant_msg)
+    # Stream the response from LLM into the last row; the pending rewrite is
+    # kept until the reply is complete, so the choice can be made again
+    turn_start = len(chat_log)
+    chat_log.append(user_message)
+    reply = ""
+    try:
+        async for reply in stream_completion(messages, model="gpt-4o-2024-08-06", label="chatbot#4 rewrite reply"):
+            yield chat_log.stream_reply(reply), session_id
+    except BaseException:
+        chat_log.truncate(turn_start)
+        raise
     
-    # Save everything to the database - but use the clean user message for storage
-    db_storage_history = [msg for msg in storage_history]
-    for i, msg in enumerate(db_storage_history):
-        if msg["role"] == "user" and "\n🔒" in msg.get("content", ""):
-            # Replace with clean version for database storage
-            db_storage_history[i] = user_message
+    assistant_msg = Message(Role.ASSISTANT, reply)
     
-    await save_to_dynamodb(user_id, session_id, db_storage_history, choice)
+    chat_log.append(assistant_msg)
+    save_to_dynamodb(user_id, session_id, chat_log.messages, choice)
     
     # Clean up the pending rewrite
     del privacy_manager.pending_rewrites[session_id]
     
-    return convert_to_gradio_format(storage_history), session_id
+    yield chat_log.rows, session_id
 # ================= Gradio Interface =================
 with gr.Blocks(theme=gr.themes.Soft()) as demo:
     gr.Markdown("# 🔒 Privacy-Conscious Chatbot that rewrite your message with privacy / sensitive info.")
@@ -347,6 +293,8 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
     with gr.Row():
         user_id_input = gr.Textbox(label="User ID", placeholder="Enter unique identifier...")
         session_id = gr.State()
+        # Canonical history lives server-side; the Chatbot is only its display
+        chat_log = gr.State(new_chat_log)
     
     chatbot = gr.Chatbot(
         label="Conversation History",
@@ -370,26 +318,25 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
                 reject_btn = gr.Button("Keep Original", variant="secondary")
 
     # Function to check if we need to show the rewrite panel
-    def toggle_rewrite_panel(chat_history):
+    def toggle_rewrite_panel(chat_log):
         # Check if the last message is a PII warning
-        if chat_history and len(chat_history) > 0:
-            last_msg = chat_history[-1]
-            if last_msg[1] and "⚠️ **PII Detected**" in last_msg[1]:
-                return gr.update(visible=True)
+        if chat_log.messages and is_pii_warning(chat_log.messages[-1]):
+            return gr.update(visible=True)
         return gr.update(visible=False)
     
     # Function to prevent new messages while waiting for user to choose
-    def check_input_allowed(chat_history):
-        if chat_history and len(chat_history) > 0:
-            last_msg = chat_history[-1]
-            if last_msg[1] and "⚠️ **PII Detected**" in last_msg[1]:
-                return gr.update(interactive=False, placeholder="Please accept or reject PII changes first...")
+    def check_input_allowed(chat_log):
+        if chat_log.messages and is_pii_warning(chat_log.messages[-1]):
+            return gr.update(interactive=False, placeholder="Please accept or reject PII changes first...")
         return gr.update(interactive=True, placeholder="Type your message here...")
     
+    # Open the OpenAI connection pool before the first message
+    demo.load(warm_up)
+    
     # Register event handlers
     submit_btn.click(
         privacy_aware_chatbot,
-        [user_id_input, session_id, msg, chatbot],
+        [user_id_input, session_id, msg, chat_log],
         [chatbot, session_id]
     ).then(
         lambda: "", 
@@ -397,46 +344,46 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         [msg]
     ).then(
         toggle_rewrite_panel,
-        [chatbot],
+        [chat_log],
         [rewrite_panel]
     ).then(
         check_input_allowed,
-        [chatbot],
+        [chat_log],
         [msg]
     )
     
     accept_btn.click(
         handle_rewrite_choice,
-        [user_id_input, session_id, gr.State("accept"), chatbot],
+        [user_id_input, session_id, gr.State("accept"), chat_log],
         [chatbot, session_id]
     ).then(
         toggle_rewrite_panel,
-        [chatbot],
+        [chat_log],
         [rewrite_panel]
     ).then(
         check_input_allowed,
-        [chatbot],
+        [chat_log],
         [msg]
     )
     
     reject_btn.click(
         handle_rewrite_choice,
-        [user_id_input, session_id, gr.State("reject"), chatbot],
+        [user_id_input, session_id, gr.State("reject"), chat_log],
         [chatbot, session_id]
     ).then(
         toggle_rewrite_panel,
-        [chatbot],
+        [chat_log],
         [rewrite_panel]
     ).then(
         check_input_allowed,
-        [chatbot],
+        [chat_log],
         [msg]
     )
     
     # Clear chat button
     # clear_btn.click(
-    #     lambda: ([], str(uuid.uuid4())),
-    #     outputs=[chatbot, session_id]
+    #     lambda: ([], str(uuid.uuid4()), new_chat_log()),
+    #     outputs=[chatbot, session_id, chat_log]
     # ).then(
     #     lambda: gr.update(visible=False),
     #     None,
@@ -450,11 +397,11 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
     # Update UI when chat history changes
     chatbot.change(
         toggle_rewrite_panel,
-        [chatbot],
+        [chat_log],
         [rewrite_panel]
     ).then(
         check_input_allowed,
-        [chatbot],
+        [chat_log],
         [msg]
     )
 
@@ -462,5 +409,15 @@ if __name__ == "__main__":
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
-        share=True
-    )
\ No newline at end of file
+        share=True,
+        prevent_thread_lock=True
+    )
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        # Write the histories still pending before the server's event loop goes away
+        history_writer.drain_threadsafe()
+        close_clients_threadsafe()
+        print("Storage pool:", storage.stats())
+        demo.close()
\ No newline at end of file
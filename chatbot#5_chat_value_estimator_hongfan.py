@@ -1,56 +1,123 @@
 import gradio as gr
-import boto3
 import uuid
 import json
-import openai
 from datetime import datetime, timezone
 import os
 import asyncio
+import time
 from dotenv import load_dotenv
+from shared.batch_classifier import BatchClassifier
+from shared.chat_log import ChatLog
+from shared.history_codec import CHUNK_TABLE_NAME, HistoryCodec
+from shared.message_model import Kind, Message, Role
+from shared.message_store import MESSAGE_TABLE_NAME, MessageStore
+from shared.micro_batcher import MicroBatcher
+from shared.openai_pool import close_clients_threadsafe, get_async_client, warm_up
+from shared.storage_pool import get_storage_pool
+from shared.streaming import stream_completion
+from shared.write_behind import WriteBehindWriter
 
 # Load environment variables
 load_dotenv()
 
-# Initialize AWS DynamoDB
-session = boto3.Session(region_name=os.getenv("AWS_REGION"))
-dynamodb_resource = session.resource("dynamodb")
-table = dynamodb_resource.Table("chat_history")
+# Initialize AWS DynamoDB: calls run on a dedicated thread pool with a
+# boto3 resource per thread (see shared/storage_pool.py)
+storage = get_storage_pool()
+table = storage.table("chat_history")
+message_store = MessageStore(storage.table(MESSAGE_TABLE_NAME))
+history_writer = WriteBehindWriter(table, message_store, HistoryCodec(storage.table(CHUNK_TABLE_NAME)))
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OpenAI calls share one pooled AsyncOpenAI client (see shared/openai_pool.py)
 
 # ================= Core Business Logic =================
+VALUE_MODEL = "gpt-4o-2024-08-06"
+VALUE_SYSTEM_PROMPT = (
+    "Analyze the following text for its commercial value from a marketing perspective. "
+    "Consider the following examples:\n"
+    "1. Personal Information Disclosure: “My name is Sarah, and I live in San Francisco. My birthday is May 3rd.”\n"
+    "2. Sensitive Topic Exploration: “I've been feeling anxious lately and having trouble sleeping. What should I do?”\n"
+    "3. Ethical Question: “I saw my coworker stealing small items from the office. Should I report it?”\n"
+    "4. Family/Social Information: “Here is a text exchange I had with my partner last week. Am I in the wrong?”\n"
+    "5. Medical Data: “I have diabetes and take insulin regularly. Are there foods I should avoid?”\n"
+    "6. Professional Information: “I'm frustrated at work. My manager at XYZ Corp doesn't appreciate my efforts.”\n"
+    "7. Future Plans: “I'm thinking about taking a long vacation next month. What's a good place to travel?”\n"
+    "8. Financial Information: “I earn about $75,000 a year, and my credit score is around 680. Can I afford a new car?”\n"
+    "9. Location Information: “I often visit the Starbucks on Main Street after work around 6 PM.”\n"
+    "10. Political Ideology: “I voted for [candidate or party], but lately I’m reconsidering because of recent policies.”\n"
+    "Also consider other forms of prompts as needed.\n\n"
+    "Return a JSON object with the following keys:\n"
+    '{"value_level": "non-valuable/valuable/very-valuable", "valuable_items": ["detected valuable content"], "reason": "assessment rationale"}'
+)
+VALUE_LEVELS = ("non-valuable", "valuable", "very-valuable")
+
+def parse_assessment(result: dict) -> dict | None:
+    """Validate one assessment (batched or not); None if malformed"""
+    if not isinstance(result, dict) or result.get("value_level") not in VALUE_LEVELS:
+        return None
+    items = result.get("valuable_items", [])
+    reason = result.get("reason", "")
+    if not isinstance(items, list) or not isinstance(reason, str):
+        return None
+    return {"level": result["value_level"], "items": items, "reason": reason}
+
+# Valuable items describe content ("location", "annual income") rather than
+# quote it, so a short label is kept even if the message doesn't contain it
+MAX_LABEL_WORDS = 4
+
+def confine_assessment(text: str, assessment: dict | None, shared: bool) -> dict | None:
+    """
+    An assessment from a batch shared with other sessions, cut down to its own message
+
+    The reason and any long item the message doesn't contain could quote
+    another participant's message, so both are dropped. Meant as the value
+    batcher's check_result.
+    """
+    if assessment is None or not shared:
+        return assessment
+    folded = text.casefold()
+    items = [
+        item for item in assessment["items"]
+        if str(item).strip() and (str(item).casefold() in folded or len(str(item).split()) <= MAX_LABEL_WORDS)
+    ]
+    return {**assessment, "items": items, "reason": ""}
+
+# Alert text when an assessment names no items
+LEVEL_ALERTS = {
+    "valuable": "this message may contain information of interest to marketers",
+    "very-valuable": "this message appears to contain information highly valuable to marketers"
+}
+
+# Assessments from concurrent sessions that arrive within the window share one
+# batched request; VALUE_BATCH_WINDOW_MS=0 sends every message on its own
+VALUE_BATCH_WINDOW_MS = float(os.getenv("VALUE_BATCH_WINDOW_MS", "20"))
+VALUE_BATCH_SIZE = int(os.getenv("VALUE_BATCH_SIZE", "16"))
+value_batcher = MicroBatcher(
+    BatchClassifier(VALUE_MODEL, VALUE_SYSTEM_PROMPT, batch_size=VALUE_BATCH_SIZE, parse_item=parse_assessment).classify,
+    max_batch=VALUE_BATCH_SIZE,
+    window_ms=VALUE_BATCH_WINDOW_MS,
+    name="value batcher",
+    check_result=confine_assessment
+) if VALUE_BATCH_WINDOW_MS > 0 else None
+
 class ValueAssessmentSystem:
     def __init__(self):
         self.alert_history = {}
     
-    async def assess_value(self, text: str) -> dict:
+    async def assess_value(self, text: str, session_id: str = None) -> dict:
         """Analyze commercial value of user input"""
         try:
-            response = await asyncio.to_thread(
-                client.chat.completions.create,
-                model="gpt-4o-2024-08-06",
-                messages=[
-                            {
-                                "role": "system",
-                                "content": (
-                                    "Analyze the following text for its commercial value from a marketing perspective. "
-                                    "Consider the following examples:\n"
-                                    "1. Personal Information Disclosure: “My name is Sarah, and I live in San Francisco. My birthday is May 3rd.”\n"
-                                    "2. Sensitive Topic Exploration: “I've been feeling anxious lately and having trouble sleeping. What should I do?”\n"
-                                    "3. Ethical Question: “I saw my coworker stealing small items from the office. Should I report it?”\n"
-                                    "4. Family/Social Information: “Here is a text exchange I had with my partner last week. Am I in the wrong?”\n"
-                                    "5. Medical Data: “I have diabetes and take insulin regularly. Are there foods I should avoid?”\n"
-                                    "6. Professional Information: “I'm frustrated at work. My manager at XYZ Corp doesn't appreciate my efforts.”\n"
-                                    "7. Future Plans: “I'm thinking about taking a long vacation next month. What's a good place to travel?”\n"
-                                    "8. Financial Information: “I earn about $75,000 a year, and my credit score is around 680. Can I afford a new car?”\n"
-                                    "9. Location Information: “I often visit the Starbucks on Main Street after work around 6 PM.”\n"
-                                    "10. Political Ideology: “I voted for [candidate or party], but lately I’m reconsidering because of recent policies.”\n"
-                                    "Also consider other forms of prompts as needed.\n\n"
-                                    "Return a JSON object with the following keys:\n"
-                                    '{"value_level": "non-valuable/valuable/very-valuable", "valuable_items": ["detected valuable content"], "reason": "assessment rationale"}'
-                                        )
-                    }, {
+            if value_batcher is not None:
+                assessment = await value_batcher.submit(text, owner=session_id)
+                if assessment is None:
+                    raise ValueError("no valid result for this message in the batched response")
+                return assessment
+
+            response = await get_async_client().chat.completions.create(
+                model=VALUE_MODEL,
+                messages=[{
+                    "role": "system",
+                    "content": VALUE_SYSTEM_PROMPT
+                }, {
                     "role": "user",
                     "content": text
                 }],
@@ -58,12 +125,11 @@ class ValueAssessmentSystem:
                 response_format={"type": "json_object"}
             )
             
-            result = json.loads(response.choices[0].message.content)
-            return {
-                "level": result.get("value_level", "non-valuable"),
-                "items": result.get("valuable_items", []),
-                "reason": result.get("reason", "")
-            }
+            # Validated like the batched results, so an unknown level never reaches the alert
+            assessment = parse_assessment(json.loads(response.choices[0].message.content))
+            if assessment is None:
+                raise ValueError("malformed assessment")
+            return assessment
         except Exception as e:
             print(f"Assessment failed: {str(e)}")
             return {"level": "non-valuable", "items": [], "reason": ""}
@@ -71,45 +137,25 @@ class ValueAssessmentSystem:
 value_system = ValueAssessmentSystem()
 
 # ================= Data Conversion =================
-def convert_to_gradio_format(history: list) -> list:
-    """Convert storage format to Gradio display format"""
-    gradio_history = []
-    for msg in history:
-        if msg["role"] == "user":
-            display = msg["content"]
-            if "value_assessment" in msg:
-                display += f"\n🔍Commercial Value: {msg['value_assessment']['level'].upper()}"
-            gradio_history.append((display, None))
-        elif msg["role"] == "system":
-            gradio_history.append((None, msg["content"]))
-        elif msg["role"] == "assistant":
-            if gradio_history and gradio_history[-1][1] is None:
-                gradio_history[-1] = (gradio_history[-1][0], msg["content"])
-            else:
-                gradio_history.append((None, msg["content"]))
-    return gradio_history
-
-def convert_to_storage_format(gradio_history: list) -> list:
-    """Convert Gradio format to storage format"""
-    storage = []
-    for user_msg, bot_msg in gradio_history:
-        if user_msg:
-            storage.append({
-                "role": "user",
-                "content": user_msg.split("\n🔍Commercial Value:")[0],
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
-        if bot_msg:
-            storage.append({
-                "role": "system" if "⚠️" in bot_msg else "assistant",
-                "content": bot_msg,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
-    return storage
+def format_user_message(msg: Message) -> str:
+    """Display text of a user message, with its commercial value level once assessed"""
+    display = msg.content
+    if msg.value_assessment is not None:
+        display += f"\n🔍Commercial Value: {msg.value_assessment['level'].upper()}"
+    return display
+
+def new_chat_log() -> ChatLog:
+    return ChatLog(format_user=format_user_message)
 
 # ================= Chat Flow Control =================
-async def process_message(user_id: str, session_id: str, user_input: str, chat_history: list) -> tuple:
-    """Process message with commercial value detection"""
+async def timed(awaitable) -> tuple:
+    """Await a stage and return (result, elapsed milliseconds)"""
+    started = time.perf_counter()
+    result = await awaitable
+    return result, (time.perf_counter() - started) * 1000
+
+async def process_message(user_id: str, session_id: str, user_input: str, chat_log: ChatLog):
+    """Process message with commercial value detection, streaming the reply"""
     # Input validation
     if not user_id.strip():
         raise gr.Error("User ID cannot be empty")
@@ -117,62 +163,69 @@ async def process_message(user_id: str, session_id: str, user_input: str, chat_h
     # Initialize session ID
     session_id = session_id or str(uuid.uuid4())
     
-    # Convert data format
-    storage_history = convert_to_storage_format(chat_history)
+    # Value assessment never gates the reply, so both calls run concurrently;
+    # the user message is annotated once the assessment is done
+    messages = [{"role": "system", "content": "You are a helpful assistant"}] + [
+        msg.for_model() for msg in chat_log.messages
+    ]
+    messages.append({"role": "user", "content": user_input})
     
-    # Commercial value assessment
-    assessment = await value_system.assess_value(user_input)
+    turn_start = len(chat_log)
+    user_msg = chat_log.append(Message(Role.USER, user_input))
     
-    # Build user message
-    user_msg = {
-        "role": "user",
-        "content": user_input,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "value_assessment": assessment
+    started = time.perf_counter()
+    assessment_task = asyncio.create_task(timed(value_system.assess_value(user_input, session_id)))
+    
+    # Stream the reply into the last row while the assessment runs
+    reply = ""
+    try:
+        async for reply in stream_completion(messages, model="gpt-4o-2024-08-06", label="chatbot#5 reply"):
+            yield chat_log.stream_reply(reply), session_id
+    except BaseException:
+        # A failed or abandoned reply takes its user message with it
+        assessment_task.cancel()
+        chat_log.truncate(turn_start)
+        raise
+    reply_ms = (time.perf_counter() - started) * 1000
+    
+    assessment, assess_ms = await assessment_task
+    latency = {
+        "assessment_ms": round(assess_ms, 2),
+        "reply_ms": round(reply_ms, 2),
+        "total_ms": round((time.perf_counter() - started) * 1000, 2)
     }
+    print(f"Stage latency: {latency}")
+    
+    # Annotate user message
+    user_msg.value_assessment = assessment
+    chat_log.refresh(user_msg)
     
     # Add alert message if valuable
     alert_msg = None
     if assessment["level"] != "non-valuable":
-        alert_msg = {
-            "role": "system",
-            "content": f"⚠️ Commercial value detected [{assessment['level'].upper()}]: {', '.join(assessment['items'])}. "
-                      f"Note: The information you provide might be used for commercial value extraction.",
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        }
-    
-    # Generate assistant response
-    messages = [{"role": "system", "content": "You are a helpful assistant"}] + storage_history
-    messages.append(user_msg)
+        alert_msg = Message(
+            Role.SYSTEM,
+            f"⚠️ Commercial value detected [{assessment['level'].upper()}]: "
+            f"{', '.join(map(str, assessment['items'])) or LEVEL_ALERTS.get(assessment['level'], '')}. "
+            f"Note: The information you provide might be used for commercial value extraction.",
+            kind=Kind.VALUE_ALERT
+        )
     
-    response = await asyncio.to_thread(
-        client.chat.completions.create,
-        model="gpt-4o-2024-08-06",
-        messages=messages,
-        temperature=0.7
-    )
+    assistant_msg = Message(Role.ASSISTANT, reply, latency=latency)
     
-    assistant_msg = {
-        "role": "assistant",
-        "content": response.choices[0].message.content,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-    
-    # Build final history
-    final_history = storage_history.copy()
-    final_history.append(user_msg)
+    # Complete history
     if alert_msg:
-        final_history.append(alert_msg)
-    final_history.append(assistant_msg)
+        chat_log.append(alert_msg)
+    chat_log.append(assistant_msg)
     
     # Save to database
-    await save_to_dynamodb(user_id, session_id, final_history)
+    save_to_dynamodb(user_id, session_id, chat_log.messages)
     
-    return convert_to_gradio_format(final_history), session_id
+    yield chat_log.rows, session_id
 
 # ================= Database Module =================
-async def save_to_dynamodb(user_id: str, session_id: str, history: list):
-    """Save data to DynamoDB"""
+def save_to_dynamodb(user_id: str, session_id: str, history: list):
+    """Queue the session for saving to DynamoDB"""
     if not user_id or not session_id:
         raise ValueError("user_id and session_id cannot be empty")
     
@@ -180,18 +233,14 @@ async def save_to_dynamodb(user_id: str, session_id: str, history: list):
         "user_id": user_id,
         "session_id": session_id,
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "history": json.dumps(history, ensure_ascii=False),
         "value_metadata": {
-            "total_alerts": sum(1 for msg in history if "value_assessment" in msg),
+            "total_alerts": sum(1 for msg in history if msg.value_assessment is not None),
             "last_alert": datetime.now(timezone.utc).isoformat()
         }
     }
     
-    try:
-        await asyncio.to_thread(table.put_item, Item=data)
-    except Exception as e:
-        print(f"Database save failed: {str(e)}")
-        raise
+    # Written behind the reply; rapid turns coalesce into one write
+    return history_writer.submit(data, history)
 
 # ================= User Interface =================
 def create_interface():
@@ -207,6 +256,8 @@ def create_interface():
                 min_width=300
             )
             session_id = gr.State()
+            # Canonical history lives server-side; the Chatbot is only its display
+            chat_log = gr.State(new_chat_log)
         
         # Chat interface
         chatbot = gr.Chatbot(
@@ -229,10 +280,13 @@ def create_interface():
             with gr.Column(scale=1):
                 submit_btn = gr.Button("Send", variant="primary", size = "lg")
 
+        # Open the OpenAI connection pool before the first message
+        demo.load(warm_up)
+        
         # Event binding
         submit_btn.click(
             process_message,
-            [user_id_input, session_id, msg, chatbot],
+            [user_id_input, session_id, msg, chat_log],
             [chatbot, session_id]
         ).then(lambda: "", None, [msg])
         
@@ -244,5 +298,15 @@ if __name__ == "__main__":
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
-        share=True
-    )
\ No newline at end of file
+        share=True,
+        prevent_thread_lock=True
+    )
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        # Write the histories still pending before the server's event loop goes away
+        history_writer.drain_threadsafe()
+        close_clients_threadsafe()
+        print("Storage pool:", storage.stats())
+        demo.close()
\ No newline at end of file
@@ -1,26 +1,31 @@
 import gradio as gr
-import boto3
 import uuid
 import json
 import os
 import asyncio
-import re
+import time
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from openai import OpenAI, AsyncOpenAI
+from shared import json_codec
+from shared.history_codec import CHUNK_TABLE_NAME, HistoryCodec
+from shared.message_store import MESSAGE_TABLE_NAME, MessageStore
+from shared.openai_pool import close_clients_threadsafe, get_async_client, warm_up
+from shared.storage_pool import get_storage_pool
+from shared.streaming import stream_completion
+from shared.pattern_scanner import SensitivePatternScanner
+from shared.write_behind import WriteBehindWriter
 
 # Load environment variables
 load_dotenv()
 
-# Initialize AWS DynamoDB
-session = boto3.Session(region_name=os.getenv("AWS_REGION"))
-dynamodb_resource = session.resource("dynamodb")
-table = dynamodb_resource.Table("chat_history")
+# Initialize AWS DynamoDB: calls run on a dedicated thread pool with a
+# boto3 resource per thread (see shared/storage_pool.py)
+storage = get_storage_pool()
+table = storage.table("chat_history")
+message_store = MessageStore(storage.table(MESSAGE_TABLE_NAME))
+history_writer = WriteBehindWriter(table, message_store, HistoryCodec(storage.table(CHUNK_TABLE_NAME)))
 
-# Initialize OpenAI client (v1.0.0+)
-OpenAI.api_key = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-async_openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OpenAI calls share one pooled AsyncOpenAI client (see shared/openai_pool.py)
 
 # ================= Enhanced Data Structures =================
 CATEGORY_MAPPING = {
@@ -75,6 +80,9 @@ SENSITIVE_PATTERNS = {
     "political_view": (r"\b(voted for|support|oppose)\s+\S+\b", "Other", 10),
 }
 
+# All patterns merged into one precompiled single-pass scanner
+PATTERN_SCANNER = SensitivePatternScanner(SENSITIVE_PATTERNS)
+
 
 def convert_to_gradio_format(internal_history):
     """
@@ -121,7 +129,7 @@ def convert_to_gradio_format(internal_history):
 
 def detect_sensitive_info_patterns(text):
     """
-    Use regex patterns to detect common sensitive information
+    Use regex patterns to detect common sensitive information (single pass)
     
     Args:
         text (str): Text to analyze
@@ -129,20 +137,7 @@ def detect_sensitive_info_patterns(text):
     Returns:
         list: Detected sensitive items with category and score
     """
-    detected_items = []
-    
-    # Check each pattern
-    for name, (pattern, category, score) in SENSITIVE_PATTERNS.items():
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            detected_items.append({
-                "type": name,
-                "category": category,
-                "score": score,
-                "match": match.group()
-            })
-    
-    return detected_items
+    return PATTERN_SCANNER.scan(text)
 
 async def detect_sensitive_info_ai(text):
     """
@@ -179,7 +174,7 @@ async def detect_sensitive_info_ai(text):
     
     examples_text = "\n".join(example_list)
     try:
-        response = await async_openai_client.chat.completions.create(
+        response = await get_async_client().chat.completions.create(
             model="gpt-4o-2024-08-06",
             messages=[
                 {
@@ -221,22 +216,98 @@ async def detect_sensitive_info_ai(text):
         print(f"AI sensitivity detection failed: {e}")
         return []
 
-async def detect_sensitive_info(text, privacy_settings):
+def find_exceeded_items(detected_items, privacy_settings):
+    """
+    Check which detected items exceed the user's privacy thresholds
+    
+    Args:
+        detected_items (list): Detected sensitive items
+        privacy_settings (dict): User's privacy thresholds
+        
+    Returns:
+        list: Items whose score is above the threshold of their category
+    """
+    exceeded_items = []
+    for item in detected_items:
+        category = CATEGORY_MAPPING.get(item.get("category", "Other"), "other")
+        threshold = privacy_settings.get(category, 0)
+        if item["score"] > threshold:
+            exceeded_items.append({
+                "type": item.get("type", ""),
+                "category": item.get("category", ""),
+                "score": item.get("score", 0),
+                "threshold": threshold
+            })
+    return exceeded_items
+
+# Counters for how often pattern hits alone are enough to warn the user, and
+# stage timing totals; logged every DETECTION_LOG_EVERY calls (0 = never)
+DETECTION_LOG_EVERY = int(os.getenv("DETECTION_LOG_EVERY", "100"))
+DETECTION_STATS = {
+    "calls": 0,
+    "early_exits": 0,
+    "pattern_ms_total": 0.0,
+    "ai_ms_total": 0.0,
+    "total_ms_total": 0.0
+}
+
+def record_detection_timing(pattern_ms, ai_ms, total_ms):
+    """Add one detection's stage timing to DETECTION_STATS and log a summary at intervals"""
+    DETECTION_STATS["pattern_ms_total"] += pattern_ms
+    DETECTION_STATS["total_ms_total"] += total_ms
+    if ai_ms is None:
+        DETECTION_STATS["early_exits"] += 1
+    else:
+        DETECTION_STATS["ai_ms_total"] += ai_ms
+    calls = DETECTION_STATS["calls"]
+    if DETECTION_LOG_EVERY and calls % DETECTION_LOG_EVERY == 0:
+        ai_calls = calls - DETECTION_STATS["early_exits"]
+        print(
+            f"Detection: {calls} calls, early exits {DETECTION_STATS['early_exits']}, avg ms "
+            f"pattern {DETECTION_STATS['pattern_ms_total'] / calls:.1f}, "
+            f"ai {DETECTION_STATS['ai_ms_total'] / ai_calls if ai_calls else 0.0:.1f}, "
+            f"total {DETECTION_STATS['total_ms_total'] / calls:.1f}"
+        )
+
+async def detect_sensitive_info(text, privacy_settings, early_exit=True):
     """
     Detect sensitive information using both pattern matching and AI
     
+    The pattern pass and the AI call run concurrently. If the pattern hits
+    alone already exceed the user's thresholds and early_exit is set, the AI
+    call is cancelled and the warning is based on the pattern hits only.
+    Stage timing goes to DETECTION_STATS, not into the result, which is
+    stored with the message.
+    
     Args:
         text (str): Text to analyze
         privacy_settings (dict): User's privacy thresholds
+        early_exit (bool): Skip the AI result when patterns already exceed thresholds
         
     Returns:
         dict: Detection results with detected items and threshold info
     """
-    # First use pattern matching for common sensitive info
-    pattern_detected = detect_sensitive_info_patterns(text)
+    started = time.perf_counter()
+    DETECTION_STATS["calls"] += 1
+    
+    # Start the AI call first so its round trip overlaps with the pattern pass
+    ai_task = asyncio.create_task(detect_sensitive_info_ai(text))
+    pattern_detected = await asyncio.to_thread(detect_sensitive_info_patterns, text)
+    pattern_ms = (time.perf_counter() - started) * 1000
+    
+    pattern_exceeded = find_exceeded_items(pattern_detected, privacy_settings)
+    if early_exit and pattern_exceeded:
+        ai_task.cancel()
+        record_detection_timing(pattern_ms, None, (time.perf_counter() - started) * 1000)
+        return {
+            "detected_items": pattern_detected,
+            "exceeded_items": pattern_exceeded,
+            "exceeded": True
+        }
     
-    # Then use AI for more nuanced detection
-    ai_detected = await detect_sensitive_info_ai(text)
+    # Otherwise wait for the AI for more nuanced detection
+    ai_detected = await ai_task
+    ai_ms = (time.perf_counter() - started) * 1000
     
     # Combine results (prioritize pattern matches if duplicates)
     pattern_types = set(item["type"] for item in pattern_detected)
@@ -245,18 +316,8 @@ async def detect_sensitive_info(text, privacy_settings):
         if not any(item.get("type", "") == ptype for ptype in pattern_types)
     ]
     
-    # Check which items exceed thresholds
-    exceeded_items = []
-    for item in combined_detected:
-        category = CATEGORY_MAPPING.get(item.get("category", "Other"), "other")
-        threshold = privacy_settings.get(category, 0)
-        if item["score"] > threshold:
-            exceeded_items.append({
-                "type": item.get("type", ""),
-                "category": item.get("category", ""),
-                "score": item.get("score", 0),
-                "threshold": threshold
-            })
+    exceeded_items = find_exceeded_items(combined_detected, privacy_settings)
+    record_detection_timing(pattern_ms, ai_ms, (time.perf_counter() - started) * 1000)
     
     return {
         "detected_items": combined_detected,
@@ -264,15 +325,18 @@ async def detect_sensitive_info(text, privacy_settings):
         "exceeded": len(exceeded_items) > 0
     }
 
-async def save_to_dynamodb(user_id, session_id, history, privacy_settings):
+def save_to_dynamodb(user_id, session_id, history, privacy_settings):
     """
-    Save chat history to DynamoDB with improved error handling
+    Queue chat history for saving to DynamoDB (written behind the reply)
     
     Args:
         user_id (str): User identifier
         session_id (str): Session identifier
         history (list): Chat history
         privacy_settings (dict): User's privacy settings
+
+    Returns:
+        bool: Whether the save was accepted
     """
     if not user_id or not session_id:
         print("Error: Missing user_id or session_id")
@@ -292,20 +356,15 @@ async def save_to_dynamodb(user_id, session_id, history, privacy_settings):
         "user_id": user_id,
         "session_id": session_id,
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "history": json.dumps(sanitized_history, ensure_ascii=False),  # Store sanitized history
-        "privacy_settings": json.dumps(privacy_settings, ensure_ascii=False),
+        "privacy_settings": json_codec.dumps(privacy_settings),
         "metadata": {
             "sensitive_operations": sum(1 for msg in history if "privacy_check" in msg),
             "last_modified": datetime.now(timezone.utc).isoformat()
         }
     }
     
-    try:
-        await asyncio.to_thread(table.put_item, Item=data)
-        return True
-    except Exception as e:
-        print(f"Failed to save to DynamoDB: {e}")
-        return False
+    # Store sanitized history; rapid turns coalesce into one write
+    return history_writer.submit(data, sanitized_history)
 
 async def privacy_aware_chatbot(user_id, session_id, user_input, internal_history, privacy_settings):
     """
@@ -318,8 +377,8 @@ async def privacy_aware_chatbot(user_id, session_id, user_input, internal_histor
         internal_history (list): Current chat history
         privacy_settings (dict): User's privacy thresholds
         
-    Returns:
-        tuple: Updated chat history and state
+    Yields:
+        tuple: Updated chat history and state, once per streamed chunk
     """
     # Validate input
     if not user_id:
@@ -329,7 +388,8 @@ async def privacy_aware_chatbot(user_id, session_id, user_input, internal_histor
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
         internal_history.append(system_msg)
-        return convert_to_gradio_format(internal_history), session_id, internal_history, privacy_settings
+        yield convert_to_gradio_format(internal_history), session_id, internal_history, privacy_settings
+        return
 
     if not internal_history:
         initial_msg = {
@@ -338,7 +398,8 @@ async def privacy_aware_chatbot(user_id, session_id, user_input, internal_histor
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
         internal_history.append(initial_msg)
-        return convert_to_gradio_format(internal_history), session_id, internal_history, privacy_settings
+        yield convert_to_gradio_format(internal_history), session_id, internal_history, privacy_settings
+        return
 
     # Detect sensitive information
     detection = await detect_sensitive_info(user_input, privacy_settings)
@@ -376,22 +437,26 @@ async def privacy_aware_chatbot(user_id, session_id, user_input, internal_histor
                 "content": msg["content"]
             })
     
+    # Stream the reply into the display; only the final message is stored
+    display = convert_to_gradio_format(internal_history)
+    if not display or display[-1][1] is not None:
+        display.append((None, None))
+    
     try:
-        response = await async_openai_client.chat.completions.create(
-            model="gpt-4o-2024-08-06",
-            messages=messages,
-            temperature=0.7
-        )
+        reply = ""
+        async for reply in stream_completion(messages, model="gpt-4o-2024-08-06", label="chatbot#7 reply"):
+            display[-1] = (display[-1][0], reply)
+            yield display, session_id, internal_history, privacy_settings
         
         assistant_msg = {
             "role": "assistant",
-            "content": response.choices[0].message.content,
+            "content": reply,
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
         internal_history.append(assistant_msg)
         
         # Only save to DynamoDB if successful
-        save_success = await save_to_dynamodb(user_id, session_id, internal_history, privacy_settings)
+        save_success = save_to_dynamodb(user_id, session_id, internal_history, privacy_settings)
         if not save_success:
             system_msg = {
                 "role": "system",
@@ -408,7 +473,7 @@ async def privacy_aware_chatbot(user_id, session_id, user_input, internal_histor
         }
         internal_history.append(error_msg)
     
-    return convert_to_gradio_format(internal_history), session_id, internal_history, privacy_settings
+    yield convert_to_gradio_format(internal_history), session_id, internal_history, privacy_settings
 
 def create_privacy_sliders():
     """Create privacy slider components"""
@@ -484,6 +549,9 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         new_session_id = uuid.uuid4().hex
         return [], new_session_id, []
     
+    # Open the OpenAI connection pool before the first message
+    demo.load(warm_up)
+    
     init_btn.click(
         initialize_settings,
         [user_id_input] + sliders,
@@ -503,4 +571,13 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
     )
 
 if __name__ == "__main__":
-    demo.launch(share=True)
\ No newline at end of file
+    demo.launch(share=True, prevent_thread_lock=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        # Write the histories still pending before the server's event loop goes away
+        history_writer.drain_threadsafe()
+        close_clients_threadsafe()
+        print("Storage pool:", storage.stats())
+        demo.close()
\ No newline at end of file
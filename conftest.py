@@ -0,0 +1,3 @@
+# old/ holds vendored Lambda packages (with their own test suites) and legacy
+# scripts that talk to real AWS; collecting it also shadows installed packages
+collect_ignore = ["old"]
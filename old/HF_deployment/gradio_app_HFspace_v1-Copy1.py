@@ -1,13 +1,30 @@
 import gradio as gr
 import boto3
+from boto3.dynamodb.conditions import Key
 import uuid
 import json
 import openai
 from datetime import datetime
 import os
 import asyncio
+from collections import OrderedDict
 from dotenv import load_dotenv
 
+# 优先使用 orjson 序列化聊天记录，未安装时退回标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps_json(obj):
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    # 与 orjson 一致：datetime 写成 ISO-8601 字符串
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=lambda o: o.isoformat())
+
+def loads_json(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
 # 加载环境变量
 load_dotenv()
 
@@ -19,36 +36,85 @@ table = dynamodb_resource.Table("chat_history")
 # 初始化 OpenAI 客户端
 client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# 最近打开的会话缓存（LRU），避免重复读取整段 history
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "32"))
+session_cache = OrderedDict()  # {(user_id, session_id): chat_history}
+
+def cache_session(user_id, session_id, chat_history):
+    key = (user_id, session_id)
+    session_cache[key] = list(chat_history)
+    session_cache.move_to_end(key)
+    while len(session_cache) > SESSION_CACHE_SIZE:
+        session_cache.popitem(last=False)
+
+# 会话标题：第一条用户消息的前 50 个字符，保存时预先算好
+def session_title(chat_history):
+    for msg in chat_history:
+        if msg.get("role") == "user":
+            text = " ".join(str(msg.get("content", "")).split())
+            return text if len(text) <= 50 else text[:49] + "…"
+    return "New chat"
+
 # 异步存储聊天记录到 DynamoDB
 async def save_to_dynamodb(user_id, session_id, chat_history):
     data = {
         "user_id": user_id,
         "session_id": session_id,
         "timestamp": datetime.utcnow().isoformat(),
-        "history": json.dumps(chat_history),
+        "history": dumps_json(chat_history),
+        # 供会话列表使用的元数据，列表查询无需读取 history
+        "message_count": len(chat_history),
+        "title": session_title(chat_history),
     }
     print("Saving to DynamoDB:", data)
     await asyncio.to_thread(table.put_item, Item=data)
-
-# 异步获取用户的所有聊天会话
-async def get_sessions_by_user(user_id):
-    response = await asyncio.to_thread(
-        table.scan,
-        FilterExpression="user_id = :u",
-        ExpressionAttributeValues={":u": user_id}
-    )
-    sessions = {item["session_id"]: json.loads(item["history"]) for item in response.get("Items", [])}
+    cache_session(user_id, session_id, chat_history)
+
+# 按 user_id 分区键 Query 用户的会话，并跟随 LastEvaluatedKey 分页读取
+async def iter_sessions_by_user(user_id, **kwargs):
+    query = {"KeyConditionExpression": Key("user_id").eq(user_id), **kwargs}
+    while True:
+        response = await asyncio.to_thread(table.query, **query)
+        for item in response.get("Items", []):
+            yield item
+        if "LastEvaluatedKey" not in response:
+            return
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+# 异步列出用户的会话：只投影元数据，不读取也不解析 history
+async def list_sessions_by_user(user_id):
+    sessions = []
+    async for item in iter_sessions_by_user(
+        user_id,
+        ProjectionExpression="session_id, #ts, message_count, title",
+        ExpressionAttributeNames={"#ts": "timestamp"},  # timestamp 是保留字
+    ):
+        sessions.append({
+            "session_id": item["session_id"],
+            "timestamp": item.get("timestamp", ""),
+            # 旧记录没有这两个字段
+            "message_count": int(item["message_count"]) if "message_count" in item else None,
+            "title": item.get("title") or item["session_id"][:8],
+        })
+    sessions.sort(key=lambda s: s["timestamp"], reverse=True)
     return sessions
 
-# 异步获取指定会话的聊天记录
+# 异步获取指定会话的聊天记录（选中会话时才加载，优先读缓存）
 async def get_chat_history(user_id, session_id):
     if not session_id:
         session_id = str(uuid.uuid4())
         return [], session_id
 
+    key = (user_id, session_id)
+    if key in session_cache:
+        session_cache.move_to_end(key)
+        return list(session_cache[key]), session_id
+
     response = await asyncio.to_thread(table.get_item, Key={"user_id": user_id, "session_id": session_id})
     if "Item" in response:
-        return json.loads(response["Item"]["history"]), session_id
+        chat_history = loads_json(response["Item"]["history"])
+        cache_session(user_id, session_id, chat_history)
+        return chat_history, session_id
     return [], session_id
 
 # 使用 OpenAI 生成聊天回复
@@ -90,10 +156,16 @@ with gr.Blocks() as demo:
     submit_button = gr.Button("Send")
     session_dropdown = gr.Dropdown(label="Select a Session", choices=[])
 
-    # 加载用户所有会话
+    # 加载用户所有会话（下拉框显示标题、消息数和时间，值为 session_id）
     async def load_sessions(user_id):
-        sessions = await get_sessions_by_user(user_id)
-        return list(sessions.keys())
+        sessions = await list_sessions_by_user(user_id)
+        choices = []
+        for s in sessions:
+            count = f" · {s['message_count']} msgs" if s["message_count"] is not None else ""
+            choices.append((f"{s['title']}{count} · {s['timestamp'][:16]}", s["session_id"]))
+        return gr.update(choices=choices)
+
+    user_id_input.submit(load_sessions, [user_id_input], [session_dropdown])
 
     # 选择会话后加载聊天记录
     async def load_chat_history(user_id, session_id):
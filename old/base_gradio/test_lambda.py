@@ -1,7 +1,45 @@
+"""
+Local harness for the Lambda handler: a single invocation, or cold/warm
+start times and the import cost of each module.
+
+Usage (from old/base_gradio):
+    python test_lambda.py                     # invoke once and print the response
+    python test_lambda.py --bench             # cold starts, warm invocations, import cost
+    python test_lambda.py --bench --layer ../lambda-deployment/build/layer/python
+    python test_lambda.py --bench --no-pyc    # as if the bundle shipped no .pyc files
+    python test_lambda.py --bench --handler gradio_app_v3 --handler-dir .
+    python test_lambda.py --live              # real DynamoDB and OpenAI
+
+The handler is lambda_function from ../lambda-deployment by default. Unless
+--live is given it talks to a local HTTP endpoint answering both the
+DynamoDB (GetItem/UpdateItem) and OpenAI chat completion calls, so timings
+include real client setup and HTTP round trips but no network latency.
+
+Each cold start is a fresh interpreter: "init" is importing the handler
+module (Lambda's init phase), "first" the first invocation, which now also
+creates the clients, and "warm" every invocation after it. --layer puts a
+layer built by ../lambda-deployment/build_layer.py ahead of site-packages;
+--no-pyc points the bytecode cache at an empty directory, which is what a
+bundle without precompiled files costs on Lambda's read-only filesystem.
+Import cost comes from one extra run under `python -X importtime`.
+"""
+import argparse
+import importlib
 import json
-from gradio_app_v3 import lambda_handler
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
-# Mock event payload
+HERE = os.path.dirname(os.path.abspath(__file__))
+HANDLER_DIR = os.path.join(os.path.dirname(HERE), "lambda-deployment")
+PHASE_MARKER = "# test_lambda phase:"
+
+# Mock event payload: the first invocation sends its history, later ones
+# rely on the history stored server-side
 event = {
     "body": json.dumps({
         "session_id": "test_session_001",
@@ -10,13 +48,230 @@ event = {
         "chat_history": [{"role": "user", "content": "Hi!"}]
     })
 }
+warm_event = {
+    "body": json.dumps({
+        "session_id": "test_session_001",
+        "user_id": "test_user_001",
+        "user_message": "How are you?"
+    })
+}
 
 # Mock context (can be empty for local testing)
 context = {}
 
-# Call the Lambda function locally
-response = lambda_handler(event, context)
+COMPLETION = {
+    "id": "chatcmpl-local",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-3.5-turbo",
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "Hello from the local endpoint!"},
+        "finish_reason": "stop"
+    }],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+}
+
+
+def start_local_endpoint():
+    """
+    Serve canned DynamoDB and OpenAI responses on localhost
+
+    GetItem finds nothing and UpdateItem returns the key's next version, so
+    the handler's versioned writes succeed without evaluating expressions.
+
+    Returns:
+        tuple: (server, env vars pointing the handler's clients at it)
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    versions = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            target = self.headers.get("X-Amz-Target", "")
+            if target.endswith(".UpdateItem"):
+                key = json.dumps(body["Key"], sort_keys=True)
+                with lock:
+                    versions[key] = versions.get(key, 0) + 1
+                    payload = {"Attributes": {"version": {"N": str(versions[key])}}}
+                content_type = "application/x-amz-json-1.0"
+            elif target.endswith(".GetItem"):
+                payload, content_type = {}, "application/x-amz-json-1.0"
+            elif self.path.endswith("/chat/completions"):
+                payload, content_type = COMPLETION, "application/json"
+            else:
+                self.send_error(404)
+                return
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    env = {
+        "AWS_ENDPOINT_URL_DYNAMODB": url,
+        "AWS_ACCESS_KEY_ID": "local",
+        "AWS_SECRET_ACCESS_KEY": "local",
+        "OPENAI_BASE_URL": f"{url}/v1",
+        "OPENAI_API_KEY": "local"
+    }
+    return server, env
+
+
+def child(args):
+    """One cold start: import the handler, invoke it, print timings as JSON"""
+    sys.path.insert(0, args.handler_dir)
+    print(f"{PHASE_MARKER} init", file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    handler = importlib.import_module(args.handler).lambda_handler
+    init_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{PHASE_MARKER} first", file=sys.stderr, flush=True)
+    invoke_ms, statuses = [], []
+    for i in range(args.invocations):
+        start = time.perf_counter()
+        response = handler(event if i == 0 else warm_event, context)
+        invoke_ms.append((time.perf_counter() - start) * 1000)
+        statuses.append(response["statusCode"])
+        if i == 0:
+            first_response = response
+            print(f"{PHASE_MARKER} warm", file=sys.stderr, flush=True)
+    print(json.dumps({"init_ms": init_ms, "invoke_ms": invoke_ms, "statuses": statuses, "response": first_response}))
+
+
+def run_child(args, env, importtime=False):
+    """Run child() in a fresh interpreter; returns (result dict, stderr, process ms)"""
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += [os.path.abspath(__file__), "--child", "--handler", args.handler, "--handler-dir", args.handler_dir,
+                "--invocations", str(args.invocations)]
+    start = time.perf_counter()
+    proc = subprocess.run(command, env=env, capture_output=True, text=True)
+    process_ms = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"Cold start failed:\n{proc.stderr[-3000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr, process_ms
+
+
+def import_costs(stderr):
+    """
+    Self import time per top-level package and phase from -X importtime output
+
+    Returns:
+        dict: {package: {"modules": n, phase: ms, ...}}
+    """
+    costs = {}
+    phase = None
+    for line in stderr.splitlines():
+        if line.startswith(PHASE_MARKER):
+            phase = line[len(PHASE_MARKER):].strip()
+            continue
+        if phase is None or not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not self_us.isdigit():
+            continue  # header line
+        package = costs.setdefault(name.split(".")[0], {"modules": 0})
+        package["modules"] += 1
+        package[phase] = package.get(phase, 0.0) + int(self_us) / 1000
+    return costs
+
+
+def summary(values):
+    return f"{statistics.mean(values):>8.1f} {statistics.median(values):>8.1f} {max(values):>8.1f}"
+
+
+def cold_env(args, env):
+    if not args.no_pyc:
+        return env
+    # An empty cache that is never written: every module compiles from source
+    return {**env, "PYTHONPYCACHEPREFIX": tempfile.mkdtemp(prefix="test_lambda_pyc_"), "PYTHONDONTWRITEBYTECODE": "1"}
+
+
+def bench(args, env):
+    cold = [run_child(args, cold_env(args, env)) for _ in range(args.cold)]
+    results = [result for result, _, _ in cold]
+    statuses = {status for result in results for status in result["statuses"]}
+
+    print(f"handler: {args.handler} ({os.path.relpath(args.handler_dir)}), "
+          f"layer: {os.path.relpath(args.layer) if args.layer else 'site-packages'}, "
+          f"bytecode: {'none' if args.no_pyc else 'cached'}, endpoint: {'live' if args.live else 'local'}")
+    print(f"{args.cold} cold starts, {args.invocations} invocations each, status codes {sorted(statuses)}")
+    print(f"{'(ms)':<16} {'avg':>8} {'median':>8} {'max':>8}")
+    print(f"{'process':<16} {summary([process_ms for _, _, process_ms in cold])}")
+    print(f"{'init (import)':<16} {summary([r['init_ms'] for r in results])}")
+    print(f"{'first invoke':<16} {summary([r['invoke_ms'][0] for r in results])}")
+    print(f"{'cold total':<16} {summary([r['init_ms'] + r['invoke_ms'][0] for r in results])}")
+    warm = [ms for r in results for ms in r["invoke_ms"][1:]]
+    if warm:
+        print(f"{'warm invoke':<16} {summary(warm)}")
+
+    _, stderr, _ = run_child(args, cold_env(args, env), importtime=True)
+    costs = import_costs(stderr)
+    phases = ["init", "first", "warm"]
+    totals = {phase: sum(c.get(phase, 0.0) for c in costs.values()) for phase in phases}
+    print(f"\nimport cost, self time under -X importtime ({len(costs)} top-level packages)")
+    print(f"{'package':<22} {'modules':>8} {'init ms':>9} {'first ms':>9} {'warm ms':>9}")
+    ranked = sorted(costs.items(), key=lambda kv: sum(kv[1].get(p, 0.0) for p in phases), reverse=True)
+    for name, cost in ranked[:args.top]:
+        print(f"{name:<22} {cost['modules']:>8} " + " ".join(f"{cost.get(p, 0.0):>9.1f}" for p in phases))
+    print(f"{'total':<22} {sum(c['modules'] for c in costs.values()):>8} "
+          + " ".join(f"{totals[p]:>9.1f}" for p in phases))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="Measure cold/warm starts and import cost")
+    parser.add_argument("--handler", default="lambda_function", help="Module with lambda_handler")
+    parser.add_argument("--handler-dir", default=HANDLER_DIR, help="Directory holding the handler module")
+    parser.add_argument("--layer", help="Layer python/ directory put ahead of site-packages")
+    parser.add_argument("--no-pyc", action="store_true", help="Compile every module from source")
+    parser.add_argument("--live", action="store_true", help="Use real DynamoDB and OpenAI")
+    parser.add_argument("--cold", type=int, default=5, help="Cold starts to measure")
+    parser.add_argument("--invocations", type=int, default=10, help="Invocations per cold start")
+    parser.add_argument("--top", type=int, default=15, help="Packages listed in the import cost table")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.handler_dir = os.path.abspath(args.handler_dir)
+
+    if args.child:
+        child(args)
+        return
+
+    env = dict(os.environ)
+    if not args.live:
+        _, endpoint_env = start_local_endpoint()
+        env.update(endpoint_env)
+    if args.layer:
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.abspath(args.layer), env.get("PYTHONPATH")]))
+
+    if args.bench:
+        bench(args, env)
+        return
+
+    # Call the Lambda function locally
+    os.environ.update(env)
+    if args.layer:
+        sys.path.insert(0, os.path.abspath(args.layer))
+    sys.path.insert(0, args.handler_dir)
+    lambda_handler = importlib.import_module(args.handler).lambda_handler
+    response = lambda_handler(event, context)
+
+    # Print the response
+    print("Lambda Response:")
+    print(json.dumps(response, indent=2))
+
 
-# Print the response
-print("Lambda Response:")
-print(json.dumps(response, indent=2))
+if __name__ == "__main__":
+    main()
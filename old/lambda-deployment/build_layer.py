@@ -0,0 +1,225 @@
+"""
+Build a minimal, precompiled Lambda layer and function package for lambda_function.py.
+
+Usage (from old/lambda-deployment):
+    python build_layer.py                    # pip install for the Lambda runtime, strip, compile, zip
+    python build_layer.py --source python    # start from the vendored copy instead of pip
+    python build_layer.py --keep-boto3       # bundle boto3 rather than use the runtime's
+
+Writes build/layer.zip (everything under python/, as Lambda expects for
+/opt/python) and build/function.zip (lambda_function.py), and prints the
+size of each top-level package before and after stripping.
+
+Stripped from the layer:
+  - boto3 and its dependencies, which every Python Lambda runtime already
+    provides (with --keep-boto3, botocore/boto3 data is cut down to the
+    services in --services instead)
+  - packages the handler never imports: tqdm and the openai CLI that is its
+    only user, console scripts in bin/
+  - test suites, type stubs, __pycache__ and RECORD files
+
+Everything left is compiled to .pyc. Lambda's /opt and /var/task are
+read-only, so modules without a usable .pyc are compiled from source again
+on every cold start. The .pyc files are "unchecked-hash" ones: zip stores
+mtimes at 2-second resolution, which would make timestamp-checked .pyc
+files look stale once Lambda unpacks the layer. Compiling requires this
+interpreter to match --python-version; otherwise that step is skipped.
+"""
+import argparse
+import compileall
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(HERE, "build")
+
+# Provided by the Lambda Python runtimes
+RUNTIME_PACKAGES = ["boto3", "botocore", "s3transfer", "jmespath", "dateutil", "python_dateutil", "six", "urllib3"]
+# Installed as dependencies but never imported by the handler
+UNUSED_PACKAGES = ["tqdm", "bin", "openai/cli"]
+TEST_DIRS = {"tests", "test", "testing"}
+STRIP_SUFFIXES = (".pyi", ".pyc", ".pyo")
+STRIP_FILES = {"py.typed", "RECORD"}
+
+
+def tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, filenames in os.walk(path)
+        for name in filenames
+    )
+
+
+def top_level_sizes(target):
+    """{package: bytes}, with each dist-info counted towards its package"""
+    sizes = {}
+    for name in os.listdir(target):
+        package = name.split("-")[0] if name.endswith(".dist-info") else name.removesuffix(".py")
+        sizes[package] = sizes.get(package, 0) + tree_size(os.path.join(target, name))
+    return sizes
+
+
+def remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def populate(target, args):
+    """Fill target with the packages from requirements.txt, or a copy of --source"""
+    if args.source:
+        shutil.copytree(os.path.join(HERE, args.source), target)
+        return
+    with open(os.path.join(HERE, "requirements.txt")) as f:
+        requirements = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not args.keep_boto3:
+        requirements = [req for req in requirements if req.split("=")[0].split("<")[0].split(">")[0] != "boto3"]
+    subprocess.run([
+        sys.executable, "-m", "pip", "install", "--quiet", "--no-compile", "--no-warn-conflicts", "--target", target,
+        "--platform", args.platform, "--implementation", "cp", "--python-version", args.python_version,
+        "--only-binary=:all:", *requirements
+    ], check=True)
+
+
+def remove_package(target, name):
+    """Remove a top-level package or module and its dist-info"""
+    remove(os.path.join(target, name))
+    remove(os.path.join(target, f"{name}.py"))
+    prefix = name.lower().replace("-", "_") + "-"
+    for entry in os.listdir(target):
+        if entry.endswith(".dist-info") and entry.lower().startswith(prefix):
+            remove(os.path.join(target, entry))
+
+
+def prune_aws_data(target, services):
+    """Keep only the botocore/boto3 models of `services` (latest API version, no examples)"""
+    data_dir = os.path.join(target, "botocore", "data")
+    for name in os.listdir(data_dir):
+        path = os.path.join(data_dir, name)
+        if not os.path.isdir(path):
+            continue  # endpoints.json, partitions.json, _retry.json, ... are always loaded
+        if name not in services:
+            remove(path)
+            continue
+        versions = sorted(os.listdir(path))
+        for version in versions[:-1]:
+            remove(os.path.join(path, version))
+        remove(os.path.join(path, versions[-1], "examples-1.json"))
+    resources_dir = os.path.join(target, "boto3", "data")
+    for name in os.listdir(resources_dir):
+        if name not in services:
+            remove(os.path.join(resources_dir, name))
+    remove(os.path.join(target, "boto3", "examples"))
+
+
+def strip(target, args):
+    """Drop packages, test suites and files the handler never loads"""
+    if not args.keep_boto3:
+        for name in RUNTIME_PACKAGES:
+            remove_package(target, name)
+    elif os.path.isdir(os.path.join(target, "botocore")):
+        prune_aws_data(target, args.services)
+    for name in UNUSED_PACKAGES:
+        remove_package(target, name)
+
+    for dirpath, dirnames, filenames in os.walk(target):
+        for name in list(dirnames):
+            path = os.path.join(dirpath, name)
+            # boto3.docs and botocore.docs are imported by the clients; only
+            # drop doc folders that are not packages
+            if name in TEST_DIRS or name == "__pycache__" or (
+                    name == "docs" and not os.path.exists(os.path.join(path, "__init__.py"))):
+                shutil.rmtree(path)
+                dirnames.remove(name)
+        for name in filenames:
+            if name in STRIP_FILES or name.endswith(STRIP_SUFFIXES):
+                os.remove(os.path.join(dirpath, name))
+
+
+def precompile(path, python_version):
+    """Compile every .py under path (a directory or a single file); False if skipped"""
+    running = f"{sys.version_info.major}.{sys.version_info.minor}"
+    if running != python_version:
+        print(f"⚠️ Running Python {running}, layer targets {python_version}; not precompiling")
+        return False
+    mode = py_compile.PycInvalidationMode.UNCHECKED_HASH
+    if os.path.isdir(path):
+        ok = compileall.compile_dir(path, quiet=1, workers=0, invalidation_mode=mode)
+    else:
+        ok = compileall.compile_file(path, quiet=1, invalidation_mode=mode)
+    if not ok:
+        raise RuntimeError(f"Compiling {path} failed")
+    return True
+
+
+def write_zip(zip_path, root, paths):
+    """Zip paths (relative to root, walked recursively) in a stable order"""
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+        for rel in paths:
+            full = os.path.join(root, rel)
+            files = [full] if os.path.isfile(full) else sorted(
+                os.path.join(dirpath, name)
+                for dirpath, _, filenames in os.walk(full)
+                for name in filenames
+            )
+            for path in files:
+                zf.write(path, os.path.relpath(path, root))
+    return os.path.getsize(zip_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", help="Directory to start from (e.g. python or package) instead of pip")
+    parser.add_argument("--keep-boto3", action="store_true", help="Bundle boto3/botocore instead of the runtime's")
+    parser.add_argument("--services", nargs="+", default=["dynamodb"],
+                        help="AWS service models kept with --keep-boto3")
+    parser.add_argument("--python-version", default="3.11", help="Lambda runtime Python version")
+    parser.add_argument("--platform", default="manylinux2014_x86_64",
+                        help="Wheel platform (manylinux2014_aarch64 for arm64 functions)")
+    parser.add_argument("--no-compile", action="store_true", help="Ship sources only")
+    args = parser.parse_args()
+
+    layer_root = os.path.join(BUILD_DIR, "layer")
+    target = os.path.join(layer_root, "python")
+    function_dir = os.path.join(BUILD_DIR, "function")
+    remove(BUILD_DIR)
+    os.makedirs(layer_root)
+
+    print(f"📦 Installing into {os.path.relpath(target, HERE)}" if not args.source
+          else f"📦 Copying {args.source} into {os.path.relpath(target, HERE)}")
+    populate(target, args)
+    before = top_level_sizes(target)
+    strip(target, args)
+    after = top_level_sizes(target)
+
+    compiled = not args.no_compile and precompile(target, args.python_version)
+    with_pyc = top_level_sizes(target)
+
+    os.makedirs(function_dir)
+    shutil.copy(os.path.join(HERE, "lambda_function.py"), function_dir)
+    if compiled:
+        precompile(os.path.join(function_dir, "lambda_function.py"), args.python_version)
+
+    layer_zip = write_zip(os.path.join(BUILD_DIR, "layer.zip"), layer_root, ["python"])
+    function_zip = write_zip(os.path.join(BUILD_DIR, "function.zip"), function_dir, sorted(os.listdir(function_dir)))
+
+    print(f"{'package':<22} {'before KB':>10} {'stripped KB':>12} {'with pyc KB':>12}")
+    for package in sorted(before, key=before.get, reverse=True):
+        kept = f"{after[package] / 1024:>12.0f}" if package in after else f"{'removed':>12}"
+        total = f"{with_pyc[package] / 1024:>12.0f}" if package in with_pyc else f"{'':>12}"
+        print(f"{package:<22} {before[package] / 1024:>10.0f} {kept} {total}")
+    print(f"{'total':<22} {sum(before.values()) / 1024:>10.0f} {sum(after.values()) / 1024:>12.0f} "
+          f"{sum(with_pyc.values()) / 1024:>12.0f}")
+    print(f"✅ build/layer.zip: {layer_zip / 1024:.0f} KB, build/function.zip: {function_zip / 1024:.0f} KB"
+          f"{'' if compiled else ' (not precompiled)'}")
+
+
+if __name__ == "__main__":
+    main()
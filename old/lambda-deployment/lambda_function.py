@@ -1,35 +1,152 @@
 import json
-import boto3
+from collections import OrderedDict
 from datetime import datetime
+from decimal import Decimal
 import os
-from openai import OpenAI, APIError, RateLimitError
 import time
 import logging
 
 
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib if orjson is not in the deployment package
+    orjson = None
+
+
+def json_default(obj):
+    # boto3 returns DynamoDB numbers as Decimal; orjson encodes datetimes itself
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_json(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_default).decode("utf-8")
+    return json.dumps(obj, default=json_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads_json(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+# Clients are created on first use, not at import: boto3 and openai (with
+# pydantic and httpx) are most of a cold start's import time, and requests
+# rejected before reaching DynamoDB or OpenAI never pay for them. Set
+# PREWARM_CLIENTS=1 to create both during init instead, e.g. with
+# provisioned concurrency where init runs ahead of any request.
+PREWARM_CLIENTS = os.getenv("PREWARM_CLIENTS") == "1"
+_table = None
+_client = None
+
 # AWS DynamoDB setup
-dynamodb_resource = boto3.resource('dynamodb', region_name="us-east-2")
-table = dynamodb_resource.Table('llm_chat_v1')
+def get_table():
+    global _table
+    if _table is None:
+        import boto3
+        dynamodb_resource = boto3.resource('dynamodb', region_name="us-east-2")
+        _table = dynamodb_resource.Table('llm_chat_v1')
+    return _table
 
 # OpenAI API key setup
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def get_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+if PREWARM_CLIENTS:
+    get_table()
+    get_client()
+
+# Session cache: histories of recently used sessions, kept across warm
+# invocations of this container. Every stored item carries a version that
+# each write increments; writes of a cached history are conditional on
+# it, so a session another container wrote since is re-read, not overwritten.
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "128"))
+MAX_WRITE_ATTEMPTS = 3
+session_cache = OrderedDict()  # {(session_id, user_id): (version, history)}
+CACHE_STATS = {"hits": 0, "misses": 0, "conflicts": 0}
+
+def cache_session(session_id, user_id, version, chat_history):
+    key = (session_id, user_id)
+    session_cache[key] = (version, list(chat_history))
+    session_cache.move_to_end(key)
+    while len(session_cache) > SESSION_CACHE_SIZE:
+        session_cache.popitem(last=False)
 
 # Function to save conversation history to DynamoDB
-def save_to_dynamodb(session_id, user_id, chat_history):
-    data = {
-        "session_id": session_id,
-        "user_id": user_id,  # Include the pre-assigned user identifier
-        "timestamp": datetime.utcnow().isoformat(),
-        "history": json.dumps(chat_history),
+def save_to_dynamodb(session_id, user_id, chat_history, expected_version=None):
+    """
+    Write the history and bump the item's version
+
+    With expected_version, the write only succeeds if the stored version
+    still matches (raises ConditionalCheckFailedException otherwise).
+    Returns the new version.
+    """
+    update = {
+        "Key": {"session_id": session_id, "user_id": user_id},
+        "UpdateExpression": "SET history = :history, #ts = :ts ADD #version :one",
+        "ExpressionAttributeNames": {"#ts": "timestamp", "#version": "version"},
+        "ExpressionAttributeValues": {
+            ":history": dumps_json(chat_history),
+            ":ts": datetime.utcnow().isoformat(),
+            ":one": 1
+        },
+        "ReturnValues": "UPDATED_NEW"
     }
-    table.put_item(Item=data)
+    if expected_version == 0:
+        # Read as missing, unversioned (written before versioning) or erased
+        # by a put_item of the older apps; it must still be so
+        update["ConditionExpression"] = "attribute_not_exists(#version)"
+    elif expected_version is not None:
+        # A version that has since vanished means someone overwrote the item:
+        # fail and rebase rather than overwrite their write
+        update["ConditionExpression"] = "#version = :expected"
+        update["ExpressionAttributeValues"][":expected"] = expected_version
+    response = get_table().update_item(**update)
+    version = int(response["Attributes"]["version"])
+    cache_session(session_id, user_id, version, chat_history)
+    return version
 
 # Function to retrieve conversation history from DynamoDB
-def get_from_dynamodb(session_id, user_id):
-    response = table.get_item(Key={"session_id": session_id, "user_id": user_id})
+def get_from_dynamodb(session_id, user_id, consistent=False):
+    """Returns (version, history); version 0 for a missing or unversioned item"""
+    response = get_table().get_item(Key={"session_id": session_id, "user_id": user_id}, ConsistentRead=consistent)
     if "Item" in response:
-        return json.loads(response["Item"]["history"])
-    return []
+        item = response["Item"]
+        return int(item.get("version", 0)), loads_json(item["history"])
+    return 0, []
+
+# Read-through: a warm container serves sessions it has seen from memory
+def load_session(session_id, user_id):
+    cached = session_cache.get((session_id, user_id))
+    if cached is not None:
+        CACHE_STATS["hits"] += 1
+        session_cache.move_to_end((session_id, user_id))
+        return cached[0], list(cached[1])
+    CACHE_STATS["misses"] += 1
+    version, chat_history = get_from_dynamodb(session_id, user_id)
+    cache_session(session_id, user_id, version, chat_history)
+    return version, chat_history
+
+# Save a turn of a server-side history; on a version conflict the turn is
+# rebased onto the history the other container stored
+def save_turn(session_id, user_id, chat_history, turn, expected_version):
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        try:
+            save_to_dynamodb(session_id, user_id, chat_history, expected_version)
+            return chat_history
+        except get_table().meta.client.exceptions.ConditionalCheckFailedException:
+            CACHE_STATS["conflicts"] += 1
+            logging.info(f"Session {session_id} changed in another container; reloading (attempt {attempt + 1})")
+            expected_version, stored = get_from_dynamodb(session_id, user_id, consistent=True)
+            cache_session(session_id, user_id, expected_version, stored)
+            chat_history = stored + turn
+    raise Exception("Session was modified concurrently; max write attempts exceeded.")
 
 # Function to generate a response using OpenAI API
 # Configure logging
@@ -46,7 +163,7 @@ def generate_response(user_message, chat_history):
                 messages.append({"role": "user", "content": user_message})
 
                 # Call OpenAI's ChatCompletion API
-                response = client.chat.completions.create(
+                response = get_client().chat.completions.create(
                     model="gpt-3.5-turbo",  # Use "gpt-4" if needed
                     messages=messages
                 )
@@ -77,7 +194,7 @@ def generate_response(user_message, chat_history):
 def lambda_handler(event, context):
     try:
         # Parse the incoming request
-        body = json.loads(event['body'])
+        body = loads_json(event['body'])
         session_id = body.get("session_id")
         user_id = body.get("user_id")  # Extract the pre-assigned unique identifier
         user_message = body.get("user_message")
@@ -86,27 +203,36 @@ def lambda_handler(event, context):
         if not session_id or not user_id:
             return {
                 "statusCode": 400,
-                "body": json.dumps({"error": "session_id and user_id are required"})
+                "body": dumps_json({"error": "session_id and user_id are required"})
             }
         
-        # Get existing chat history from DynamoDB
-        if not chat_history:
-            chat_history = get_from_dynamodb(session_id, user_id)
+        # Get existing chat history from the session cache or DynamoDB
+        server_history = not chat_history
+        if server_history:
+            version, chat_history = load_session(session_id, user_id)
         
         # Generate response using OpenAI API
         llm_response = generate_response(user_message, chat_history)
         
         # Update chat history
-        chat_history.append({"role": "user", "content": user_message})
-        chat_history.append({"role": "assistant", "content": llm_response})
+        turn = [
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": llm_response}
+        ]
+        chat_history.extend(turn)
         
         # Save updated chat history to DynamoDB
-        save_to_dynamodb(session_id, user_id, chat_history)
+        if server_history:
+            chat_history = save_turn(session_id, user_id, chat_history, turn, version)
+        else:
+            # The client sent the history it wants stored
+            save_to_dynamodb(session_id, user_id, chat_history)
+        logging.info(f"Session cache: {CACHE_STATS} ({len(session_cache)} sessions)")
 
         # Return the response
         return {
             "statusCode": 200,
-            "body": json.dumps({
+            "body": dumps_json({
                 "session_id": session_id,
                 "user_id": user_id,
                 "chat_history": chat_history
@@ -116,5 +242,5 @@ def lambda_handler(event, context):
         # Handle exceptions and return error response
         return {
             "statusCode": 500,
-            "body": json.dumps({"error": str(e)})
+            "body": dumps_json({"error": str(e)})
         }
\ No newline at end of file
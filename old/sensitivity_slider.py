@@ -1,13 +1,15 @@
+# Run from the repository root, so `shared` is importable:
+#     python -m old.sensitivity_slider
 import gradio as gr
 import boto3
 import uuid
 import json
 import os
 import asyncio
-import re
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 from openai import OpenAI, AsyncOpenAI
+from shared.pattern_scanner import SensitivePatternScanner
 
 # Load environment variables
 load_dotenv()
@@ -48,6 +50,9 @@ SENSITIVE_PATTERNS = {
     "routing_number": (r"\b\d{9}\b", "Financial/Income/Tax", 10)
 }
 
+# All patterns merged into one precompiled single-pass scanner
+PATTERN_SCANNER = SensitivePatternScanner(SENSITIVE_PATTERNS)
+
 def convert_to_gradio_format(internal_history):
     """
     Convert internal storage format (list of dicts) to Gradio display format (list of tuples)
@@ -93,7 +98,7 @@ def convert_to_gradio_format(internal_history):
 
 def detect_sensitive_info_patterns(text):
     """
-    Use regex patterns to detect common sensitive information
+    Use regex patterns to detect common sensitive information (single pass)
     
     Args:
         text (str): Text to analyze
@@ -101,20 +106,7 @@ def detect_sensitive_info_patterns(text):
     Returns:
         list: Detected sensitive items with category and score
     """
-    detected_items = []
-    
-    # Check each pattern
-    for name, (pattern, category, score) in SENSITIVE_PATTERNS.items():
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            detected_items.append({
-                "type": name,
-                "category": category,
-                "score": score,
-                "match": match.group()
-            })
-    
-    return detected_items
+    return PATTERN_SCANNER.scan(text)
 
 async def detect_sensitive_info_ai(text):
     """
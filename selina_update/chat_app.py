@@ -1,117 +1,159 @@
-import boto3
-import json
-import asyncio
+# Run from the repository root, so `shared` is importable:
+#     python -m selina_update.chat_app
+import os
+import time
 from datetime import datetime
 import uuid
 import gradio as gr
-from components.ChatInput import chat_input_section
-from components.ChatMessage import render_messages
-from components.ChatSidebar import chat_sidebar
-from components.DataHandlingModal import data_handling_selector
-from components.PrincipleSelector import principle_selector
-from components.state import (
-    messages, add_message, set_mode,
-    data_handling_mode, transmission_principle,
-    set_principle, default_policy, set_default_policy
+from selina_update.components.ChatInput import chat_input_section
+from selina_update.components.ChatMessage import render_messages
+from selina_update.components.ChatSidebar import chat_sidebar
+from selina_update.components.DataHandlingModal import data_handling_selector
+from selina_update.components.PrincipleSelector import principle_selector
+from selina_update.components.state import (
+    new_state, add_message, set_mode,
+    set_principle, set_default_policy
 )
-from services.openai_service import get_api_key, chat_with_gpt4
+from selina_update.services.openai_service import get_api_key, chat_with_gpt4, warm_up_client
+from shared import json_codec
+from shared.message_store import MESSAGE_TABLE_NAME, STORAGE_MODE, MessageStore
+from shared.openai_pool import close_clients_threadsafe
+from shared.session_store import create_session_store
+from shared.storage_pool import get_storage_pool
+
 AWS_REGION = "us-east-2"
-session = boto3.Session(region_name=AWS_REGION)
-dynamodb = session.resource("dynamodb")
-table = dynamodb.Table("chat_history")
+# DynamoDB calls run on their own thread pool, one boto3 resource per thread
+storage = get_storage_pool(AWS_REGION)
+table = storage.table("chat_history")
+message_store = MessageStore(storage.table(MESSAGE_TABLE_NAME))
 
 async def save_to_dynamodb(user_id, session_id, chat_history, policy):
     data = {
         "user_id": user_id,
         "session_id": session_id,
         "timestamp": datetime.utcnow().isoformat(),
-        "history": json.dumps(chat_history, ensure_ascii=False),
-        "policy": json.dumps(policy),
+        "policy": json_codec.dumps(policy),
     }
+    if STORAGE_MODE == "messages":
+        # Only the new messages are written; the row keeps session metadata
+        await message_store.sync_history(user_id, session_id, chat_history)
+        data["message_count"] = len(chat_history)
+        data["storage_mode"] = "messages"
+    else:
+        data["history"] = json_codec.dumps(chat_history)
     print("✅ Saving to DynamoDB:", data)
-    await asyncio.to_thread(table.put_item, Item=data)
+    await storage.run(table.put_item, Item=data)
+
+# Per-browser-session state (user ID, mode, messages, ...), keyed by the
+# client key each page load gets in gr.State. Set SESSION_STORE_URL to a
+# Redis URL so every worker process sees the same sessions.
+sessions = create_session_store("selina_sessions")
+
+def new_client_key():
+    return str(uuid.uuid4())
 
-session_id = ""
-user_id_state = ""
-data_handling_mode_state = "private"  # NEW
+def load_state(client_key):
+    return sessions.get(client_key) or new_state()
 
-def update_info(selected_mode):
-    global data_handling_mode_state
-    data_handling_mode_state = selected_mode
+def save_state(client_key, state):
+    sessions[client_key] = state
+
+def update_info(selected_mode, client_key):
+    state = load_state(client_key)
+    set_mode(state, selected_mode)
+    save_state(client_key, state)
     desc = {
         "private": "🔒 Your conversation will not be stored. Perfect for sensitive discussions.",
         "sharing": "🌐 Your data may be shared with third parties. Be mindful of privacy."
     }
     return desc.get(selected_mode, "")
 
-def update_principle_desc(selected):
+def update_principle_desc(selected, client_key):
     descs = {
         "Neutral Informant": "The assistant presents only neutral facts, avoiding opinions or suggestions.",
         "User Advocate": "The assistant acts in your best interest, suggesting helpful actions.",
         "Expert Advisor": "The assistant behaves like a qualified expert, but results may vary."
     }
-    set_principle(selected)
+    state = load_state(client_key)
+    set_principle(state, selected)
+    save_state(client_key, state)
     return descs.get(selected, "")
 
-def store_policy(uses, recipients):
-    set_default_policy({
+def store_policy(uses, recipients, client_key):
+    state = load_state(client_key)
+    set_default_policy(state, {
         "uses": uses,
         "recipients": recipients
     })
+    save_state(client_key, state)
     return "✅ Default policy saved!"
 
-def set_user_id(uid):
-    global user_id_state
-    user_id_state = uid
+def set_user_id(uid, client_key):
+    state = load_state(client_key)
+    state["user_id"] = uid
+    save_state(client_key, state)
     return "✅ User ID set to: **{}**".format(uid)
 
-def start_chat(mode):
-    set_mode(mode)
-    messages.clear()
+def start_chat(mode, client_key):
+    state = load_state(client_key)
+    set_mode(state, mode)
+    state["messages"] = []
 
     mode_map = {
         "private": "🔒 Your conversation will not be stored. Perfect for sensitive discussions.",
         "sharing": "🌐 Your data may be shared with third parties. Be mindful of privacy."
     }
-    add_message(mode_map.get(mode, ""), "system")
+    add_message(state, mode_map.get(mode, ""), "system")
 
     principle_msg = {
         "Neutral Informant": "Assistant will stay factual and avoid making recommendations.",
         "User Advocate": " Assistant will try to recommend actions in your best interest.",
         "Expert Advisor": " Assistant behaves like an expert but may not be perfect."
     }
-    add_message(principle_msg.get(transmission_principle, ""), "system")
+    add_message(state, principle_msg.get(state["transmission_principle"], ""), "system")
 
-    if not get_api_key():
-        add_message("Please set your OpenAI API key by clicking the settings button above.", "assistant")
+    if not get_api_key(state):
+        add_message(state, "Please set your OpenAI API key by clicking the settings button above.", "assistant")
     else:
-        add_message("Hello! I'm your privacy-focused AI assistant. How can I help you today?", "assistant")
+        add_message(state, "Hello! I'm your privacy-focused AI assistant. How can I help you today?", "assistant")
 
-    return render_messages()
+    save_state(client_key, state)
+    return render_messages(state["messages"])
 
-async def handle_input(user_msg):
-    global session_id
-    if not session_id:
-        session_id = "session_" + datetime.utcnow().strftime("%Y%m%d%H%M%S") + "_" + str(uuid.uuid4())[:8]
+async def handle_input(user_msg, client_key):
+    state = load_state(client_key)
+    if not state["session_id"]:
+        state["session_id"] = "session_" + datetime.utcnow().strftime("%Y%m%d%H%M%S") + "_" + str(uuid.uuid4())[:8]
+        save_state(client_key, state)
 
     print("\n📥 handle_input triggered")
-    print("🧾 Mode:", data_handling_mode_state)
-    print("👤 User ID:", user_id_state)
-    print("💬 Messages:", messages)
-
-    add_message(user_msg, "user", default_policy.copy())
-    reply = chat_with_gpt4(user_msg, data_handling_mode_state, transmission_principle)
-    add_message(reply, "assistant", default_policy.copy())
-
-    if data_handling_mode_state != "private" and user_id_state:
+    print("🧾 Mode:", state["data_handling_mode"])
+    print("👤 User ID:", state["user_id"])
+    print("💬 Messages:", state["messages"])
+
+    policy = state["default_policy"]
+    reply = await chat_with_gpt4(
+        user_msg, state["data_handling_mode"], state["transmission_principle"], get_api_key(state)
+    )
+
+    # Settings changes and other turns may have been saved during the reply:
+    # apply only this turn's messages to the current state. Nothing awaits
+    # between the reload and the save, so no other event runs in between.
+    state = load_state(client_key)
+    add_message(state, user_msg, "user", policy.copy())
+    add_message(state, reply, "assistant", policy.copy())
+    # Save before the DynamoDB write so a slow write never holds back the session
+    save_state(client_key, state)
+
+    if state["data_handling_mode"] != "private" and state["user_id"]:
         await save_to_dynamodb(
-            user_id=user_id_state,
-            session_id=session_id,
-            chat_history=[msg.copy() for msg in messages],
-            policy=default_policy
+            user_id=state["user_id"],
+            session_id=state["session_id"],
+            chat_history=[msg.copy() for msg in state["messages"]],
+            policy=policy
         )
 
-    return render_messages()
+    return render_messages(state["messages"])
 
 with gr.Blocks() as demo:
     with gr.Row():
@@ -129,16 +171,31 @@ with gr.Blocks() as demo:
             user_id_input = gr.Textbox(label="User ID", placeholder="Enter your user ID", value="test_user")
             user_id_confirm = gr.Button("Set User ID")
             user_id_status = gr.Markdown()
+            # A new key per page load; the state itself lives in `sessions`
+            client_key = gr.State(new_client_key)
 
-            send_btn.click(fn=handle_input, inputs=user_input, outputs=chat_display)
-            data_radio.change(fn=update_info, inputs=data_radio, outputs=info_box)
-            principle_radio.change(update_principle_desc, inputs=principle_radio, outputs=principle_desc)
+            send_btn.click(fn=handle_input, inputs=[user_input, client_key], outputs=chat_display)
+            data_radio.change(fn=update_info, inputs=[data_radio, client_key], outputs=info_box)
+            principle_radio.change(update_principle_desc, inputs=[principle_radio, client_key], outputs=principle_desc)
             principle_confirm.click(
                 fn=lambda val: f"✅ Advisory role set to: **{val}**",
                 inputs=principle_radio,
                 outputs=principle_desc)
-            start_btn.click(start_chat, inputs=data_radio, outputs=chat_display)
-            user_id_confirm.click(fn=set_user_id, inputs=user_id_input, outputs=user_id_status)
+            start_btn.click(start_chat, inputs=[data_radio, client_key], outputs=chat_display)
+            user_id_confirm.click(fn=set_user_id, inputs=[user_id_input, client_key], outputs=user_id_status)
+
+    # Open the OpenAI connection pool before the first message
+    demo.load(warm_up_client)
 
 if __name__ == "__main__":
-    demo.launch()
\ No newline at end of file
+    # Sessions no longer share state, so events from different users can run in parallel
+    demo.queue(default_concurrency_limit=int(os.getenv("GRADIO_CONCURRENCY", "16")))
+    demo.launch(prevent_thread_lock=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        # Close the pooled OpenAI connections while the server's event loop still runs
+        close_clients_threadsafe()
+        print("Storage pool:", storage.stats())
+        demo.close()
\ No newline at end of file
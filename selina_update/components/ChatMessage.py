@@ -1,3 +1,2 @@
-from components.state import messages
-def render_messages():
+def render_messages(messages):
     return '\n\n'.join([f"**{m['role'].capitalize()}**: {m['content']}" for m in messages])
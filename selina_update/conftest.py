@@ -0,0 +1,2 @@
+# test_write_dynamodb.py is a manual script that writes to the real table on import
+collect_ignore = ["test_write_dynamodb.py"]
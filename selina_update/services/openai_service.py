@@ -1,26 +1,28 @@
 import os
-import openai
 from dotenv import load_dotenv
+from shared.openai_pool import get_async_client, warm_up
 load_dotenv()
 
-_api_key = None
+def get_api_key(state=None):
+    """The key a browser session set, else OPENAI_API_KEY"""
+    return (state or {}).get("api_key") or os.getenv("OPENAI_API_KEY")
 
-def get_api_key():
-    return _api_key or os.getenv("OPENAI_API_KEY")
-
-def set_api_key(key):
-    global _api_key
-    _api_key = key
-    openai.api_key = key
+def set_api_key(state, key):
+    # Kept in the session's own state, so one user's key is never used for another
+    state["api_key"] = key
     return "✅ API key set."
 
-def chat_with_gpt4(user_message, mode, principle):
+async def warm_up_client():
     key = get_api_key()
+    if key:
+        await warm_up(key)
+
+async def chat_with_gpt4(user_message, mode, principle, key):
     if not key:
         return "⚠️ Please provide an API key first."
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=key)
+        # Reuse the pooled client instead of a new connection pool per message
+        client = get_async_client(key)
         mode_prompts = {
             "private": "You are a confidential assistant. Do not store or use this data beyond this session.",
             "personalized": "You may refer to past conversations to personalize your response, but do not use the data to train models.",
@@ -32,7 +34,7 @@ def chat_with_gpt4(user_message, mode, principle):
             "Expert Advisor": "You should behave like a confident and experienced expert, but clarify limitations."
         }
         system_prompt = f"{principle_prompts.get(principle, '')}\n{mode_prompts.get(mode, '')}"
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4",
             messages=[
                 {"role": "system", "content": system_prompt},
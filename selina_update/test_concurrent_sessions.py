@@ -0,0 +1,145 @@
+"""
+Many simulated users chatting at once must never see each other's state.
+
+Run from the repository root:
+    python -m pytest selina_update/test_concurrent_sessions.py
+
+Each user's last turn also changes the advisory role and default policy
+while the reply is being generated; both changes must survive the turn.
+
+The OpenAI client and the DynamoDB write are replaced by local fakes, so no
+keys are needed. The multi-worker test serves every request from a
+randomly chosen store instance backed by the same fakeredis server, as
+several worker processes sharing one Redis would.
+"""
+import asyncio
+import random
+import types
+
+import pytest
+
+from selina_update import chat_app
+from selina_update.services import openai_service
+from shared.session_store import create_session_store
+
+USERS = 50
+TURNS = 5
+
+
+class FakeCompletions:
+    def __init__(self, key, calls):
+        self.key = key
+        self.calls = calls
+
+    async def create(self, model, messages):
+        await asyncio.sleep(random.uniform(0.01, 0.02))
+        self.calls.append((self.key, messages[-1]["content"]))
+        content = f"echo: {messages[-1]['content']}"
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    """Stub OpenAI client and DynamoDB write; returns (completion calls, saved records)"""
+    calls, saved = [], []
+
+    def fake_client(key):
+        return types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions(key, calls)))
+
+    async def fake_save_to_dynamodb(user_id, session_id, chat_history, policy):
+        saved.append({"user_id": user_id, "session_id": session_id, "history": chat_history})
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-env")
+    monkeypatch.setattr(openai_service, "get_async_client", fake_client)
+    monkeypatch.setattr(chat_app, "save_to_dynamodb", fake_save_to_dynamodb)
+    monkeypatch.setattr(chat_app, "sessions", create_session_store("selina_sessions", url=""))
+    return calls, saved
+
+
+def pick_worker(workers):
+    if workers:
+        chat_app.sessions = random.choice(workers)
+
+
+async def simulate_user(i, turns, workers):
+    key = chat_app.new_client_key()
+    mode = "sharing" if i % 2 else "private"
+    for step in (
+        lambda: chat_app.set_user_id(f"user_{i}", key),
+        lambda: chat_app.update_info(mode, key),
+        lambda: chat_app.update_principle_desc("User Advocate", key),
+        lambda: chat_app.start_chat(mode, key),
+    ):
+        pick_worker(workers)
+        step()
+        await asyncio.sleep(0)
+    for turn in range(turns):
+        pick_worker(workers)
+        await chat_app.handle_input(f"user_{i} turn {turn}", key)
+
+    async def change_settings():
+        # Lands while the reply below is still being generated
+        await asyncio.sleep(0.005)
+        pick_worker(workers)
+        chat_app.update_principle_desc("Expert Advisor", key)
+        chat_app.store_policy(["research"], [f"lab_{i}"], key)
+
+    pick_worker(workers)
+    await asyncio.gather(chat_app.handle_input(f"user_{i} turn {turns}", key), change_settings())
+    return i, key
+
+
+def check_sessions(results, saved, turns):
+    session_ids = set()
+    for i, key in results:
+        state = chat_app.load_state(key)
+        user_messages = [m["content"] for m in state["messages"] if m["role"] == "user"]
+        assert user_messages == [f"user_{i} turn {t}" for t in range(turns + 1)], (i, user_messages)
+        replies = [m["content"] for m in state["messages"] if m["content"].startswith("echo: ")]
+        assert replies == [f"echo: user_{i} turn {t}" for t in range(turns + 1)], (i, replies)
+        assert state["user_id"] == f"user_{i}"
+        # The settings changed during the last reply were not overwritten by it
+        assert state["transmission_principle"] == "Expert Advisor"
+        assert state["default_policy"] == {"uses": ["research"], "recipients": [f"lab_{i}"]}
+        assert state["data_handling_mode"] == ("sharing" if i % 2 else "private")
+        assert state["session_id"] not in session_ids
+        session_ids.add(state["session_id"])
+
+    # Only sharing-mode users are written, each under their own ID and session
+    for record in saved:
+        owner = record["user_id"]
+        turns_seen = [m["content"] for m in record["history"]
+                      if m["role"] == "user" or m["content"].startswith("echo: ")]
+        assert all(c.startswith((f"{owner} ", f"echo: {owner} ")) for c in turns_seen), record
+    assert len(saved) == (len(results) // 2) * (turns + 1)
+
+
+async def run_users(users, turns, workers):
+    return await asyncio.gather(*(simulate_user(i, turns, workers) for i in range(users)))
+
+
+def test_concurrent_sessions_share_no_state(fakes):
+    _, saved = fakes
+    results = asyncio.run(run_users(USERS, TURNS, []))
+    check_sessions(results, saved, TURNS)
+
+
+def test_concurrent_sessions_across_workers(fakes):
+    _, saved = fakes
+    workers = [create_session_store("selina_sessions", url="fakeredis://") for _ in range(4)]
+    results = asyncio.run(run_users(USERS, TURNS, workers))
+    check_sessions(results, saved, TURNS)
+
+
+def test_api_key_is_per_session(fakes):
+    calls, _ = fakes
+    own, other = chat_app.new_client_key(), chat_app.new_client_key()
+    state = chat_app.load_state(own)
+    openai_service.set_api_key(state, "sk-own")
+    chat_app.save_state(own, state)
+
+    async def chat():
+        await asyncio.gather(chat_app.handle_input("mine", own), chat_app.handle_input("theirs", other))
+
+    asyncio.run(chat())
+    assert sorted(calls) == [("sk-env", "theirs"), ("sk-own", "mine")]
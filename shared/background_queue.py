@@ -0,0 +1,172 @@
+import asyncio
+import time
+
+
+class BackgroundQueue:
+    """
+    In-process job queue served by a bounded pool of asyncio workers.
+
+    Jobs are handed to `handler` (an async callable); a job whose handler
+    raises is retried with exponential backoff up to `max_attempts` times.
+    Jobs waiting for a retry form the retry backlog. Workers start on the
+    first submit, on that event loop, and drain() finishes outstanding work
+    before shutdown.
+    """
+
+    def __init__(self, handler, workers=4, maxsize=1000, max_attempts=3, retry_delay=2.0, name="background"):
+        """
+        Args:
+            handler: async callable taking one job
+            workers (int): Number of concurrent workers
+            maxsize (int): Queue capacity; further jobs go to the retry backlog
+            max_attempts (int): Attempts per job (failed runs and full-queue waits) before it is dropped
+            retry_delay (float): Seconds before the first retry (doubles each time)
+            name (str): Name used in log lines
+        """
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.name = name
+        self.loop = None
+        self._queue = None
+        self._workers = []
+        self._retries = set()
+        self._accepting = True
+        self.in_flight = 0
+        self.counters = {
+            "submitted": 0,
+            "processed": 0,
+            "retried": 0,
+            "failed": 0,
+            "rejected": 0,
+            "max_depth": 0
+        }
+
+    def _start(self):
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.maxsize)
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"{self.name}-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    def submit(self, job):
+        """
+        Queue a job without waiting; must be called on the event loop
+
+        Returns:
+            bool: False if the queue is shutting down and the job was refused
+        """
+        if not self._accepting:
+            self.counters["rejected"] += 1
+            return False
+        if self._queue is None:
+            self._start()
+        self.counters["submitted"] += 1
+        self._enqueue(job, 1)
+        return True
+
+    def _enqueue(self, job, attempt):
+        try:
+            self._queue.put_nowait((job, attempt))
+            self.counters["max_depth"] = max(self.counters["max_depth"], self._queue.qsize())
+        except asyncio.QueueFull:
+            if not self._accepting:
+                # drain() would only cancel the wait and land here again, without end
+                self.counters["failed"] += 1
+                print(f"❌ {self.name}: queue full while draining, dropping a job (attempt {attempt})")
+            elif attempt < self.max_attempts:
+                # Don't block the caller; try again once the queue has room.
+                # A full queue counts as a failed attempt, so a job can't circle forever
+                self.counters["retried"] += 1
+                self._schedule_retry(job, attempt + 1, self.retry_delay * 2 ** (attempt - 1))
+            else:
+                self.counters["failed"] += 1
+                print(f"❌ {self.name}: giving up after {attempt} attempts: queue full")
+
+    def _schedule_retry(self, job, attempt, delay):
+        task = asyncio.create_task(self._retry_later(job, attempt, delay))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _retry_later(self, job, attempt, delay):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            # Also runs when drain() cancels the wait, so the job is never lost
+            self._enqueue(job, attempt)
+
+    async def _work(self):
+        while True:
+            job, attempt = await self._queue.get()
+            self.in_flight += 1
+            try:
+                await self.handler(job)
+                self.counters["processed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt < self.max_attempts:
+                    self.counters["retried"] += 1
+                    self._schedule_retry(job, attempt + 1, self.retry_delay * 2 ** (attempt - 1))
+                else:
+                    self.counters["failed"] += 1
+                    print(f"❌ {self.name}: giving up after {attempt} attempts: {e}")
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
+
+    def stats(self):
+        """Queue depth, in-flight and backlog sizes plus lifetime counters"""
+        return {
+            **self.counters,
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": self.in_flight,
+            "retry_backlog": len(self._retries)
+        }
+
+    async def drain(self, timeout=30.0):
+        """
+        Stop accepting jobs, finish queued ones and retry the backlog now
+
+        Jobs still failing or unfinished after `timeout` seconds are dropped.
+
+        Returns:
+            dict: Final stats
+        """
+        self._accepting = False
+        if self._queue is None:
+            return self.stats()
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # Skip the backoff: pull waiting retries forward, only as many as
+            # the queue has room for; the rest follow once it has been worked off
+            retries = list(self._retries)
+            if self.maxsize > 0:
+                retries = retries[:self.maxsize - self._queue.qsize()]
+            for task in retries:
+                task.cancel()
+            await asyncio.gather(*retries, return_exceptions=True)
+            if self._queue.empty() and self.in_flight == 0 and not self._retries:
+                break
+            try:
+                await asyncio.wait_for(self._queue.join(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        stats = self.stats()
+        print(f"{self.name} drained: {stats}")
+        return stats
+
+    def drain_threadsafe(self, timeout=30.0):
+        """drain() from another thread (e.g. the main thread on Ctrl+C)"""
+        if self.loop is None or self.loop.is_closed():
+            return self.stats()
+        future = asyncio.run_coroutine_threadsafe(self.drain(timeout), self.loop)
+        return future.result(timeout + 5)
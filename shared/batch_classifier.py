@@ -0,0 +1,191 @@
+import asyncio
+import json
+
+from shared.openai_pool import get_async_client
+
+SENSITIVITY_LEVELS = ("non-sensitive", "sensitive", "very-sensitive")
+
+BATCH_INSTRUCTIONS = (
+    "\n\nYou will receive a JSON object {\"items\": [{\"id\": <int>, \"text\": <message>}, ...]}. "
+    "Analyze every message independently and return a JSON object "
+    "{\"results\": [{\"id\": <int>, ...the keys described above...}, ...]} "
+    "with exactly one result per id."
+)
+
+
+def parse_detection(result):
+    """
+    Validate one classification result
+
+    Returns:
+        dict: {"level", "items", "reason"}, or None if the result is malformed
+    """
+    if not isinstance(result, dict):
+        return None
+    level = result.get("sensitivity_level")
+    items = result.get("flagged_items", [])
+    reason = result.get("reason", "")
+    if level not in SENSITIVITY_LEVELS or not isinstance(items, list) or not isinstance(reason, str):
+        return None
+    return {"level": level, "items": [str(item) for item in items], "reason": reason}
+
+
+def confine_to_text(text, result, shared=True):
+    """
+    A batched result cut down to what its own message contains
+
+    Messages batched together may come from different participants, and
+    the model can attribute one message's content to another. When the
+    batch was shared, flagged items that do not occur in `text` are
+    dropped, and so is the free-text reason, which could quote any message
+    of the batch. Meant as a MicroBatcher check_result.
+
+    Returns:
+        dict | None: The result, with "items" filtered and "reason" emptied if shared
+    """
+    if result is None or not shared:
+        return result
+    folded = text.casefold()
+    items = [item for item in result.get("items", []) if str(item).strip() and str(item).casefold() in folded]
+    return {**result, "items": items, "reason": ""}
+
+
+class BatchClassifier:
+    """
+    Classification of many messages per chat completion.
+
+    Up to `batch_size` messages are sent as one JSON array, so the system
+    prompt and the round trip are paid once per batch instead of once per
+    message. Results are validated item by item; items that come back
+    missing or malformed are split into smaller batches and retried, down
+    to single messages. A request that fails outright (rate limit, timeout,
+    outage) is not split: the client has already retried it, and splitting
+    would only multiply requests, so its whole batch comes back as None.
+    """
+
+    def __init__(self, model, system_prompt, batch_size=10, temperature=0.2,
+                 get_client=get_async_client, parse_item=parse_detection):
+        """
+        Args:
+            model (str): Classification model
+            system_prompt (str): Single-message prompt; batch instructions are appended
+            batch_size (int): Maximum messages per request
+            temperature (float): Sampling temperature
+            get_client: Callable returning the AsyncOpenAI client to use
+            parse_item: Validates one result dict; returns the parsed value or None
+        """
+        self.model = model
+        self.parse_item = parse_item
+        self.system_prompt = system_prompt + BATCH_INSTRUCTIONS
+        self.batch_size = max(1, batch_size)
+        self.temperature = temperature
+        self.get_client = get_client
+        self.stats = {
+            "requests": 0,
+            "messages": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "split_retries": 0,
+            "failed_items": 0
+        }
+
+    async def _request(self, texts):
+        """One completion for a batch; returns the response text"""
+        payload = {"items": [{"id": i, "text": text} for i, text in enumerate(texts)]}
+        self.stats["requests"] += 1
+        response = await self.get_client().chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": json.dumps(payload, ensure_ascii=False)}
+            ],
+            temperature=self.temperature,
+            response_format={"type": "json_object"}
+        )
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.stats["prompt_tokens"] += usage.prompt_tokens or 0
+            self.stats["completion_tokens"] += usage.completion_tokens or 0
+
+        return response.choices[0].message.content
+
+    def _parse(self, content, count):
+        """{index: detection} for the valid items of a response; empty if it is not usable JSON"""
+        try:
+            results = json.loads(content).get("results", [])
+        except (TypeError, ValueError, AttributeError) as e:
+            print(f"Batch classification returned malformed output ({count} messages): {e}")
+            return {}
+        valid = {}
+        for result in results if isinstance(results, list) else []:
+            index = result.get("id") if isinstance(result, dict) else None
+            if isinstance(index, int) and 0 <= index < count and index not in valid:
+                detection = self.parse_item(result)
+                if detection is not None:
+                    valid[index] = detection
+        return valid
+
+    async def _classify_batch(self, texts, semaphore):
+        try:
+            if semaphore is None:
+                content = await self._request(texts)
+            else:
+                # Held for the request only: split retries below acquire it again
+                async with semaphore:
+                    content = await self._request(texts)
+        except Exception as e:
+            print(f"Batch classification failed ({len(texts)} messages): {e}")
+            self.stats["failed_items"] += len(texts)
+            return [None] * len(texts)
+
+        valid = self._parse(content, len(texts))
+
+        missing = [i for i in range(len(texts)) if i not in valid]
+        if not missing:
+            return [valid[i] for i in range(len(texts))]
+        if len(texts) == 1:
+            self.stats["failed_items"] += 1
+            return [None]
+
+        # Output was malformed: retry only the bad items, in two halves so one
+        # problematic message can't sink the rest
+        self.stats["split_retries"] += 1
+        half = (len(missing) + 1) // 2
+        groups = [missing[:half], missing[half:]] if len(missing) > 1 else [missing]
+        retried = await asyncio.gather(*(
+            self._classify_batch([texts[i] for i in group], semaphore) for group in groups if group
+        ))
+        for group, detections in zip(groups, retried):
+            for i, detection in zip(group, detections):
+                valid[i] = detection
+        return [valid[i] for i in range(len(texts))]
+
+    def batches(self, texts):
+        """Split texts into request-sized lists"""
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+    async def classify(self, texts, semaphore=None):
+        """
+        Classify messages in batches of at most `batch_size`
+
+        Identical texts are sent once. Batches run concurrently; every
+        request, split retries included, is made holding `semaphore` if one
+        is given, so it bounds the requests in flight.
+
+        Args:
+            texts (list): Messages to classify
+            semaphore (asyncio.Semaphore): Optional limit on concurrent requests
+
+        Returns:
+            list: One parsed result per text (by default a {"level", "items",
+            "reason"} dict), in order, or None where it could not be classified
+        """
+        unique = list(dict.fromkeys(texts))
+        self.stats["messages"] += len(unique)
+        results = await asyncio.gather(*(self._classify_batch(batch, semaphore) for batch in self.batches(unique)))
+        by_text = {
+            text: detection
+            for batch, detections in zip(self.batches(unique), results)
+            for text, detection in zip(batch, detections)
+        }
+        return [by_text[text] for text in texts]
@@ -0,0 +1,113 @@
+from shared.message_model import Role
+
+
+def plain_content(msg):
+    return msg.content
+
+
+class ChatLog:
+    """
+    Canonical message log of one chat session, plus its Chatbot display.
+
+    `messages` is the history that gets saved, as shared.message_model
+    Message objects that keep the timestamp and metadata they were created
+    with. `rows` is the (user, bot) tuple projection shown by gr.Chatbot and
+    is updated in place as messages are added, so a turn costs O(1) instead
+    of rebuilding the history from the display and the display from the
+    history.
+
+    Kept server-side in a gr.State, one per browser session; the Chatbot
+    is only an output.
+    """
+
+    def __init__(self, messages=None, format_user=plain_content):
+        """
+        Args:
+            messages (list): Initial history (Message objects)
+            format_user: callable rendering a user Message's display text
+        """
+        self.format_user = format_user
+        self.messages = []
+        self.rows = []
+        self._row_of = []  # row index of each message
+        self._open = False  # last row is a user row still waiting for its reply
+        self._preview = False  # that row's bot slot holds a streamed, uncommitted reply
+        for msg in messages or []:
+            self.append(msg)
+
+    def append(self, msg):
+        """Add a message to the log and project it onto the display"""
+        self._clear_preview()
+        if msg.role is Role.USER:
+            self.rows.append((self.format_user(msg), None))
+            self._open = True
+        elif msg.role is Role.ASSISTANT and self._open:
+            self.rows[-1] = (self.rows[-1][0], msg.content)
+            self._open = False
+        else:
+            self.rows.append((None, msg.content))
+            self._open = False
+        self.messages.append(msg)
+        self._row_of.append(len(self.rows) - 1)
+        return msg
+
+    def extend(self, messages):
+        for msg in messages:
+            self.append(msg)
+
+    def stream_reply(self, text):
+        """
+        Show a partial reply under the last user message without logging it
+
+        Returns:
+            list: The display rows
+        """
+        if self._open:
+            self.rows[-1] = (self.rows[-1][0], text)
+        else:
+            self.rows.append((None, text))
+            self._open = True
+        self._preview = True
+        return self.rows
+
+    def refresh(self, msg):
+        """Re-render the row of a logged user message after its metadata changed"""
+        for i in range(len(self.messages) - 1, -1, -1):
+            if self.messages[i] is msg:
+                row = self._row_of[i]
+                self.rows[row] = (self.format_user(msg), self.rows[row][1])
+                return
+        raise ValueError("message is not in this log")
+
+    def remove(self, predicate):
+        """Drop every message matching predicate and rebuild the display (O(n), for rare edits)"""
+        self._rebuild([msg for msg in self.messages if not predicate(msg)])
+
+    def truncate(self, length):
+        """
+        Drop the messages after the first `length`, and any streamed preview
+
+        Used to undo a turn whose reply failed or was abandoned, so the log
+        never keeps a user message without its answer. O(n), like remove().
+        """
+        self._rebuild(self.messages[:length])
+
+    def _rebuild(self, messages):
+        self.messages, self.rows, self._row_of = [], [], []
+        self._open = self._preview = False
+        self.extend(messages)
+
+    def _clear_preview(self):
+        if not self._preview:
+            return
+        self._preview = False
+        user, _ = self.rows[-1]
+        if user is None:
+            # The preview had a row of its own
+            self.rows.pop()
+            self._open = False
+        else:
+            self.rows[-1] = (user, None)
+
+    def __len__(self):
+        return len(self.messages)
@@ -0,0 +1,141 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from shared import json_codec
+
+
+class DetectionCache:
+    """
+    Content-addressed cache for sensitivity detection results.
+
+    Entries are keyed on (message hash, model, prompt version), so changing
+    the detector model or its prompt never serves stale results. The
+    in-memory tier is an LRU with a TTL; an optional SQLite file adds a
+    second tier that survives restarts. Both tiers hold results serialized,
+    so callers always get their own copy and may mutate it.
+    """
+
+    def __init__(self, maxsize=1024, ttl=24 * 3600, sqlite_path=None):
+        """
+        Args:
+            maxsize (int): Maximum number of entries kept in memory
+            ttl (float): Seconds before an entry expires (None = never)
+            sqlite_path (str): Optional path of the on-disk tier
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {key: (expires_at, serialized value)}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0
+        }
+
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS detection_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(message_hash, model, prompt_version):
+        return f"{message_hash}:{model}:{prompt_version}"
+
+    def _expired(self, expires_at):
+        return expires_at is not None and expires_at <= time.time()
+
+    async def get(self, message_hash, model, prompt_version):
+        """
+        Look up a cached detection result
+
+        Returns:
+            dict: A copy of the cached result, or None on a miss
+        """
+        key = self.make_key(message_hash, model, prompt_version)
+        expired = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, data = entry
+                if not self._expired(expires_at):
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return json_codec.loads(data)
+                del self._entries[key]
+                expired = True
+
+        if self._db is not None:
+            # SQLite blocks, so the disk tier is read off the event loop
+            row, disk_expired = await asyncio.to_thread(self._disk_lookup, key)
+            if row is not None:
+                data, expires_at = row
+                with self._lock:
+                    self._store(key, expires_at, data)
+                    self.counters["disk_hits"] += 1
+                return json_codec.loads(data)
+            expired = expired or disk_expired
+
+        with self._lock:
+            if expired:
+                self.counters["expired"] += 1
+            self.counters["misses"] += 1
+        return None
+
+    async def set(self, message_hash, model, prompt_version, value):
+        """Store a copy of a detection result in memory and, if enabled, on disk"""
+        key = self.make_key(message_hash, model, prompt_version)
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        data = json_codec.dumps(value)
+        with self._lock:
+            self._store(key, expires_at, data)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_store, key, data, expires_at)
+
+    def _store(self, key, expires_at, data):
+        self._entries[key] = (expires_at, data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _disk_lookup(self, key):
+        """((serialized value, expires_at) or None, whether an expired row was deleted)"""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM detection_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, False
+            if self._expired(row[1]):
+                self._db.execute("DELETE FROM detection_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None, True
+            return row, False
+
+    def _disk_store(self, key, data, expires_at):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO detection_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, data, expires_at)
+            )
+            self._db.commit()
+
+    def stats(self):
+        """Hit/miss counters plus the share of lookups that avoided an API call"""
+        hits = self.counters["hits"] + self.counters["disk_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "size": len(self._entries),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,230 @@
+import gzip
+import hashlib
+import os
+from collections import OrderedDict
+
+from boto3.dynamodb.conditions import Key
+
+from shared import json_codec
+from shared.message_store import create_message_table
+
+try:
+    import zstandard
+except ImportError:  # optional; gzip is used instead
+    zstandard = None
+
+# "json" keeps the history as a plain JSON string (legacy); "gzip" and
+# "zstd" store it compressed in a Binary attribute.
+HISTORY_CODEC = os.getenv("CHAT_HISTORY_CODEC", "json")
+CHUNK_TABLE_NAME = os.getenv("CHAT_HISTORY_CHUNK_TABLE", "chat_history_chunks")
+# Largest compressed history kept on the row itself, leaving room under DynamoDB's
+# 400 KB item limit for the row's other attributes
+MAX_INLINE_BYTES = int(os.getenv("CHAT_HISTORY_MAX_INLINE_BYTES", str(300 * 1024)))
+CHUNK_BYTES = 350 * 1024
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Row attributes describing a stored history, other than `history` itself
+HISTORY_ATTRIBUTES = ("history_codec", "history_chunks", "history_version")
+
+
+def resolve_codec(codec):
+    """The codec actually used: zstd falls back to gzip when zstandard is missing"""
+    if codec == "zstd" and zstandard is None:
+        print("⚠️ zstandard is not installed; compressing history with gzip")
+        return "gzip"
+    if codec not in ("json", "gzip", "zstd"):
+        raise ValueError(f"Unknown history codec: {codec}")
+    return codec
+
+
+def compress(data, codec):
+    """
+    Compress encoded JSON
+
+    Args:
+        data (bytes): UTF-8 JSON
+        codec (str): "gzip", "zstd" or "json" (returned as is)
+
+    Returns:
+        bytes: Blob that decompress() recognizes by its magic number
+    """
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == "gzip":
+        # mtime=0 keeps the output, and so the chunk version, deterministic
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    return data
+
+
+def decompress(blob):
+    """Bytes of a stored history blob, whatever codec wrote it"""
+    if blob.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("History is zstd-compressed; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    if blob.startswith(GZIP_MAGIC):
+        return gzip.decompress(blob)
+    return blob  # uncompressed JSON, chunked by earlier versions of the json codec
+
+
+def _bytes(value):
+    # boto3 returns Binary attributes wrapped in boto3.dynamodb.types.Binary
+    return getattr(value, "value", value)
+
+
+def has_history(item):
+    """Whether a chat_history row holds its history (inline or chunked)"""
+    return "history" in item or "history_chunks" in item
+
+
+class HistoryCodec:
+    """
+    Storage format of the `history` attribute of chat_history rows.
+
+    pack() turns a history's JSON into row attributes. The default "json"
+    codec always keeps the legacy inline string. With the "gzip" or "zstd"
+    codec it is compressed into a Binary `history`; if the blob is still
+    over `max_inline_bytes` it is split across items of a separate
+    chunk table (same user_id / session_id keys), and the row only records
+    how many chunks there are and which version they belong to. Chunk keys
+    include that version, so a reader never mixes chunks of two saves.
+
+    read() detects the format on its own: a JSON string (written before the
+    codec existed or with the "json" codec), a compressed blob, or chunks.
+    """
+
+    def __init__(self, chunk_table=None, codec=HISTORY_CODEC, max_inline_bytes=MAX_INLINE_BYTES,
+                 chunk_bytes=CHUNK_BYTES, max_tracked_sessions=10000):
+        """
+        Args:
+            chunk_table: boto3 DynamoDB Table for chunk items (needed only for oversized histories)
+            codec (str): "json", "gzip" or "zstd"
+            max_inline_bytes (int): Largest compressed history stored on the row itself
+            chunk_bytes (int): Bytes per chunk item
+            max_tracked_sessions (int): Chunked sessions remembered for cleanup
+        """
+        self.chunk_table = chunk_table
+        self.codec = resolve_codec(codec)
+        self.max_inline_bytes = max_inline_bytes
+        self.chunk_bytes = chunk_bytes
+        self.max_tracked_sessions = max_tracked_sessions
+        self._chunked = OrderedDict()  # {(user_id, session_id): version} of sessions written as chunks
+
+    def pack(self, item, history_json):
+        """
+        Row with its history attached, plus the chunk items to write first
+
+        Args:
+            item (dict): chat_history row without the history
+            history_json (str): Encoded history
+
+        Returns:
+            tuple: (row dict, list of chunk items)
+        """
+        if self.codec == "json":
+            # Legacy format, whatever the size: every reader (including the old
+            # apps and the Lambda handler) parses it, and no chunk table is needed
+            return {**item, "history": history_json}, []
+
+        blob = compress(history_json.encode("utf-8"), self.codec)
+        if len(blob) <= self.max_inline_bytes:
+            return {**item, "history": blob, "history_codec": self.codec}, []
+
+        if self.chunk_table is None:
+            raise ValueError(f"History of {len(blob)} bytes needs a chunk table")
+        version = hashlib.sha1(blob).hexdigest()[:12]
+        chunks = [
+            {
+                "user_id": item["user_id"],
+                "session_id": f"{item['session_id']}#{version}#{seq:04d}",
+                "data": blob[start:start + self.chunk_bytes]
+            }
+            for seq, start in enumerate(range(0, len(blob), self.chunk_bytes))
+        ]
+        row = {**item, "history_codec": self.codec, "history_chunks": len(chunks), "history_version": version}
+        return row, chunks
+
+    def write_chunks(self, chunks):
+        """Store chunk items; must run before the rows that point at them"""
+        if not chunks:
+            return
+        with self.chunk_table.batch_writer() as batch:
+            for chunk in chunks:
+                batch.put_item(Item=chunk)
+
+    def prune(self, row):
+        """
+        Delete chunks a session no longer uses, after its row was written
+
+        Returns:
+            int: Chunk items deleted
+        """
+        if self.chunk_table is None:
+            return 0
+        key = (row["user_id"], row["session_id"])
+        version = row.get("history_version")
+        if version is None and key not in self._chunked:
+            # Never written as chunks by this process; nothing to look for
+            return 0
+
+        stale = [
+            {"user_id": chunk["user_id"], "session_id": chunk["session_id"]}
+            for chunk in self._query_chunks(*key, ProjectionExpression="user_id, session_id")
+            if chunk["session_id"].split("#")[-2] != version
+        ]
+        if stale:
+            with self.chunk_table.batch_writer() as batch:
+                for chunk_key in stale:
+                    batch.delete_item(Key=chunk_key)
+
+        if version is None:
+            self._chunked.pop(key, None)
+        else:
+            self._chunked[key] = version
+            self._chunked.move_to_end(key)
+            while len(self._chunked) > self.max_tracked_sessions:
+                self._chunked.popitem(last=False)
+        return len(stale)
+
+    def _query_chunks(self, user_id, prefix, **kwargs):
+        """Chunk items whose sort key starts with `prefix`, in order, following pagination"""
+        items = []
+        query = {
+            "KeyConditionExpression": Key("user_id").eq(user_id) & Key("session_id").begins_with(f"{prefix}#"),
+            **kwargs
+        }
+        while True:
+            response = self.chunk_table.query(**query)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def read(self, item):
+        """
+        Stored history of a chat_history row (blocking when it is chunked)
+
+        Returns:
+            list | None: Messages as dicts, None if the row holds no history
+        """
+        if "history" in item:
+            value = _bytes(item["history"])
+            if isinstance(value, str):
+                return json_codec.loads(value)
+            return json_codec.loads(decompress(value))
+        if "history_chunks" in item:
+            if self.chunk_table is None:
+                raise ValueError("Row's history is chunked but no chunk table is configured")
+            prefix = f"{item['session_id']}#{item['history_version']}"
+            chunks = self._query_chunks(item["user_id"], prefix)
+            if len(chunks) != int(item["history_chunks"]):
+                raise ValueError(f"Expected {item['history_chunks']} history chunks, found {len(chunks)}")
+            return json_codec.loads(decompress(b"".join(_bytes(chunk["data"]) for chunk in chunks)))
+        return None
+
+
+def create_chunk_table(dynamodb_resource, table_name=CHUNK_TABLE_NAME):
+    """Create the chunk table; it uses the per-message table's key schema"""
+    return create_message_table(dynamodb_resource, table_name)
@@ -0,0 +1,59 @@
+from boto3.dynamodb.conditions import Key
+
+from shared.storage_pool import run_storage
+
+
+class ChatHistoryRepository:
+    """
+    Read access to the chat_history table by user.
+
+    Every read is a Query on the user_id partition key, so only that user's
+    rows are read, and LastEvaluatedKey is followed so results are never
+    cut off at DynamoDB's 1 MB page limit.
+    """
+
+    def __init__(self, table, page_size=None):
+        """
+        Args:
+            table: boto3 DynamoDB Table keyed on user_id / session_id
+            page_size (int): Optional Limit per Query page
+        """
+        self.table = table
+        self.page_size = page_size
+
+    def _query_page(self, user_id, start_key=None, **kwargs):
+        query = {"KeyConditionExpression": Key("user_id").eq(user_id), **kwargs}
+        if self.page_size:
+            query["Limit"] = self.page_size
+        if start_key:
+            query["ExclusiveStartKey"] = start_key
+        return self.table.query(**query)
+
+    async def iter_pages(self, user_id, **kwargs):
+        """
+        Yield one list of items per Query page
+
+        Extra keyword arguments (e.g. ProjectionExpression) go to every Query.
+        """
+        start_key = None
+        while True:
+            response = await run_storage(self.table, self._query_page, user_id, start_key, **kwargs)
+            yield response.get("Items", [])
+            start_key = response.get("LastEvaluatedKey")
+            if not start_key:
+                return
+
+    async def iter_sessions(self, user_id, **kwargs):
+        """
+        Yield every session row of a user, fetching pages as they are consumed
+
+        Returns:
+            AsyncIterator[dict]: Raw DynamoDB items in session_id order
+        """
+        async for items in self.iter_pages(user_id, **kwargs):
+            for item in items:
+                yield item
+
+    async def list_sessions(self, user_id, **kwargs):
+        """All session rows of a user as a list"""
+        return [item async for item in self.iter_sessions(user_id, **kwargs)]
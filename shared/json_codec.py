@@ -0,0 +1,64 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback, e.g. on a platform without an orjson wheel
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _default(obj):
+    """Types neither encoder handles on its own"""
+    if isinstance(obj, Decimal):
+        # boto3 returns every DynamoDB number as a Decimal
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _stdlib_default(obj):
+    # orjson encodes these natively; match its output
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Enum):
+        return obj.value
+    return _default(obj)
+
+
+def dumps(obj):
+    """
+    Serialize to a compact JSON string
+
+    Non-ASCII text is kept as is (like ensure_ascii=False). datetime/date
+    values become ISO-8601 strings, enums their values, Decimals numbers,
+    and objects with a to_dict() method (e.g. Message) their dict form.
+
+    Args:
+        obj: Value to serialize
+
+    Returns:
+        str: JSON text
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, default=_stdlib_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data):
+    """
+    Parse JSON text
+
+    Args:
+        data (str | bytes): JSON text
+
+    Returns:
+        The parsed value
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
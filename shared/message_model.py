@@ -0,0 +1,196 @@
+from datetime import datetime, timezone
+from enum import Enum
+
+from shared import json_codec
+
+
+class Role(str, Enum):
+    USER = "user"
+    ASSISTANT = "assistant"
+    SYSTEM = "system"
+
+
+class Kind(str, Enum):
+    """What a message is for, so code never has to guess from its text"""
+    CHAT = "chat"
+    SENSITIVITY_WARNING = "sensitivity_warning"  # chatbot#2 "⚠️ Detected ..."
+    PII_WARNING = "pii_warning"                  # chatbot#4 "⚠️ **PII Detected** ..."
+    VALUE_ALERT = "value_alert"                  # chatbot#5 "⚠️ Commercial value detected ..."
+    ACTION = "action"                            # record of a user's privacy choice
+    NOTICE = "notice"                            # any other system message
+
+
+class Message:
+    """
+    One chat message.
+
+    Slotted, so a message costs a fixed handful of pointers instead of a
+    dict with its keys repeated per instance. to_dict()/from_dict() map to
+    the stored JSON, which keeps its existing shape: optional fields are
+    left out when unset, and keys this class does not know are kept in
+    `extra` and written back unchanged.
+    """
+
+    __slots__ = (
+        "role", "kind", "content", "timestamp",
+        "sensitivity", "hash", "metadata", "privacy_check", "value_assessment",
+        "extra"
+    )
+
+    def __init__(self, role, content, kind=Kind.CHAT, timestamp=None, sensitivity=None, hash=None,
+                 metadata=None, privacy_check=None, value_assessment=None, **extra):
+        """
+        Args:
+            role (Role | str): Who sent the message
+            content (str): Message text
+            kind (Kind | str): What the message is for
+            timestamp (str): ISO-8601 UTC time (default: now)
+            sensitivity (dict): chatbot#2 detection result
+            hash (str): chatbot#2 message hash
+            metadata (dict): chatbot#4 rewrite choice and removed PII
+            privacy_check (dict): chatbot#7 detection result
+            value_assessment (dict): chatbot#5 assessment
+            **extra: Any other stored fields (e.g. action_record, latency)
+        """
+        self.role = _member(_ROLES, Role, role)
+        self.kind = _member(_KINDS, Kind, kind)
+        self.content = content
+        self.timestamp = timestamp or datetime.now(timezone.utc).isoformat()
+        self.sensitivity = sensitivity
+        self.hash = hash
+        self.metadata = metadata
+        self.privacy_check = privacy_check
+        self.value_assessment = value_assessment
+        self.extra = extra or None
+
+    def to_dict(self):
+        """The stored JSON form of the message"""
+        data = {"role": self.role.value, "content": self.content}
+        if self.timestamp is not None:
+            data["timestamp"] = self.timestamp
+        if self.kind is not Kind.CHAT:
+            data["kind"] = self.kind.value
+        # Unrolled: this runs once per message on every save
+        if self.sensitivity is not None:
+            data["sensitivity"] = self.sensitivity
+        if self.hash is not None:
+            data["hash"] = self.hash
+        if self.metadata is not None:
+            data["metadata"] = self.metadata
+        if self.privacy_check is not None:
+            data["privacy_check"] = self.privacy_check
+        if self.value_assessment is not None:
+            data["value_assessment"] = self.value_assessment
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Message from its stored JSON form
+
+        Records written before `kind` was stored get it inferred once here.
+        """
+        get = data.get
+        msg = cls.__new__(cls)
+        msg.role = role = _ROLES.get(data["role"]) or Role(data["role"])
+        msg.content = content = get("content", "")
+        msg.timestamp = get("timestamp")
+        kind = get("kind")
+        msg.kind = (_KINDS.get(kind) or Kind(kind)) if kind else _infer_kind(role, content, data)
+        msg.sensitivity = get("sensitivity")
+        msg.hash = get("hash")
+        msg.metadata = get("metadata")
+        msg.privacy_check = get("privacy_check")
+        msg.value_assessment = get("value_assessment")
+        # Only look for unknown keys when there are more keys than known fields set
+        if len(data) > _count_known(msg, kind):
+            msg.extra = {k: data[k] for k in data.keys() - _KNOWN} or None
+        else:
+            msg.extra = None
+        return msg
+
+    def for_model(self):
+        """The {"role", "content"} pair sent to the chat completions API"""
+        return {"role": self.role.value, "content": self.content}
+
+    def __eq__(self, other):
+        if not isinstance(other, Message):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"Message({self.role.value}, {self.kind.value}, {self.content[:40]!r})"
+
+
+# Calling an Enum is slow; members are looked up by value (or by member) here
+_ROLES = {role.value: role for role in Role}
+_KINDS = {kind.value: kind for kind in Kind}
+
+
+def _count_known(msg, kind):
+    count = 2  # role and content
+    for value in (msg.timestamp, kind, msg.sensitivity, msg.hash, msg.metadata,
+                  msg.privacy_check, msg.value_assessment):
+        if value is not None:
+            count += 1
+    return count
+
+
+def _member(lookup, enum, value):
+    try:
+        return lookup[value]
+    except KeyError:
+        return enum(value)  # raises ValueError for an unknown value
+
+
+# Stored keys with a slot of their own (every slot but `extra`)
+_KNOWN = frozenset(Message.__slots__[:-1])
+
+
+def _infer_kind(role, content, data):
+    if role is not Role.SYSTEM:
+        return Kind.CHAT
+    if "action_record" in data:
+        return Kind.ACTION
+    if content.startswith("⚠️ **PII Detected**"):
+        return Kind.PII_WARNING
+    if content.startswith("⚠️ Detected"):
+        return Kind.SENSITIVITY_WARNING
+    if content.startswith("⚠️ Commercial value"):
+        return Kind.VALUE_ALERT
+    return Kind.NOTICE
+
+
+def as_dict(msg):
+    """Stored JSON form of a Message or an already plain dict message"""
+    return msg.to_dict() if isinstance(msg, Message) else msg
+
+
+def encode_history(messages):
+    """
+    Serialize a history to the stored JSON string
+
+    Args:
+        messages (list): Message objects (plain dicts are accepted too)
+
+    Returns:
+        str: JSON array of messages
+    """
+    return json_codec.dumps([as_dict(msg) for msg in messages])
+
+
+def decode_history(data):
+    """
+    Parse a stored history
+
+    Args:
+        data (str | list): JSON string or already parsed list of dicts
+
+    Returns:
+        list: Message objects
+    """
+    if isinstance(data, str):
+        data = json_codec.loads(data)
+    return [Message.from_dict(item) for item in data]
@@ -0,0 +1,161 @@
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from boto3.dynamodb.conditions import Key
+
+from shared import json_codec
+from shared.message_model import Message, as_dict
+from shared.storage_pool import run_storage
+
+# "blob" keeps the whole history JSON on the chat_history row (legacy);
+# "messages" stores one item per message and keeps only metadata on the row.
+STORAGE_MODE = os.getenv("CHAT_STORAGE_MODE", "blob")
+MESSAGE_TABLE_NAME = os.getenv("CHAT_MESSAGE_TABLE", "chat_messages")
+
+# Zero-padded so the sort key orders messages lexicographically
+SEQ_WIDTH = 6
+
+
+def message_sort_key(session_id, seq):
+    return f"{session_id}#{seq:0{SEQ_WIDTH}d}"
+
+
+def _fingerprint(msg):
+    # Role and content only: older histories, rebuilt from the Gradio display,
+    # carry regenerated timestamps and no metadata, which is not a change.
+    if isinstance(msg, Message):
+        return hash((msg.role.value, msg.content))
+    return hash((msg.get("role"), msg.get("content")))
+
+
+class MessageStore:
+    """
+    Append-only per-message storage for chat history.
+
+    Each message is its own item keyed by user_id (partition) and
+    "<session_id>#<seq>" (sort key, stored in the session_id attribute), so
+    a turn writes only the messages it added instead of the whole history,
+    and a session is read back with a single Query.
+    """
+
+    def __init__(self, table, max_tracked_sessions=10000):
+        """
+        Args:
+            table: boto3 DynamoDB Table with user_id / session_id keys
+            max_tracked_sessions (int): Sessions whose persisted state is remembered
+        """
+        self.table = table
+        self.max_tracked_sessions = max_tracked_sessions
+        self._persisted = OrderedDict()  # {(user_id, session_id): [fingerprint, ...]}
+
+    def _make_item(self, user_id, session_id, seq, msg):
+        msg = as_dict(msg)
+        return {
+            "user_id": user_id,
+            "session_id": message_sort_key(session_id, seq),
+            "session": session_id,
+            "seq": seq,
+            "role": msg.get("role", ""),
+            "message": json_codec.dumps(msg),
+            "timestamp": msg.get("timestamp") or datetime.now(timezone.utc).isoformat()
+        }
+
+    def _query_session(self, user_id, session_id, **kwargs):
+        """All message items of a session in seq order, following pagination"""
+        items = []
+        query = {
+            "KeyConditionExpression": Key("user_id").eq(user_id) & Key("session_id").begins_with(f"{session_id}#"),
+            **kwargs
+        }
+        while True:
+            response = self.table.query(**query)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    async def load_history(self, user_id, session_id):
+        """
+        Rebuild a session's history from its message items
+
+        Returns:
+            list: Messages in order
+        """
+        items = await run_storage(self.table, self._query_session, user_id, session_id)
+        history = [json_codec.loads(item["message"]) for item in items]
+        self._remember(user_id, session_id, [_fingerprint(msg) for msg in history])
+        return history
+
+    def _remember(self, user_id, session_id, fingerprints):
+        key = (user_id, session_id)
+        self._persisted[key] = fingerprints
+        self._persisted.move_to_end(key)
+        while len(self._persisted) > self.max_tracked_sessions:
+            self._persisted.popitem(last=False)
+
+    async def sync_history(self, user_id, session_id, history):
+        """
+        Persist a session's history, writing only what changed
+
+        In the normal case this appends the new messages of the turn. If an
+        earlier message changed (e.g. a removed sensitive message), the
+        history is rewritten from that point and any extra items deleted.
+
+        Returns:
+            int: Number of items written or deleted
+        """
+        key = (user_id, session_id)
+        persisted = self._persisted.get(key)
+        if persisted is None:
+            items = await run_storage(
+                self.table, self._query_session, user_id, session_id, ProjectionExpression="message"
+            )
+            persisted = [_fingerprint(json_codec.loads(item["message"])) for item in items]
+
+        fingerprints = [_fingerprint(msg) for msg in history]
+        first_changed = 0
+        while (first_changed < len(persisted) and first_changed < len(fingerprints)
+               and persisted[first_changed] == fingerprints[first_changed]):
+            first_changed += 1
+
+        puts = [
+            self._make_item(user_id, session_id, seq, history[seq])
+            for seq in range(first_changed, len(history))
+        ]
+        deletes = [
+            {"user_id": user_id, "session_id": message_sort_key(session_id, seq)}
+            for seq in range(len(history), len(persisted))
+        ]
+        if puts or deletes:
+            await run_storage(self.table, self._write_batch, puts, deletes)
+        self._remember(user_id, session_id, fingerprints)
+        return len(puts) + len(deletes)
+
+    def _write_batch(self, puts, deletes):
+        if len(puts) == 1 and not deletes:
+            self.table.put_item(Item=puts[0])
+            return
+        with self.table.batch_writer() as batch:
+            for item in puts:
+                batch.put_item(Item=item)
+            for key in deletes:
+                batch.delete_item(Key=key)
+
+
+def create_message_table(dynamodb_resource, table_name=MESSAGE_TABLE_NAME):
+    """Create the per-message table (on-demand billing) and wait until it exists"""
+    table = dynamodb_resource.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {"AttributeName": "user_id", "KeyType": "HASH"},
+            {"AttributeName": "session_id", "KeyType": "RANGE"}
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "user_id", "AttributeType": "S"},
+            {"AttributeName": "session_id", "AttributeType": "S"}
+        ],
+        BillingMode="PAY_PER_REQUEST"
+    )
+    table.wait_until_exists()
+    return table
@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-item calls into batched calls.
+
+    Callers await submit(item). Items arriving within `window_ms` of the
+    first pending one, or until `max_batch` items are pending, are handed
+    together to `batch_fn` and each result is routed back to its caller.
+    Under light load a call waits at most one window; under heavy load
+    batches fill up and go out immediately.
+
+    A batch can mix items from different owners (e.g. sessions of
+    different participants), so `check_result` gets to vet each result
+    against its own item, knowing whether the batch was shared, before it
+    is handed back.
+    """
+
+    def __init__(self, batch_fn, max_batch=16, window_ms=20, name="micro-batch", log_every=100, check_result=None):
+        """
+        Args:
+            batch_fn: async callable taking a list of items and returning one result per item
+            max_batch (int): Items that trigger an immediate dispatch
+            window_ms (float): Longest time the first item waits for company
+            name (str): Name used in log lines
+            log_every (int): Log stats() every this many batches (0 = never)
+            check_result: callable(item, result, shared) returning what its caller receives (default:
+                result as is); `shared` is True when the batch held items of more than one owner
+        """
+        self.batch_fn = batch_fn
+        self.check_result = check_result
+        self.max_batch = max(1, max_batch)
+        self.window = window_ms / 1000
+        self.name = name
+        self.log_every = log_every
+        self._pending = []  # [(item, future, enqueued_at)]
+        self._timer = None
+        self._running = set()
+        self.counters = {
+            "batches": 0,
+            "items": 0,
+            "size_flushes": 0,
+            "window_flushes": 0,
+            "errors": 0,
+            "queue_delay_ms_total": 0.0,
+            "queue_delay_ms_max": 0.0
+        }
+
+    async def submit(self, item, owner=None):
+        """
+        Queue one item for the next batch and wait for its result
+
+        Args:
+            item: Passed to batch_fn
+            owner: Who the item belongs to (e.g. a session id); items without
+                an owner are each treated as belonging to someone else
+
+        Raises whatever batch_fn raised for the batch the item was in.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter(), owner))
+        if len(self._pending) >= self.max_batch:
+            self._dispatch("size_flushes")
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._dispatch, "window_flushes")
+        return await future
+
+    def _dispatch(self, reason):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Callers that gave up (e.g. a cancelled speculative turn) are left out
+        batch = [entry for entry in self._pending if not entry[1].cancelled()]
+        self._pending = []
+        if not batch:
+            return
+
+        now = time.perf_counter()
+        delays = [(now - enqueued_at) * 1000 for _, _, enqueued_at, _ in batch]
+        self.counters[reason] += 1
+        self.counters["batches"] += 1
+        self.counters["items"] += len(batch)
+        self.counters["queue_delay_ms_total"] += sum(delays)
+        self.counters["queue_delay_ms_max"] = max(self.counters["queue_delay_ms_max"], max(delays))
+        if self.log_every and self.counters["batches"] % self.log_every == 0:
+            print(f"{self.name}: {self.stats()}")
+
+        task = asyncio.create_task(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.batch_fn([item for item, _, _, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"{self.name}: batch of {len(batch)} failed: {e}")
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        shared = len({id(future) if owner is None else owner for _, future, _, owner in batch}) > 1
+        for (item, future, _, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if self.check_result is not None:
+                try:
+                    result = self.check_result(item, result, shared)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+            future.set_result(result)
+
+    def stats(self):
+        """Counters plus average batch fill (share of max_batch) and queueing delay"""
+        batches = self.counters["batches"]
+        items = self.counters["items"]
+        return {
+            **self.counters,
+            "queue_delay_ms_total": round(self.counters["queue_delay_ms_total"], 2),
+            "queue_delay_ms_max": round(self.counters["queue_delay_ms_max"], 2),
+            "avg_batch_size": round(items / batches, 2) if batches else 0.0,
+            "avg_fill": round(items / (batches * self.max_batch), 3) if batches else 0.0,
+            "avg_queue_delay_ms": round(self.counters["queue_delay_ms_total"] / items, 2) if items else 0.0
+        }
@@ -0,0 +1,117 @@
+"""
+Copy existing chat_history rows into the per-message table.
+
+Usage (from the repository root):
+    python -m shared.migrate_history --create-table
+    python -m shared.migrate_history --dry-run
+    python -m shared.migrate_history --strip-history --legacy-readers-retired   # also drop the blob
+
+Stripping removes `history` from the rows, which the HF Space app
+(old/HF_deployment, old/base_gradio/gradio_app_HFspace_v1.py) and any
+other reader of the blob still index directly; they fail with a KeyError
+on stripped rows. --strip-history is refused unless
+--legacy-readers-retired confirms none of them reads the source table.
+
+Each row's `history` (JSON, compressed or chunked; see
+shared/history_codec.py) is split into one item per message (see
+shared/message_store.py). Re-running is safe: items are keyed by
+session and sequence number, so they are overwritten, not duplicated.
+"""
+import argparse
+import os
+
+import boto3
+from dotenv import load_dotenv
+
+from shared.history_codec import CHUNK_TABLE_NAME, HISTORY_ATTRIBUTES, HistoryCodec, has_history
+from shared.message_store import MESSAGE_TABLE_NAME, MessageStore, create_message_table, message_sort_key
+
+
+def scan_rows(table):
+    """All rows of the source table, following pagination"""
+    scan = {}
+    while True:
+        response = table.scan(**scan)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        scan["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def migrate(source, target, dry_run=False, strip_history=False, chunk_table=None):
+    store = MessageStore(target)
+    codec = HistoryCodec(chunk_table)
+    sessions = messages = skipped = 0
+    for row in scan_rows(source):
+        if not has_history(row):
+            skipped += 1
+            continue
+        try:
+            history = codec.read(row)
+        except (TypeError, ValueError, OSError, EOFError) as e:
+            print(f"Skipping {row['user_id']}/{row['session_id']}: unreadable history ({e})")
+            skipped += 1
+            continue
+
+        # Messages that are not objects cannot be stored as items; seq numbers
+        # and the count cover only the messages actually written
+        valid = [msg for msg in history if isinstance(msg, dict)]
+        if len(valid) < len(history):
+            print(f"{row['user_id']}/{row['session_id']}: dropping {len(history) - len(valid)} malformed message(s)")
+        sessions += 1
+        messages += len(valid)
+        if dry_run:
+            continue
+
+        items = [store._make_item(row["user_id"], row["session_id"], seq, msg) for seq, msg in enumerate(valid)]
+        # Seqs past the end may exist from an earlier run that left gaps
+        stale = [
+            {"user_id": row["user_id"], "session_id": message_sort_key(row["session_id"], seq)}
+            for seq in range(len(valid), len(history))
+        ]
+        store._write_batch(items, stale)
+        if strip_history:
+            source.update_item(
+                Key={"user_id": row["user_id"], "session_id": row["session_id"]},
+                UpdateExpression=f"REMOVE {', '.join(('history',) + HISTORY_ATTRIBUTES)} "
+                                 "SET message_count = :n, storage_mode = :m",
+                ExpressionAttributeValues={":n": len(items), ":m": "messages"}
+            )
+
+    action = "Would migrate" if dry_run else "Migrated"
+    print(f"{action} {messages} messages from {sessions} sessions ({skipped} rows skipped)")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", default="chat_history", help="Table with history blobs")
+    parser.add_argument("--target", default=MESSAGE_TABLE_NAME, help="Per-message table")
+    parser.add_argument("--chunk-table", default=CHUNK_TABLE_NAME, help="Chunks of oversized histories")
+    parser.add_argument("--region", default=os.getenv("AWS_REGION"))
+    parser.add_argument("--create-table", action="store_true", help="Create the target table first")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be copied")
+    parser.add_argument("--strip-history", action="store_true",
+                        help="Remove the blob after copying; rows then break the HF Space app and other "
+                             "readers that index row['history'] (needs --legacy-readers-retired)")
+    parser.add_argument("--legacy-readers-retired", action="store_true",
+                        help="Confirm no reader of the history blob uses the source table any more")
+    args = parser.parse_args()
+    if args.strip_history and not args.legacy_readers_retired:
+        parser.error("--strip-history removes `history`, which the HF Space app still reads; "
+                     "retire those readers and pass --legacy-readers-retired")
+
+    dynamodb_resource = boto3.Session(region_name=args.region).resource("dynamodb")
+    if args.create_table:
+        create_message_table(dynamodb_resource, args.target)
+    migrate(
+        dynamodb_resource.Table(args.source),
+        dynamodb_resource.Table(args.target),
+        dry_run=args.dry_run,
+        strip_history=args.strip_history,
+        chunk_table=dynamodb_resource.Table(args.chunk_table)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import asyncio
+import importlib.util
+import os
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+load_dotenv()
+
+# Connection pool tuning; override through the environment if needed
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+REQUEST_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]")
+USE_HTTP2 = os.getenv("OPENAI_HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+
+# {(api_key, event loop): AsyncOpenAI}; httpx clients must stay on the loop that created them
+_clients = {}
+_warmed_up = set()  # keys of _clients whose client has been warmed up
+
+
+def _build_client(api_key):
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+        http2=USE_HTTP2
+    )
+    return AsyncOpenAI(api_key=api_key, http_client=http_client)
+
+
+def get_async_client(api_key=None):
+    """
+    Return the shared pooled AsyncOpenAI client for the running event loop
+
+    Must be called from a coroutine. Every app calling this on the same loop
+    reuses one connection pool, so there is one TLS handshake per connection
+    instead of one per message.
+
+    Args:
+        api_key (str): API key to use (defaults to OPENAI_API_KEY)
+
+    Returns:
+        AsyncOpenAI: The shared client
+    """
+    key = _client_key(api_key)
+    client = _clients.get(key)
+    if client is None:
+        # Drop clients whose event loop has gone away
+        for stale in [k for k in _clients if k[1].is_closed()]:
+            del _clients[stale]
+            _warmed_up.discard(stale)
+        client = _clients[key] = _build_client(key[0])
+    return client
+
+
+def _client_key(api_key=None):
+    return (api_key or os.getenv("OPENAI_API_KEY"), asyncio.get_running_loop())
+
+
+async def warm_up(api_key=None):
+    """
+    Open a pooled connection ahead of the first user message
+
+    Meant as a startup hook (e.g. ``demo.load(warm_up)``). Only the first
+    call per client does any work; failures are logged and ignored.
+    """
+    client = get_async_client(api_key)
+    key = _client_key(api_key)
+    if key in _warmed_up:
+        return
+    _warmed_up.add(key)
+    try:
+        await client.models.list()
+        print(f"OpenAI client warmed up (http2={USE_HTTP2})")
+    except Exception as e:
+        print(f"OpenAI warm-up failed: {e}")
+
+
+async def close_clients():
+    """Close every pooled client on the running event loop"""
+    loop = asyncio.get_running_loop()
+    for key in [k for k in _clients if k[1] is loop]:
+        client = _clients.pop(key)
+        _warmed_up.discard(key)
+        await client.close()
+
+
+def close_clients_threadsafe(timeout=5.0):
+    """
+    close_clients() on every event loop holding pooled clients, from another
+    thread (e.g. the main thread on Ctrl+C, while the server's loop still runs)
+    """
+    for loop in {key[1] for key in _clients}:
+        if loop.is_closed() or not loop.is_running():
+            continue
+        try:
+            asyncio.run_coroutine_threadsafe(close_clients(), loop).result(timeout)
+        except Exception as e:
+            print(f"Closing OpenAI clients failed: {e}")
@@ -0,0 +1,146 @@
+"""
+Persisted per-message sensitivity results.
+
+Create the table once (from the repository root):
+    python -m shared.sensitivity_store --create-table
+"""
+import argparse
+import hashlib
+import os
+from datetime import datetime, timezone
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from dotenv import load_dotenv
+
+from shared.storage_pool import run_storage
+
+SENSITIVITY_TABLE_NAME = os.getenv("SENSITIVITY_TABLE", "chat_sensitivity")
+
+
+def detector_version(model, prompt_version):
+    """Version tag of a detector; results from any other version are ignored"""
+    return f"{model}:{prompt_version}"
+
+
+def message_key(session_id, content):
+    """Stable key of a message: its session plus a hash of its text"""
+    digest = hashlib.sha256(content.encode()).hexdigest()[:32]
+    return f"{session_id}#{digest}"
+
+
+class SensitivityStore:
+    """
+    Detection results stored per user message, per detector version.
+
+    Items are keyed by user_id (partition) and "<version>#<message key>"
+    (sort key), so all of a user's results for the current detector come
+    back from one Query, and changing the model or prompt starts a fresh
+    set instead of serving stale classifications.
+    """
+
+    def __init__(self, table):
+        """
+        Args:
+            table: boto3 DynamoDB Table keyed on user_id / result_key
+        """
+        self.table = table
+
+    def _query_version(self, user_id, version):
+        items = []
+        query = {
+            "KeyConditionExpression": Key("user_id").eq(user_id) & Key("result_key").begins_with(f"{version}#")
+        }
+        while True:
+            response = self.table.query(**query)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    async def load(self, user_id, version):
+        """
+        Stored results of a user for one detector version
+
+        Returns:
+            dict: {message key: {"level", "items", "reason"}}
+        """
+        items = await run_storage(self.table, self._query_version, user_id, version)
+        prefix = len(version) + 1
+        return {
+            item["result_key"][prefix:]: {
+                "level": item["level"],
+                "items": list(item.get("items", [])),
+                "reason": item.get("reason", "")
+            }
+            for item in items
+        }
+
+    def _write(self, items):
+        with self.table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
+    async def save(self, user_id, version, results):
+        """
+        Store detection results
+
+        Args:
+            user_id (str): Owner of the messages
+            version (str): Detector version (see detector_version)
+            results (dict): {message key: detection dict}
+        """
+        if not results:
+            return
+        analyzed_at = datetime.now(timezone.utc).isoformat()
+        items = [
+            {
+                "user_id": user_id,
+                "result_key": f"{version}#{key}",
+                "version": version,
+                "level": detection["level"],
+                "items": detection.get("items", []),
+                "reason": detection.get("reason", ""),
+                "analyzed_at": analyzed_at
+            }
+            for key, detection in results.items()
+        ]
+        await run_storage(self.table, self._write, items)
+
+
+def create_sensitivity_table(dynamodb_resource, table_name=SENSITIVITY_TABLE_NAME):
+    """Create the results table (on-demand billing) and wait until it exists"""
+    table = dynamodb_resource.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {"AttributeName": "user_id", "KeyType": "HASH"},
+            {"AttributeName": "result_key", "KeyType": "RANGE"}
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "user_id", "AttributeType": "S"},
+            {"AttributeName": "result_key", "AttributeType": "S"}
+        ],
+        BillingMode="PAY_PER_REQUEST"
+    )
+    table.wait_until_exists()
+    return table
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Manage the sensitivity results table")
+    parser.add_argument("--create-table", action="store_true", help="Create the table")
+    parser.add_argument("--table", default=SENSITIVITY_TABLE_NAME)
+    parser.add_argument("--region", default=os.getenv("AWS_REGION"))
+    args = parser.parse_args()
+
+    if args.create_table:
+        dynamodb_resource = boto3.Session(region_name=args.region).resource("dynamodb")
+        create_sensitivity_table(dynamodb_resource, args.table)
+        print(f"Created table {args.table}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
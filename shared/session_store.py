@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from shared import json_codec
+
+# Unset: per-process memory. "redis://host:6379/0": a shared Redis server.
+# "fakeredis://": an in-process Redis stand-in (tests and local runs).
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "")
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(2 * 3600)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+
+
+class SessionStore:
+    """
+    Dict-like per-session state with size and TTL eviction.
+
+    Values must be JSON-serializable; they are stored serialized, so what
+    get() returns is always a copy and every backend behaves the same.
+    Reads and writes refresh an entry's TTL (sliding expiry). When the store
+    is full the least recently used entry is evicted. State the user chose
+    to keep is created with maxsize=None and ttl=None, so it is never
+    evicted.
+    """
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+
+_MISSING = object()
+
+
+class MemorySessionStore(SessionStore):
+    """In-process backend: an LRU OrderedDict with per-entry expiry"""
+
+    def __init__(self, namespace, maxsize=SESSION_MAX_ENTRIES, ttl=SESSION_TTL, max_bytes=None):
+        """
+        Args:
+            namespace (str): Name used in stats and log lines
+            maxsize (int): Maximum number of entries (None = unbounded)
+            ttl (float): Seconds of inactivity before an entry expires (None = never)
+            max_bytes (int): Optional cap on the total serialized size
+        """
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # {key: (expires_at, serialized, size in bytes)}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"evictions": 0, "expired": 0}
+
+    def _expires_at(self):
+        return time.time() + self.ttl if self.ttl is not None else None
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _purge_expired(self):
+        # With one sliding TTL, LRU order is expiry order: stop at the first live entry
+        now = time.time()
+        while self._entries:
+            key, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at is None or expires_at > now:
+                return
+            self._remove(key)
+            self.counters["expired"] += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, data, size = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                self.counters["expired"] += 1
+                return default
+            self._entries[key] = (self._expires_at(), data, size)
+            self._entries.move_to_end(key)
+            return json_codec.loads(data)
+
+    def set(self, key, value):
+        data = json_codec.dumps(value)
+        size = len(data.encode("utf-8"))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._expires_at(), data, size)
+            self._bytes += size
+            self._purge_expired()
+            while self._entries and (
+                (self.maxsize is not None and len(self._entries) > self.maxsize)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1)
+            ):
+                self._remove(next(iter(self._entries)))
+                self.counters["evictions"] += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._remove(key)
+            expires_at, data, _ = entry
+            if expires_at is not None and expires_at <= time.time():
+                self.counters["expired"] += 1
+                return default
+            return json_codec.loads(data)
+
+    def items(self):
+        with self._lock:
+            self._purge_expired()
+            return [(key, json_codec.loads(data)) for key, (_, data, _) in self._entries.items()]
+
+    def stats(self):
+        """Entry count, serialized bytes and eviction counters"""
+        with self._lock:
+            self._purge_expired()
+            return {"backend": "memory", "namespace": self.namespace,
+                    "entries": len(self._entries), "bytes": self._bytes, **self.counters}
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Shared backend on a Redis server (or fakeredis), so several worker
+    processes can serve the same session.
+
+    Each entry is a string key with a TTL; a sorted set of last-access
+    times per namespace drives LRU eviction once maxsize is exceeded.
+    """
+
+    def __init__(self, client, namespace, maxsize=SESSION_MAX_ENTRIES, ttl=SESSION_TTL):
+        """
+        Args:
+            client: redis.Redis-compatible client
+            namespace (str): Key prefix separating stores on one server
+            maxsize (int): Maximum number of entries (None = unbounded)
+            ttl (float): Seconds of inactivity before an entry expires (None = never)
+        """
+        self.client = client
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._index = f"session:{namespace}:lru"
+        self.counters = {"evictions": 0}
+
+    def _key(self, key):
+        return f"session:{self.namespace}:{key}"
+
+    def _touch(self, pipe, key):
+        pipe.zadd(self._index, {key: time.time()})
+        if self.ttl is not None:
+            pipe.pexpire(self._key(key), int(self.ttl * 1000))
+
+    def get(self, key, default=None):
+        data = self.client.get(self._key(key))
+        if data is None:
+            self.client.zrem(self._index, key)
+            return default
+        pipe = self.client.pipeline()
+        self._touch(pipe, key)
+        pipe.execute()
+        return json_codec.loads(data)
+
+    def set(self, key, value):
+        pipe = self.client.pipeline()
+        pipe.set(self._key(key), json_codec.dumps(value))
+        self._touch(pipe, key)
+        pipe.zcard(self._index)
+        size = pipe.execute()[-1]
+        if self.maxsize is not None and size > self.maxsize:
+            oldest = self.client.zpopmin(self._index, size - self.maxsize)
+            if oldest:
+                self.client.delete(*[self._key(_decode(k)) for k, _ in oldest])
+                self.counters["evictions"] += len(oldest)
+
+    def pop(self, key, default=None):
+        pipe = self.client.pipeline()
+        pipe.get(self._key(key))
+        pipe.delete(self._key(key))
+        pipe.zrem(self._index, key)
+        data = pipe.execute()[0]
+        return json_codec.loads(data) if data is not None else default
+
+    def items(self):
+        keys = [_decode(k) for k in self.client.zrange(self._index, 0, -1)]
+        if not keys:
+            return []
+        values = self.client.mget([self._key(k) for k in keys])
+        expired = [k for k, data in zip(keys, values) if data is None]
+        if expired:
+            self.client.zrem(self._index, *expired)
+        return [(k, json_codec.loads(data)) for k, data in zip(keys, values) if data is not None]
+
+    def stats(self):
+        """Entry count, serialized bytes and eviction counters"""
+        keys = [self._key(_decode(k)) for k in self.client.zrange(self._index, 0, -1)]
+        pipe = self.client.pipeline()
+        for key in keys:
+            pipe.strlen(key)
+        sizes = pipe.execute() if keys else []
+        return {"backend": "redis", "namespace": self.namespace,
+                "entries": sum(1 for size in sizes if size), "bytes": sum(sizes), **self.counters}
+
+
+def _decode(member):
+    return member.decode() if isinstance(member, bytes) else member
+
+
+_fake_server = None
+
+
+def _redis_client(url):
+    global _fake_server
+    if url.startswith("fakeredis://"):
+        import fakeredis
+        # One fake server per process, shared by every store
+        if _fake_server is None:
+            _fake_server = fakeredis.FakeServer()
+        return fakeredis.FakeRedis(server=_fake_server)
+    import redis
+    return redis.Redis.from_url(url)
+
+
+def create_session_store(namespace, maxsize=SESSION_MAX_ENTRIES, ttl=SESSION_TTL, url=None):
+    """
+    Session store for `namespace`, on the backend chosen by SESSION_STORE_URL
+
+    Args:
+        namespace (str): Name of the store (also the Redis key prefix)
+        maxsize (int): Maximum number of entries (None = unbounded)
+        ttl (float): Seconds of inactivity before an entry expires (None = never)
+        url (str): Overrides SESSION_STORE_URL
+
+    Returns:
+        SessionStore: The store
+    """
+    url = SESSION_STORE_URL if url is None else url
+    if not url:
+        return MemorySessionStore(namespace, maxsize=maxsize, ttl=ttl)
+    return RedisSessionStore(_redis_client(url), namespace, maxsize=maxsize, ttl=ttl)
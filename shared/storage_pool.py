@@ -0,0 +1,257 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+# Sized for DynamoDB alone, so storage never waits behind other blocking work
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", "16"))
+# Each worker thread makes one call at a time, so one pooled connection each
+STORAGE_MAX_POOL_CONNECTIONS = int(os.getenv("STORAGE_MAX_POOL_CONNECTIONS", "1"))
+STORAGE_CONNECT_TIMEOUT = float(os.getenv("STORAGE_CONNECT_TIMEOUT", "3"))
+STORAGE_READ_TIMEOUT = float(os.getenv("STORAGE_READ_TIMEOUT", "10"))
+
+# {region: StoragePool}
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class LatencyStats:
+    """Count, mean, max and percentiles over the most recent samples"""
+
+    def __init__(self, window=1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.recent.append(ms)
+
+    def summary(self):
+        ordered = sorted(self.recent)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 2) if ordered else 0.0
+
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count, 2) if self.count else 0.0,
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "max_ms": round(self.max, 2)
+        }
+
+
+class StorageTable:
+    """
+    Stand-in for a boto3 Table that resolves to the calling thread's own Table.
+
+    boto3 resources are not thread-safe. Table methods (put_item, query,
+    batch_writer, ...) are looked up on a Table of the thread that *calls*
+    them, so `pool.run(table.put_item, Item=...)` runs on the worker's own
+    resource and code written against a plain Table works unchanged.
+    Other attributes (meta, key_schema, ...) are plain values read from the
+    accessing thread's Table.
+    """
+
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+
+    def __getattr__(self, attr):
+        value = getattr(self.pool.thread_table(self.name), attr)
+        if not callable(value):
+            return value
+
+        def method(*args, **kwargs):
+            return getattr(self.pool.thread_table(self.name), attr)(*args, **kwargs)
+        method.__name__ = attr
+        return method
+
+    def __repr__(self):
+        return f"StorageTable({self.name!r})"
+
+
+class StoragePool:
+    """
+    Dedicated executor for blocking DynamoDB calls.
+
+    Storage gets its own `workers` threads instead of sharing asyncio's
+    default pool with every other to_thread() call, and each thread keeps
+    its own boto3 session and resource (with tuned connection pool size and
+    timeouts). Time spent waiting for a free worker and time spent in the
+    call itself are measured separately, so a saturated pool is told apart
+    from a slow DynamoDB.
+    """
+
+    def __init__(self, region_name=None, workers=STORAGE_WORKERS, max_pool_connections=STORAGE_MAX_POOL_CONNECTIONS,
+                 connect_timeout=STORAGE_CONNECT_TIMEOUT, read_timeout=STORAGE_READ_TIMEOUT, name="storage"):
+        """
+        Args:
+            region_name (str): AWS region (default: AWS_REGION)
+            workers (int): Worker threads
+            max_pool_connections (int): HTTP connections per thread's client
+            connect_timeout (float): Seconds to open a connection
+            read_timeout (float): Seconds to wait for a response
+            name (str): Thread name prefix
+        """
+        self.region_name = region_name or os.getenv("AWS_REGION")
+        self.workers = workers
+        self.name = name
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries={"mode": "standard", "max_attempts": 3}
+        )
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.running = 0
+        self.queued = 0
+        self.counters = {
+            "calls": 0,
+            "errors": 0,
+            "max_queued": 0,
+            "resources": 0
+        }
+        self.queue_wait = LatencyStats()
+        self.call_latency = LatencyStats()
+        self.by_operation = {}  # {name: LatencyStats} of call latency
+
+    def thread_resource(self):
+        """The calling thread's DynamoDB resource, created on first use"""
+        resource = getattr(self._local, "resource", None)
+        if resource is None:
+            session = boto3.session.Session(region_name=self.region_name)
+            resource = self._local.resource = session.resource("dynamodb", config=self.config)
+            self._local.tables = {}
+            with self._lock:
+                self.counters["resources"] += 1
+        return resource
+
+    def thread_table(self, name):
+        """The calling thread's Table object for a table name"""
+        resource = self.thread_resource()
+        table = self._local.tables.get(name)
+        if table is None:
+            table = self._local.tables[name] = resource.Table(name)
+        return table
+
+    def table(self, name):
+        """
+        A Table to hand to stores and apps
+
+        Returns:
+            StorageTable: Proxy resolving to the calling thread's Table
+        """
+        return StorageTable(self, name)
+
+    def _dequeue(self, ticket):
+        # Exactly once per call: when a worker picks it up, or when it is cancelled first
+        with self._lock:
+            if ticket[0]:
+                return
+            ticket[0] = True
+            self.queued -= 1
+
+    def _call(self, ticket, fn, args, kwargs):
+        started = time.perf_counter()
+        self._dequeue(ticket)
+        with self._lock:
+            self.running += 1
+        try:
+            return fn(*args, **kwargs), started, time.perf_counter(), None
+        except Exception as e:
+            return None, started, time.perf_counter(), e
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run a blocking storage call on the pool and await its result
+
+        Args:
+            fn: callable, e.g. table.put_item or a method doing several calls
+            *args, **kwargs: Passed to fn
+
+        Returns:
+            Whatever fn returns; its exceptions are re-raised here
+        """
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+            self.counters["max_queued"] = max(self.counters["max_queued"], self.queued)
+        ticket = [False]
+        loop = asyncio.get_running_loop()
+        try:
+            result, started, finished, error = await loop.run_in_executor(
+                self._executor, self._call, ticket, fn, args, kwargs
+            )
+        except asyncio.CancelledError:
+            self._dequeue(ticket)
+            raise
+        call_ms = (finished - started) * 1000
+        operation = getattr(fn, "__name__", "call")
+        with self._lock:
+            self.counters["calls"] += 1
+            self.queue_wait.add((started - submitted) * 1000)
+            self.call_latency.add(call_ms)
+            self.by_operation.setdefault(operation, LatencyStats(window=200)).add(call_ms)
+            if error is not None:
+                self.counters["errors"] += 1
+        if error is not None:
+            raise error
+        return result
+
+    def stats(self):
+        """Pool occupancy, queue wait and call latency (overall and per operation)"""
+        with self._lock:
+            return {
+                **self.counters,
+                "workers": self.workers,
+                "running": self.running,
+                "queued": self.queued,
+                "queue_wait": self.queue_wait.summary(),
+                "call": self.call_latency.summary(),
+                "operations": {name: stats.summary() for name, stats in self.by_operation.items()}
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def get_storage_pool(region_name=None):
+    """
+    The process-wide StoragePool for a region (default: AWS_REGION)
+
+    Every app and store in the process shares it, so the storage thread
+    budget is set in one place.
+    """
+    region_name = region_name or os.getenv("AWS_REGION")
+    with _pools_lock:
+        pool = _pools.get(region_name)
+        if pool is None:
+            pool = _pools[region_name] = StoragePool(region_name)
+        return pool
+
+
+def run_storage(table, fn, *args, **kwargs):
+    """
+    Awaitable running blocking work against `table` off the event loop
+
+    Uses the table's StoragePool when it is a StorageTable, and asyncio's
+    default executor for a plain boto3 Table (scripts, tests).
+    """
+    if isinstance(table, StorageTable):
+        return table.pool.run(fn, *args, **kwargs)
+    return asyncio.to_thread(fn, *args, **kwargs)
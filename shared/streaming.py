@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from shared.openai_pool import get_async_client
+
+
+async def stream_completion(messages, model, temperature=0.7, label="reply"):
+    """
+    Stream a chat completion, yielding the reply accumulated so far
+
+    Time to first token and total time are logged once per call.
+
+    Args:
+        messages (list): Chat messages for the API
+        model (str): Model name
+        temperature (float): Sampling temperature
+        label (str): Name used in the timing log line
+
+    Yields:
+        str: The reply text received so far
+    """
+    started = time.perf_counter()
+    first_token_ms = None
+    parts = []
+    stream = await get_async_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True
+    )
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if first_token_ms is None:
+            first_token_ms = (time.perf_counter() - started) * 1000
+        parts.append(delta)
+        yield "".join(parts)
+
+    total_ms = (time.perf_counter() - started) * 1000
+    ttft = f"{first_token_ms:.0f} ms" if first_token_ms is not None else "n/a"
+    print(f"⏱️ {label}: time to first token {ttft}, total {total_ms:.0f} ms")
+
+
+class BufferedStream:
+    """
+    Consume a reply stream in the background and replay it on demand
+
+    Lets a reply start streaming before the caller knows whether it will be
+    shown (speculative replies); cancel() drops it, iterating yields the
+    text received so far and then every update until the stream ends.
+    """
+
+    def __init__(self, stream):
+        self.text = ""
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._consume(stream))
+
+    async def _consume(self, stream):
+        try:
+            async for partial in stream:
+                self.text = partial
+                self._changed.set()
+        finally:
+            self._changed.set()
+
+    def cancel(self):
+        """Cancel the stream and discard its outcome"""
+        if self.task.done():
+            # Retrieve the exception (if any) so asyncio doesn't log it as unhandled
+            if not self.task.cancelled():
+                self.task.exception()
+        else:
+            self.task.cancel()
+
+    async def __aiter__(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            if self.task.done():
+                break
+            yield self.text
+        # Re-raises any error from the stream
+        await self.task
+        yield self.text
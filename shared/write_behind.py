@@ -0,0 +1,317 @@
+import asyncio
+import os
+import time
+
+from shared.history_codec import HistoryCodec
+from shared.message_model import encode_history
+from shared.message_store import STORAGE_MODE
+from shared.storage_pool import run_storage
+
+# Seconds between flushes; a session's row is at most this stale in DynamoDB
+FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "1.0"))
+DRAIN_TIMEOUT = float(os.getenv("WRITE_BEHIND_DRAIN_TIMEOUT", "30"))
+
+
+class WriteBehindWriter:
+    """
+    Write-behind persistence of chat_history rows.
+
+    submit() records the latest state of a session and returns at once, so
+    a reply never waits on DynamoDB. Pending writes are keyed by
+    (user_id, session_id): a state submitted before the previous one was
+    flushed replaces it, so rapid turns cost one write of the newest
+    history. A background task flushes every `flush_interval` seconds
+    (sooner once `max_pending` sessions are waiting) through one
+    batch_writer; rows whose write failed are retried with exponential
+    backoff unless a newer state replaced them meanwhile. drain() writes
+    everything still pending before shutdown.
+
+    The history is serialized and packed by `history_codec` (or, in
+    "messages" storage mode, synced through the MessageStore) at flush
+    time, so coalesced states are never encoded at all.
+    """
+
+    def __init__(self, table, message_store=None, history_codec=None, flush_interval=FLUSH_INTERVAL,
+                 max_pending=500, max_attempts=5, retry_delay=1.0, storage_mode=STORAGE_MODE,
+                 name="write-behind"):
+        """
+        Args:
+            table: boto3 DynamoDB Table with user_id / session_id keys
+            message_store: MessageStore used when storage_mode is "messages"
+            history_codec: HistoryCodec storing the history blob (default: CHAT_HISTORY_CODEC, no chunking)
+            flush_interval (float): Seconds between flushes
+            max_pending (int): Pending sessions that trigger an early flush
+            max_attempts (int): Attempts per row before it is dropped
+            retry_delay (float): Seconds before the first retry (doubles each time)
+            storage_mode (str): "blob" or "messages" (see shared/message_store.py)
+            name (str): Name used in log lines
+        """
+        self.table = table
+        self.message_store = message_store
+        self.history_codec = history_codec or HistoryCodec()
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.storage_mode = storage_mode
+        self.name = name
+        self.loop = None
+        self._task = None
+        self._wake = None
+        self._flush_lock = None
+        self._pending = {}  # {(user_id, session_id): [item, history, attempt, not_before, since]}
+        self._accepting = True
+        self.in_flight = 0
+        self.counters = {
+            "submitted": 0,
+            "coalesced": 0,
+            "written": 0,
+            "flushes": 0,
+            "retried": 0,
+            "failed": 0,
+            "rejected": 0,
+            "max_depth": 0
+        }
+        self.flush_ms = {
+            "last": 0.0,
+            "max": 0.0,
+            "total": 0.0
+        }
+
+    def _start(self):
+        self.loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        # One flush at a time, so an older state never lands after a newer one
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run(), name=f"{self.name}-flusher")
+
+    def submit(self, item, history=None):
+        """
+        Queue a session's row without waiting; must be called on the event loop
+
+        Args:
+            item (dict): chat_history row without the history itself
+            history (list): Messages (Message objects or dicts) to store with it
+
+        Returns:
+            bool: False if the writer is shutting down and the row was refused
+        """
+        if not self._accepting:
+            self.counters["rejected"] += 1
+            print(f"⚠️ {self.name}: shutting down, row for session {item['session_id']} not saved")
+            return False
+        if self._task is None or self._task.done():
+            self._start()
+        self.counters["submitted"] += 1
+
+        key = (item["user_id"], item["session_id"])
+        previous = self._pending.get(key)
+        # Snapshot the list: the caller keeps appending to it
+        history = list(history) if history is not None else None
+        if previous is not None:
+            self.counters["coalesced"] += 1
+            # Keep the oldest unsaved time so staleness is measured from the first turn
+            self._pending[key] = [item, history, 1, 0.0, previous[4]]
+        else:
+            self._pending[key] = [item, history, 1, 0.0, time.monotonic()]
+            depth = len(self._pending)
+            self.counters["max_depth"] = max(self.counters["max_depth"], depth)
+            if depth >= self.max_pending:
+                self._wake.set()
+        return True
+
+    async def _run(self):
+        while self._accepting:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self._accepting:
+                return
+            try:
+                await self.flush()
+            except Exception as e:
+                # flush() handles write errors itself; never let the flusher die
+                print(f"❌ {self.name}: flush failed: {e}")
+
+    async def flush(self, force=False):
+        """
+        Write every pending row that is due
+
+        Also useful before reading chat_history back, to see the latest turns.
+
+        Args:
+            force (bool): Also write rows still waiting out a retry backoff
+
+        Returns:
+            int: Rows written
+        """
+        if self._flush_lock is None:
+            return 0
+        async with self._flush_lock:
+            return await self._flush(force)
+
+    async def _flush(self, force):
+        now = time.monotonic()
+        due = {key: entry for key, entry in self._pending.items() if force or entry[3] <= now}
+        if not due:
+            return 0
+        for key in due:
+            del self._pending[key]
+
+        start = time.perf_counter()
+        written = 0
+        self.in_flight += len(due)
+        try:
+            rows, errors = await self._prepare(due)
+            if rows:
+                try:
+                    written, failed = await run_storage(self.table, self._write_rows, rows)
+                    errors.update(failed)
+                except Exception as e:
+                    errors.update((key, e) for key in rows)
+        finally:
+            self.in_flight -= len(due)
+
+        elapsed = (time.perf_counter() - start) * 1000
+        self.counters["flushes"] += 1
+        self.counters["written"] += written
+        self.flush_ms["last"] = elapsed
+        self.flush_ms["max"] = max(self.flush_ms["max"], elapsed)
+        self.flush_ms["total"] += elapsed
+        for key, error in errors.items():
+            self._retry(key, due[key], error)
+        if written:
+            print(f"✅ {self.name}: saved {written} session(s) in {elapsed:.0f} ms")
+        return written
+
+    async def _prepare(self, due):
+        """
+        (row, history JSON) per session; in messages mode sync the message items first
+
+        The history is encoded here, on the event loop, because the Message
+        objects may still change; compression happens in the writer thread.
+        """
+        rows, errors = {}, {}
+        if self.storage_mode == "messages":
+            keys = list(due)
+            results = await asyncio.gather(
+                *(self.message_store.sync_history(*key, due[key][1]) for key in keys if due[key][1] is not None),
+                return_exceptions=True
+            )
+            results = iter(results)
+            for key in keys:
+                item, history = due[key][0], due[key][1]
+                if history is not None:
+                    result = next(results)
+                    if isinstance(result, Exception):
+                        errors[key] = result
+                        continue
+                    # Only the new messages are written; the row keeps session metadata
+                    item = {**item, "message_count": len(history), "storage_mode": "messages"}
+                rows[key] = (item, None)
+        else:
+            for key, (item, history, *_) in due.items():
+                rows[key] = (item, encode_history(history) if history is not None else None)
+        return rows, errors
+
+    def _write_rows(self, rows):
+        """
+        Pack and write rows, chunks of oversized histories first
+
+        Returns:
+            tuple: (rows written, {key: error} for rows that could not be packed)
+        """
+        items, chunks, errors = [], [], {}
+        for key, (item, history_json) in rows.items():
+            if history_json is None:
+                items.append(item)
+                continue
+            try:
+                row, row_chunks = self.history_codec.pack(item, history_json)
+            except ValueError as e:
+                errors[key] = e
+                continue
+            items.append(row)
+            chunks.extend(row_chunks)
+        if not items:
+            return 0, errors
+
+        self.history_codec.write_chunks(chunks)
+        if len(items) == 1:
+            self.table.put_item(Item=items[0])
+        else:
+            with self.table.batch_writer(overwrite_by_pkeys=["user_id", "session_id"]) as batch:
+                for item in items:
+                    batch.put_item(Item=item)
+        for item in items:
+            try:
+                self.history_codec.prune(item)
+            except Exception as e:
+                # The rows are saved; leftover chunks only cost storage
+                print(f"⚠️ {self.name}: could not prune old chunks of session {item['session_id']}: {e}")
+        return len(items), errors
+
+    def _retry(self, key, entry, error):
+        if key in self._pending:
+            # A newer state arrived while this one was being written; it wins
+            self.counters["coalesced"] += 1
+            return
+        attempt = entry[2]
+        if attempt >= self.max_attempts:
+            self.counters["failed"] += 1
+            print(f"❌ {self.name}: giving up on session {key[1]} after {attempt} attempts: {error}")
+            return
+        self.counters["retried"] += 1
+        entry[2] = attempt + 1
+        entry[3] = time.monotonic() + self.retry_delay * 2 ** (attempt - 1)
+        self._pending[key] = entry
+
+    def stats(self):
+        """Queue depth, staleness and flush latency plus lifetime counters"""
+        now = time.monotonic()
+        flushes = self.counters["flushes"]
+        return {
+            **self.counters,
+            "depth": len(self._pending),
+            "in_flight": self.in_flight,
+            "oldest_pending_s": round(max((now - entry[4] for entry in self._pending.values()), default=0.0), 3),
+            "last_flush_ms": round(self.flush_ms["last"], 1),
+            "avg_flush_ms": round(self.flush_ms["total"] / flushes, 1) if flushes else 0.0,
+            "max_flush_ms": round(self.flush_ms["max"], 1)
+        }
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        """
+        Stop accepting rows and write everything still pending
+
+        Retries skip their backoff; rows still failing after `timeout`
+        seconds are dropped.
+
+        Returns:
+            dict: Final stats
+        """
+        self._accepting = False
+        if self._task is None:
+            return self.stats()
+
+        # Let a flush in progress finish rather than cancelling it mid-write
+        self._wake.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await self.flush(force=True)
+            if self._pending:
+                await asyncio.sleep(min(self.retry_delay, max(0.0, deadline - time.monotonic())))
+        stats = self.stats()
+        print(f"{self.name} drained: {stats}")
+        return stats
+
+    def drain_threadsafe(self, timeout=DRAIN_TIMEOUT):
+        """drain() from another thread (e.g. the main thread on Ctrl+C)"""
+        if self.loop is None or self.loop.is_closed():
+            return self.stats()
+        future = asyncio.run_coroutine_threadsafe(self.drain(timeout), self.loop)
+        return future.result(timeout + 5)